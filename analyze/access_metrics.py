@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+"""
+Access pattern metrics for request tables (log2csv.py csv, Parquet datasets or traces).
+
+Every request is treated as a contiguous (offset, length) range at its start time. For reads it is the read itself.
+Positions of readv chunks are not known, only the first byte (buf_start), the total size and the distance from the first
+to the last byte (scatter): by default a readv is taken as its size bytes from buf_start, which is a lower bound of what
+it touches, with --span it is the whole [buf_start, buf_start + scatter) range, which is an upper bound (and for
+sparse readvs, a lot of blocks to expand). All requests are assumed to be for the same file.
+
+    sequential runs     requests that start where the previous one ended (or at most --gap bytes after it)
+    stride histogram    distance from the end of the previous request to the start of the next, log2 buckets
+    block reuse         for every block size: block accesses, unique blocks, and the reuse interval
+                        (block accesses since the previous access of the same block, an upper bound of LRU stack distance)
+    fetched bytes       for every block size and readahead window: bytes fetched without a cache, and with
+                        an infinite one (only the first access of every byte is fetched)
+    working set         unique bytes requested in every --window seconds, and unique bytes requested so far
+
+Everything is computed with NumPy on whole columns, block expansion is done in chunks of bounded size,
+so memory is about 100 bytes per request plus 16 bytes per unique block (or page, for the working set).
+"""
+import sys
+import json
+import argparse
+
+import numpy as np
+
+import columnar
+
+from trace_log import is_trace, load, as_columns
+
+
+DEF_BLOCK_SIZES = '4k,64k,1m,4m,8m'
+DEF_READAHEAD = '0,128k,1m,8m'
+#Block accesses expanded at once
+EXPAND_CHUNK = 4*1024*1024
+UNITS = {'k': 1024, 'm': 1024**2, 'g': 1024**3}
+
+
+def parse_size(value):
+    value = value.strip().lower()
+    if value and value[-1] in UNITS:
+        return int(float(value[:-1]) * UNITS[value[-1]])
+    return int(value)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('data', nargs='+', help="Csv, Parquet or trace files. Requests from all of them are merged.")
+    parser.add_argument('-r', '--request_type', help="Request type to take from traces. Default is readv", default='readv')
+    parser.add_argument('-b', '--block_sizes', help="Comma-separated block sizes, k/m/g suffixes allowed. Default is {0}".format(DEF_BLOCK_SIZES), default=DEF_BLOCK_SIZES)
+    parser.add_argument('-R', '--readahead', help="Comma-separated readahead windows. Default is {0}".format(DEF_READAHEAD), default=DEF_READAHEAD)
+    parser.add_argument('-s', '--span', help="Use the whole range from the first to the last byte of readvs, not their size", action='store_true')
+    parser.add_argument('-g', '--gap', help="Max gap between sequential requests, bytes. Default is 0", type=parse_size, default=0)
+    parser.add_argument('-w', '--window', help="Working set window, seconds. Default is 60", type=float, default=60)
+    parser.add_argument('-p', '--page_size', help="Granularity of cumulative unique bytes. Default is 4k", type=parse_size, default=4096)
+    parser.add_argument('-j', '--json', help="Also save metrics to this json file", default=None)
+    return parser.parse_args()
+
+
+def load_requests(paths, req_type='readv', span=False):
+    "(time, offset, length) arrays of all requests, sorted by time"
+    length_col = 'scatter' if span else 'size'
+    times, offsets, lengths = [], [], []
+    for path in paths:
+        if not columnar.is_parquet(path) and is_trace(path):
+            cols = as_columns(load(path), req_type)
+        else:
+            cols = columnar.load(path, ['start', length_col, 'buf_start'])
+        times.append(np.asarray(cols['start'], dtype=np.float64))
+        offsets.append(np.asarray(cols['buf_start'], dtype=np.int64))
+        lengths.append(np.asarray(cols[length_col], dtype=np.int64))
+    time, offset, length = np.concatenate(times), np.concatenate(offsets), np.concatenate(lengths)
+    #Requests with unknown range are written with negative offset
+    valid = offset >= 0
+    time, offset, length = time[valid], offset[valid], np.maximum(length[valid], 1)
+    order = np.argsort(time, kind='stable')
+    return time[order], offset[order], length[order]
+
+
+def log2_histogram(values, signed=False):
+    "{bucket: count}, where bucket is the smallest power of two >= |value| (with the sign of value if signed), or 0"
+    values = np.asarray(values, dtype=np.int64)
+    mag = np.abs(values)
+    buckets = np.zeros(len(values), dtype=np.int64)
+    nz = mag > 0
+    buckets[nz] = np.left_shift(1, np.ceil(np.log2(mag[nz])).astype(np.int64))
+    if signed:
+        buckets *= np.sign(values)
+    keys, counts = np.unique(buckets, return_counts=True)
+    return {int(k): int(c) for k, c in zip(keys, counts)}
+
+
+def percentiles(values, pcts=(50, 90, 99)):
+    if len(values) == 0:
+        return {}
+    return {'p{0}'.format(p): float(v) for p, v in zip(pcts, np.percentile(values, pcts))}
+
+
+def sequential_runs(offset, length, gap=0):
+    "Requests that continue the previous one, and runs of such requests"
+    if len(offset) == 0:
+        return {}
+    dist = offset[1:] - (offset[:-1] + length[:-1])
+    seq = (dist >= 0) & (dist <= gap)
+    new_run = np.concatenate( ([True], ~seq) )
+    run_id = np.cumsum(new_run) - 1
+    run_requests = np.bincount(run_id)
+    run_bytes = np.bincount(run_id, weights=length)
+    return {
+            'requests': int(len(offset)),
+            'sequential_fraction': float(seq.mean()) if len(seq) else 0.0,
+            'runs': int(len(run_requests)),
+            'run_requests': percentiles(run_requests),
+            'run_bytes': percentiles(run_bytes),
+            'run_requests_histogram': log2_histogram(run_requests),
+        }
+
+
+def stride_histogram(offset, length):
+    return log2_histogram(offset[1:] - (offset[:-1] + length[:-1]), signed=True)
+
+
+def expand_blocks(offset, length, block_size):
+    """
+    Yield (request index, block) arrays for all blocks touched by requests, in request order,
+    in chunks of about EXPAND_CHUNK blocks.
+    """
+    first = offset // block_size
+    nblocks = (offset + length - 1) // block_size - first + 1
+    bounds = np.cumsum(nblocks)
+    pos = 0
+    while pos < len(offset):
+        end = max(int(np.searchsorted(bounds, (bounds[pos - 1] if pos else 0) + EXPAND_CHUNK, side='right')), pos + 1)
+        counts = nblocks[pos:end]
+        req = np.repeat(np.arange(pos, end), counts)
+        starts = np.cumsum(counts) - counts
+        blocks = first[req] + (np.arange(len(req)) - np.repeat(starts, counts))
+        yield req, blocks
+        pos = end
+
+
+def block_reuse(time, offset, length, block_size, window=None):
+    """
+    Block accesses, unique blocks and histogram of reuse intervals for the block size.
+    If window is given, also the number of first block accesses in every window (for cumulative unique bytes).
+    """
+    #Sorted blocks seen so far and the number of their last access, ending with a sentinel larger than any block
+    seen_blocks = np.array([np.iinfo(np.int64).max])
+    seen_last = np.array([-1])
+    accesses = 0
+    reuse = {}
+    first_touch = {}
+    t0 = time[0] if len(time) else 0
+    for req, blocks in expand_blocks(offset, length, block_size):
+        acc = np.arange(accesses, accesses + len(blocks))
+        accesses += len(blocks)
+        #Previous access of the same block: inside this chunk, or from the earlier chunks
+        order = np.lexsort( (acc, blocks) )
+        sblocks, sacc = blocks[order], acc[order]
+        same = np.concatenate( ([False], sblocks[1:] == sblocks[:-1]) )
+        pos = np.searchsorted(seen_blocks, sblocks)
+        found = seen_blocks[pos] == sblocks
+        prev = np.where(same, np.concatenate( ([-1], sacc[:-1]) ), np.where(found, seen_last[pos], -1))
+
+        is_last = np.concatenate( (sblocks[1:] != sblocks[:-1], [True]) )
+        old = is_last & found
+        seen_last[pos[old]] = sacc[old]
+        new = is_last & ~found
+        seen_blocks = np.insert(seen_blocks, pos[new], sblocks[new])
+        seen_last = np.insert(seen_last, pos[new], sacc[new])
+
+        for k, c in log2_histogram(sacc[prev >= 0] - prev[prev >= 0]).items():
+            reuse[k] = reuse.get(k, 0) + c
+        if window:
+            windows = ((time[req[order][prev < 0]] - t0) // window).astype(np.int64)
+            for k, c in zip(*np.unique(windows, return_counts=True)):
+                first_touch[int(k)] = first_touch.get(int(k), 0) + int(c)
+    unique = len(seen_blocks) - 1
+    return {'accesses': int(accesses), 'unique': unique, 'reuse_interval_histogram': dict(sorted(reuse.items()))}, first_touch
+
+
+def union_bytes(start, end):
+    "Total length of the union of [start, end) intervals"
+    if len(start) == 0:
+        return 0
+    order = np.argsort(start, kind='stable')
+    start, end = start[order], end[order]
+    covered = np.concatenate( ([start[0]], np.maximum.accumulate(end)[:-1]) )
+    return int(np.maximum(end - np.maximum(start, covered), 0).sum())
+
+
+def fetched_bytes(offset, length, block_sizes, readahead):
+    "Bytes that would be fetched from the storage with whole blocks or with readahead, without and with a cache"
+    res = {'requested': int(length.sum()), 'unique': union_bytes(offset, offset + length), 'block': {}, 'readahead': {}}
+    end = offset + length
+    for bs in block_sizes:
+        first, last = offset // bs, (end - 1) // bs
+        res['block'][bs] = {'no_cache': int(((last - first + 1) * bs).sum()), 'infinite_cache': union_bytes(first * bs, (last + 1) * bs)}
+    for ra in readahead:
+        ra_end = offset + np.maximum(length, ra)
+        res['readahead'][ra] = {'no_cache': int((ra_end - offset).sum()), 'infinite_cache': union_bytes(offset, ra_end)}
+    return res
+
+
+def working_set(time, offset, length, window, page_size=4096):
+    "Unique bytes in every window, and unique bytes (rounded to pages) requested from the start up to the end of every window"
+    if len(time) == 0:
+        return []
+    win = ((time - time[0]) // window).astype(np.int64)
+    end = offset + length
+    #Shift every window to its own range of offsets, so that a single sort and cummax work for all of them
+    shift = win * (int(end.max()) + 1)
+    s, e = offset + shift, end + shift
+    order = np.argsort(s)
+    s, e, w = s[order], e[order], win[order]
+    covered = np.concatenate( ([s[0]], np.maximum.accumulate(e)[:-1]) )
+    new = np.maximum(e - np.maximum(s, covered), 0)
+    per_window = np.bincount(w, weights=new)
+
+    _, first_touch = block_reuse(time, offset, length, page_size, window)
+    cumulative = np.cumsum(np.bincount(list(first_touch.keys()), weights=list(first_touch.values()), minlength=len(per_window))) * page_size
+    return [{'start': float(time[0] + i * window), 'unique_bytes': int(per_window[i]), 'cumulative_unique_bytes': int(cumulative[i])}
+            for i in range(len(per_window)) if per_window[i] > 0]
+
+
+def analyse(time, offset, length, block_sizes, readahead, gap=0, window=60, page_size=4096):
+    res = {
+            'sequential': sequential_runs(offset, length, gap),
+            'stride_histogram': stride_histogram(offset, length),
+            'fetched_bytes': fetched_bytes(offset, length, block_sizes, readahead),
+            'block_reuse': {bs: block_reuse(time, offset, length, bs)[0] for bs in block_sizes},
+            'working_set': working_set(time, offset, length, window, page_size),
+        }
+    return res
+
+
+def print_report(res, fd=sys.stdout):
+    seq = res['sequential']
+    print("Requests: {0}, sequential: {1:.2%}, runs: {2}".format(seq['requests'], seq['sequential_fraction'], seq['runs']), file=fd)
+    print("Run length, requests: {0}; bytes: {1}".format(seq['run_requests'], seq['run_bytes']), file=fd)
+    print("\nStride histogram (bytes <= bucket):", file=fd)
+    for bucket, count in sorted(res['stride_histogram'].items()):
+        print("  {0:>16} {1:>12}".format(bucket, count), file=fd)
+
+    fetched = res['fetched_bytes']
+    print("\nRequested bytes: {0}, unique: {1}".format(fetched['requested'], fetched['unique']), file=fd)
+    print("{0:>10} {1:>10} {2:>18} {3:>18} {4:>12} {5:>12}".format('block', 'accesses', 'fetched, no cache', 'fetched, cache', 'reuse p50<=', 'reuse max<='), file=fd)
+    for bs, blk in fetched['block'].items():
+        reuse = res['block_reuse'][bs]
+        hist = reuse['reuse_interval_histogram']
+        total, seen, median = sum(hist.values()), 0, None
+        for bucket, count in hist.items():
+            seen += count
+            if median is None and seen * 2 >= total:
+                median = bucket
+        print("{0:>10} {1:>10} {2:>18} {3:>18} {4:>12} {5:>12}".format(bs, reuse['accesses'], blk['no_cache'], blk['infinite_cache'], str(median), str(max(hist) if hist else None)), file=fd)
+    print("{0:>10} {1:>18} {2:>18}".format('readahead', 'fetched, no cache', 'fetched, cache'), file=fd)
+    for ra, val in fetched['readahead'].items():
+        print("{0:>10} {1:>18} {2:>18}".format(ra, val['no_cache'], val['infinite_cache']), file=fd)
+
+    print("\nWorking set:", file=fd)
+    print("{0:>18} {1:>16} {2:>18}".format('window start', 'unique bytes', 'cumulative unique'), file=fd)
+    for row in res['working_set']:
+        print("{0:>18.3f} {1:>16} {2:>18}".format(row['start'], row['unique_bytes'], row['cumulative_unique_bytes']), file=fd)
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    time, offset, length = load_requests(args.data, args.request_type, args.span)
+    res = analyse(time, offset, length, [parse_size(v) for v in args.block_sizes.split(',')], [parse_size(v) for v in args.readahead.split(',')],
+                  gap=args.gap, window=args.window, page_size=args.page_size)
+    print_report(res)
+    if args.json:
+        with open(args.json, 'w') as fd:
+            json.dump(res, fd, indent=2)
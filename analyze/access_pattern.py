@@ -1,75 +1,138 @@
 #!/usr/bin/env python
+"""
+Plot file access pattern: every request is a horizontal segment from its first to its last byte, at its start time.
+
+Segments are not drawn one by one: they are binned into a width x height pixel grid with NumPy, counting
+how many segments cover every pixel, separately for every input file. Counts are then shaded with the colour
+of the input file (log scale) and the image is saved with imshow. Input is read in blocks, in two passes
+(bounds, then binning), so memory depends on the image size, not on the number of requests.
+"""
 import argparse
 
+import numpy as np
 import matplotlib.pyplot as plt
-import sys
 
-from matplotlib.collections import LineCollection
+from matplotlib.colors import to_rgb
+
+import columnar
+
+from trace_log import is_trace, records, as_columns
 
 DEF_OUTPUT='./plot.png'
+#Colour for every input file, in order
+COLORS = ['r', 'b', 'g', 'm', 'c', 'y', 'k']
+#Opacity of pixels covered by a single segment, so that rare requests remain visible
+MIN_ALPHA = 0.25
+
 
 def parse_args():
     parser = argparse.ArgumentParser()
-    parser.add_argument('-d', '--data', help="File(s) to process, comma-separated", required=True)
+    parser.add_argument('-d', '--data', help="Csv, Parquet or trace file(s) to process, comma-separated. For traces, readvs are taken.", required=True)
     parser.add_argument('-o', '--output', help="Output picture. Default={0}".format(DEF_OUTPUT), default=DEF_OUTPUT)
-    parser.add_argument('-f', '--fake_time', help="Do not use actual timestamps, use request's number instead.", action='store_true')
+    parser.add_argument('-f', '--fake_time', help="Do not use actual timestamps, use request's number instead. Keeps a start time (then a rank) of every request in memory, other columns are read in blocks.", action='store_true')
     parser.add_argument('-r', '--read_length', help="If given, it is assumed that all reads have this length. Usefull for plotting small reads. File with read's data is assumed to be the first one.", type=int, default=None)
+    parser.add_argument('-W', '--width', help="Image width, pixels. Default is 2000", type=int, default=2000)
+    parser.add_argument('-H', '--height', help="Image height, pixels. Default is 2000", type=int, default=2000)
+    parser.add_argument('-D', '--dpi', help="Resolution of the saved picture. Default is 300", type=int, default=300)
+    parser.add_argument('-b', '--block_rows', help="Requests read at once. Default is 1M", type=int, default=1024*1024)
     return parser.parse_args()
 
 
+def read_blocks(fname, block_rows):
+    "(time, length, offset) arrays for consecutive blocks of requests of a file. Requests with unknown range (-1) are skipped."
+    if not columnar.is_parquet(fname) and is_trace(fname):
+        recs = records(fname)
+        blocks = (as_columns(recs[pos:pos + block_rows]) for pos in range(0, len(recs), block_rows))
+    else:
+        blocks = columnar.iter_batches(fname, ['start', 'scatter', 'buf_start'], block_rows)
+    for cols in blocks:
+        known = cols['buf_start'] >= 0
+        yield cols['start'][known], cols['scatter'][known], cols['buf_start'][known]
+
+
+class Canvas:
+    "Number of segments that cover every pixel, for every source"
+    def __init__(self, width, height, x_range, y_range, nsources):
+        self.width, self.height = width, height
+        self.x_range, self.y_range = x_range, y_range
+        #Difference array along x: +1 at the first pixel of a segment, -1 after the last one
+        self.diff = np.zeros( (nsources, height, width + 1), dtype=np.int64 )
+
+    def _scale(self, values, vrange, npix):
+        lo, hi = vrange
+        if hi <= lo:
+            return np.zeros(len(values), dtype=np.int64)
+        return np.clip( ((values - lo) * (npix / (hi - lo))).astype(np.int64), 0, npix - 1 )
+
+    def add(self, src, y, x_start, x_end):
+        "Add segments [x_start, x_end] at heights y"
+        rows = self._scale(np.asarray(y, dtype=np.float64), self.y_range, self.height)
+        first = self._scale(np.asarray(x_start, dtype=np.float64), self.x_range, self.width)
+        last = np.maximum(self._scale(np.asarray(x_end, dtype=np.float64), self.x_range, self.width), first)
+        np.add.at(self.diff[src], (rows, first), 1)
+        np.add.at(self.diff[src], (rows, last + 1), -1)
+
+    @property
+    def counts(self):
+        return np.cumsum(self.diff, axis=2)[:, :, :self.width]
+
+    def shade(self, colors):
+        "RGB image: every source is painted over white with its colour, opacity grows with log of the count"
+        img = np.ones( (self.height, self.width, 3) )
+        for layer, color in zip(self.counts, colors):
+            top = layer.max()
+            if top <= 0:
+                continue
+            alpha = np.where(layer > 0, MIN_ALPHA + (1 - MIN_ALPHA) * np.log1p(layer) / np.log1p(top), 0)[..., None]
+            img = img * (1 - alpha) + np.array(to_rgb(color)) * alpha
+        return img
+
+
 if __name__ == '__main__':
     args = parse_args()
     files = args.data.split(',')
-    data = []
-    idx = 0 
-    for fname in files:
-        with open(fname) as fd:
-            for line in fd:
-               time, _, _, _, _, length, offset  = line.split(',')
-               time, length, offset = float(time), int(length), int(offset)
-               data.append( (time, length, offset, idx) )
-        idx = idx + 1
-
-    data = sorted(data, key=lambda x: x[0])
-
-    X = []
-    Y = []
-    res = []
-    colors = []
-    lw = []
-
-    my = 10**10
-    My = -1
-    mx, Mx = my, My
 
-    fig, ax = plt.subplots()
-    cnt = 0
-    for time, length, offset, idx in data:
+    def blocks():
+        for idx, fname in enumerate(files):
+            for time, length, offset in read_blocks(fname, args.block_rows):
+                if idx == 0 and args.read_length:
+                    length = np.full(len(length), args.read_length)
+                yield idx, time, length, offset
+
+    #First pass: plot limits, and start times of all requests for --fake_time
+    my, My, Mx = np.inf, -np.inf, 0
+    times = []
+    for _, time, length, offset in blocks():
+        if len(time):
+            my, My = min(my, time.min()), max(My, time.max())
+            Mx = max(Mx, (offset + length).max())
+            if args.fake_time:
+                times.append(time)
+    if my > My:
+        raise ValueError("No requests found in {0}".format(args.data))
+    if args.fake_time:
+        #Request number in time order of all requests
+        order = np.argsort(np.concatenate(times), kind='stable')
+        times = None
+        rank = np.empty(len(order))
+        rank[order] = np.arange(len(order))
+        order = None
+        my, My = 0, len(rank) - 1
+
+    #Second pass: binning, blocks come in the same order again
+    canvas = Canvas(args.width, args.height, (0, Mx), (my, My), len(files))
+    pos = 0
+    for idx, time, length, offset in blocks():
         if args.fake_time:
-            y_val = cnt
-        else:
-            y_val = time
-        mx = min(mx, offset)
-        Mx = max(Mx, offset + length)
-        my = min(my, y_val)
-        My = max(My, y_val)
-        if idx == 0 and args.read_length:
-            length = args.read_length
-        res.append(
-            [
-              [offset, y_val],
-              [offset + length, y_val]
-            ]
-          )
-        if idx == 0:
-            colors.append('r')
-            lw.append(0.2)
+            y = rank[pos:pos + len(time)]
+            pos += len(time)
         else:
-            lw.append(0.3)
-            colors.append('b')
-        cnt = cnt + 1
-    lc = LineCollection(res, linewidth=lw, colors=colors)
-    ax.add_collection(lc)
-    ax.set_xlim(-1, Mx)
-    ax.set_ylim(my, My)
-    plt.savefig(args.output, dpi=1800.0)
+            y = time
+        canvas.add(idx, y, offset, offset + np.maximum(length - 1, 0))
+
+    fig, ax = plt.subplots()
+    ax.imshow(canvas.shade([COLORS[i % len(COLORS)] for i in range(len(files))]), origin='lower', aspect='auto',
+              extent=(0, Mx, my, My), interpolation='nearest')
+    ax.set_xlabel('offset, bytes')
+    ax.set_ylabel('request number' if args.fake_time else 'time, s')
+    plt.savefig(args.output, dpi=args.dpi)
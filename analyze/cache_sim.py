@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+"""
+Replay request tables (log2csv.py csv, Parquet datasets or traces) against cache configurations,
+to tune buffer and XCache block sizes offline.
+
+Two kinds of layers are simulated, both keep whole aligned blocks:
+
+    buffered    XrdCephOssBufferedFile-like: a few buffers of block_size bytes, replaced by the policy
+                as soon as a new block is needed
+    xcache      XCache-like disk cache: capacity bytes of blocks, purged down to the low watermark
+                when usage goes above the high one
+
+A request reads all blocks it covers. Blocks that are missing are fetched from the backend together with
+the following readahead bytes, every contiguous run of fetched blocks is one backend read.
+Replacement policies are lru, lfu and arc. Requests are modelled as in access_metrics.py.
+
+Every configuration in the product of the given options is simulated, configurations are spread over processes:
+
+    ./cache_sim.py readv.csv -L buffered -b 1m,4m,16m -n 1,2,4 -p lru,arc -a 0,4m
+"""
+import argparse
+import itertools
+
+from heapq import heapify, heappush, heappop
+from collections import OrderedDict
+from multiprocessing import Pool
+
+from access_metrics import load_requests, parse_size
+
+
+LAYERS = ['buffered', 'xcache']
+#LFU heap is rebuilt when it has this many times more entries than the cache can hold
+LFU_COMPACT = 4
+FIELDS = ['layer', 'block_size', 'capacity', 'policy', 'readahead', 'requests', 'hit_rate', 'block_hit_rate',
+          'backend_reads', 'backend_bytes', 'requested_bytes', 'amplification', 'saved']
+
+
+class LRU:
+    def __init__(self, capacity):
+        self.blocks = OrderedDict()
+
+    def hit(self, block):
+        if block in self.blocks:
+            self.blocks.move_to_end(block)
+            return True
+        return False
+
+    def insert(self, block):
+        self.blocks[block] = True
+
+    def evict(self, incoming):
+        self.blocks.popitem(last=False)
+
+    def __contains__(self, block):
+        return block in self.blocks
+
+    def __len__(self):
+        return len(self.blocks)
+
+
+class LFU:
+    """
+    Least frequently used, ties are broken by the least recent use. Every use pushes a new heap entry,
+    stale ones are skipped on eviction, and dropped when the heap is rebuilt.
+    """
+    def __init__(self, capacity):
+        self.max_heap = LFU_COMPACT * max(capacity, 1)
+        self.counts = {}
+        #Tick of the valid heap entry of every block
+        self.ticks = {}
+        self.heap = []
+        self.tick = 0
+
+    def _push(self, block):
+        self.tick += 1
+        self.ticks[block] = self.tick
+        heappush(self.heap, (self.counts[block], self.tick, block))
+        if len(self.heap) > max(self.max_heap, LFU_COMPACT * len(self.counts)):
+            self.heap = [(self.counts[b], self.ticks[b], b) for b in self.counts]
+            heapify(self.heap)
+
+    def hit(self, block):
+        if block in self.counts:
+            self.counts[block] += 1
+            self._push(block)
+            return True
+        return False
+
+    def insert(self, block):
+        self.counts[block] = 1
+        self._push(block)
+
+    def evict(self, incoming):
+        while True:
+            _, tick, block = heappop(self.heap)
+            if self.ticks.get(block) == tick:
+                del self.counts[block]
+                del self.ticks[block]
+                return
+
+    def __contains__(self, block):
+        return block in self.counts
+
+    def __len__(self):
+        return len(self.counts)
+
+
+class ARC:
+    """
+    Adaptive replacement cache (Megiddo, Modha): recency (t1) and frequency (t2) lists, adapted with ghost lists b1, b2.
+    As in the paper, |t1| + |b1| <= c and |t1| + |t2| + |b1| + |b2| <= 2c: evictions move blocks to the ghost lists,
+    ghosts are dropped when a new block is inserted.
+    """
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.p = 0
+        self.t1, self.t2, self.b1, self.b2 = OrderedDict(), OrderedDict(), OrderedDict(), OrderedDict()
+
+    def hit(self, block):
+        if block in self.t1:
+            del self.t1[block]
+            self.t2[block] = True
+            return True
+        if block in self.t2:
+            self.t2.move_to_end(block)
+            return True
+        return False
+
+    def insert(self, block):
+        if block in self.b1:
+            self.p = min(self.capacity, self.p + max(len(self.b2) // len(self.b1), 1))
+            del self.b1[block]
+            self.t2[block] = True
+        elif block in self.b2:
+            self.p = max(0, self.p - max(len(self.b1) // len(self.b2), 1))
+            del self.b2[block]
+            self.t2[block] = True
+        else:
+            #Case IV of the paper, the cache itself has room already
+            if len(self.t1) + len(self.b1) >= self.capacity:
+                if self.b1:
+                    self.b1.popitem(last=False)
+            elif len(self.t1) + len(self.t2) + len(self.b1) + len(self.b2) >= 2 * self.capacity and self.b2:
+                self.b2.popitem(last=False)
+            self.t1[block] = True
+
+    def evict(self, incoming):
+        if self.t1 and (len(self.t1) > self.p or (incoming in self.b2 and len(self.t1) == self.p) or not self.t2):
+            block, _ = self.t1.popitem(last=False)
+            self.b1[block] = True
+        else:
+            block, _ = self.t2.popitem(last=False)
+            self.b2[block] = True
+
+    def __contains__(self, block):
+        return block in self.t1 or block in self.t2
+
+    def __len__(self):
+        return len(self.t1) + len(self.t2)
+
+
+POLICIES = {'lru': LRU, 'lfu': LFU, 'arc': ARC}
+
+
+class Config:
+    def __init__(self, layer, block_size, capacity, policy='lru', readahead=0, high=1.0, low=1.0):
+        "capacity is the number of buffers for buffered layers, bytes for xcache"
+        if layer not in LAYERS:
+            raise ValueError("Unknown layer {0}, should be one of {1}".format(layer, LAYERS))
+        if policy not in POLICIES:
+            raise ValueError("Unknown policy {0}, should be one of {1}".format(policy, list(POLICIES)))
+        self.layer = layer
+        self.block_size = block_size
+        self.capacity = capacity
+        self.policy = policy
+        self.readahead = readahead
+        self.high, self.low = high, low
+
+    @property
+    def nblocks(self):
+        if self.layer == 'buffered':
+            return self.capacity
+        return max(self.capacity // self.block_size, 1)
+
+    def as_dict(self):
+        return {'layer': self.layer, 'block_size': self.block_size, 'capacity': self.capacity, 'policy': self.policy, 'readahead': self.readahead}
+
+
+def simulate(offset, length, config):
+    "Replay requests against the configuration, return the statistics"
+    bs = config.block_size
+    nblocks = config.nblocks
+    #Purge thresholds, in blocks. For buffers both are the number of buffers.
+    high = max(int(nblocks * config.high), 1)
+    low = min(max(int(nblocks * config.low), 1), high)
+    ra_blocks = -(-config.readahead // bs)
+    cache = POLICIES[config.policy](nblocks)
+
+    first = (offset // bs).tolist()
+    last = ((offset + length - 1) // bs).tolist()
+    hits = block_hits = block_accesses = backend_reads = fetched = 0
+    for f, l in zip(first, last):
+        missing = [b for b in range(f, l + 1) if not cache.hit(b)]
+        block_accesses += l - f + 1
+        block_hits += l - f + 1 - len(missing)
+        if not missing:
+            hits += 1
+            continue
+        if ra_blocks:
+            missing.extend(b for b in range(l + 1, l + 1 + ra_blocks) if b not in cache)
+        #A new backend read for every gap between missing blocks
+        prev = None
+        for b in missing:
+            if b - 1 != prev:
+                backend_reads += 1
+            prev = b
+            #Make room before the block is added, so that it is never the victim
+            if len(cache) >= high:
+                while len(cache) >= low:
+                    cache.evict(b)
+            cache.insert(b)
+        fetched += len(missing)
+
+    requested = int(length.sum())
+    res = config.as_dict()
+    res.update({
+            'requests': len(first),
+            'hit_rate': hits / len(first) if first else 0.0,
+            'block_hit_rate': block_hits / block_accesses if block_accesses else 0.0,
+            'backend_reads': backend_reads,
+            'backend_bytes': fetched * bs,
+            'requested_bytes': requested,
+            'amplification': fetched * bs / requested if requested else 0.0,
+            #Same as in buffer_tests/cache_analyze.py: backend reads saved, percent of requests
+            'saved': (1 - backend_reads / len(first)) * 100 if first else 0.0,
+        })
+    return res
+
+
+#Requests, loaded once per worker process
+_requests = None
+
+
+def _init_worker(offset, length):
+    global _requests
+    _requests = (offset, length)
+
+
+def _simulate(config):
+    return simulate(_requests[0], _requests[1], config)
+
+
+def sweep(offset, length, configs, jobs=None):
+    "Simulate all configurations in a pool of processes, results are in the order of configs"
+    if jobs == 1:
+        return [simulate(offset, length, config) for config in configs]
+    with Pool(jobs, initializer=_init_worker, initargs=(offset, length)) as pool:
+        return pool.map(_simulate, configs, chunksize=1)
+
+
+def make_configs(args):
+    configs = []
+    sizes = lambda value: [parse_size(v) for v in value.split(',')]
+    high, low = (float(v) for v in args.watermarks.split(','))
+    for layer in args.layers.split(','):
+        if layer == 'buffered':
+            capacities, watermarks = [int(v) for v in args.nbuffers.split(',')], (1.0, 1.0)
+        else:
+            capacities, watermarks = sizes(args.capacity), (high, low)
+        for bs, cap, policy, ra in itertools.product(sizes(args.block_sizes), capacities, args.policies.split(','), sizes(args.readahead)):
+            configs.append(Config(layer, bs, cap, policy, ra, *watermarks))
+    return configs
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('data', nargs='+', help="Csv, Parquet or trace files. Requests from all of them are merged.")
+    parser.add_argument('-r', '--request_type', help="Request type to take from traces. Default is readv", default='readv')
+    parser.add_argument('-s', '--span', help="Use the whole range from the first to the last byte of readvs, not their size", action='store_true')
+    parser.add_argument('-L', '--layers', help="Comma-separated layers to simulate: {0}. Default is buffered".format(','.join(LAYERS)), default='buffered')
+    parser.add_argument('-b', '--block_sizes', help="Comma-separated block sizes, k/m/g suffixes allowed. Default is 1m,4m,16m", default='1m,4m,16m')
+    parser.add_argument('-n', '--nbuffers', help="Comma-separated numbers of buffers for buffered layers. Default is 1,2,4", default='1,2,4')
+    parser.add_argument('-c', '--capacity', help="Comma-separated xcache capacities. Default is 1g", default='1g')
+    parser.add_argument('-w', '--watermarks', help="High and low xcache watermarks, fractions of capacity. Default is 0.95,0.9", default='0.95,0.9')
+    parser.add_argument('-p', '--policies', help="Comma-separated replacement policies: {0}. Default is lru".format(','.join(POLICIES)), default='lru')
+    parser.add_argument('-a', '--readahead', help="Comma-separated readahead sizes. Default is 0", default='0')
+    parser.add_argument('-j', '--jobs', help="Number of processes. Default is the number of CPUs", type=int, default=None)
+    parser.add_argument('-S', '--sort', help="Sort results by this field. Default is backend_bytes", choices=FIELDS, default='backend_bytes')
+    parser.add_argument('-o', '--output', help="Also save results to this csv file", default=None)
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    _, offset, length = load_requests(args.data, args.request_type, args.span)
+    results = sorted(sweep(offset, length, make_configs(args), args.jobs), key=lambda res: res[args.sort])
+    print('{0:>9} {1:>10} {2:>12} {3:>6} {4:>10} {5:>8} {6:>8} {7:>10} {8:>14} {9:>8} {10:>8}'.format(
+            'layer', 'block', 'capacity', 'policy', 'readahead', 'hits', 'blk_hits', 'be_reads', 'be_bytes', 'ampl', 'saved'))
+    for res in results:
+        print('{layer:>9} {block_size:>10} {capacity:>12} {policy:>6} {readahead:>10} {hit_rate:>8.2%} {block_hit_rate:>8.2%} {backend_reads:>10} {backend_bytes:>14} {amplification:>8.2f} {saved:>8.2f}'.format(**res))
+    if args.output:
+        with open(args.output, 'w') as fd:
+            print(','.join(FIELDS), file=fd)
+            for res in results:
+                print(','.join(str(res[name]) for name in FIELDS), file=fd)
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+Typed columnar storage for request tables (start,duration,state,size,chunks,scatter,buf_start).
+
+A Parquet dataset is a directory of part files. Every writer adds a new part file, so new log segments
+are appended without rewriting what is already there, and readers only load the columns they need.
+pyarrow is needed for Parquet; csv works without it.
+
+Run as a script to append existing csv files to a dataset:
+
+    ./columnar.py -o readv.parquet data_*.csv
+"""
+import os
+import sys
+import time
+import uuid
+import argparse
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    import pyarrow.dataset as ds
+except ImportError:
+    pa = None
+
+
+COLUMNS = ['start', 'duration', 'state', 'size', 'chunks', 'scatter', 'buf_start']
+TYPES = ['float64', 'float64', 'int8', 'int64', 'int64', 'int64', 'int64']
+#Rows per row group
+BATCH_ROWS = 256*1024
+
+
+def check_pyarrow():
+    if pa is None:
+        raise RuntimeError("pyarrow is required for Parquet files, install it or use csv")
+
+
+def is_parquet(path):
+    return path.endswith('.parquet') or os.path.isdir(path)
+
+
+class CsvWriter:
+    "Same format as before: csv rows without header. Output is flushed often, so that it can be followed from a pipe"
+    def __init__(self, fd, flush_rows=100, close_fd=True):
+        self.fd = fd
+        self.flush_rows = flush_rows
+        self.close_fd = close_fd
+        self.rows = 0
+
+    def write(self, row):
+        print('{0},{1},{2},{3},{4},{5},{6}'.format(*row), file=self.fd)
+        self.rows += 1
+        if self.rows % self.flush_rows == 0:
+            self.fd.flush()
+
+    def close(self):
+        if self.close_fd:
+            self.fd.close()
+        else:
+            self.fd.flush()
+
+
+class ParquetWriter:
+    "Writes rows to a new part file of the dataset directory"
+    def __init__(self, dataset, batch_rows=BATCH_ROWS):
+        check_pyarrow()
+        os.makedirs(dataset, exist_ok=True)
+        name = 'part-{0}-{1}-{2}.parquet'.format(time.strftime('%Y%m%d%H%M%S'), os.getpid(), uuid.uuid4().hex[:8])
+        self.path = os.path.join(dataset, name)
+        #Readers skip files starting with '.', so a part being written (or left by a killed writer) is never loaded
+        self.tmp_path = os.path.join(dataset, '.' + name)
+        self.schema = pa.schema([(name, getattr(pa, tname)()) for name, tname in zip(COLUMNS, TYPES)])
+        self.batch_rows = batch_rows
+        self.columns = [[] for _ in COLUMNS]
+        self.writer = None
+
+    def write(self, row):
+        for col, val in zip(self.columns, row):
+            col.append(val)
+        if len(self.columns[0]) >= self.batch_rows:
+            self.flush()
+
+    def write_frame(self, data):
+        "Write all rows of a DataFrame with the table columns"
+        self.flush()
+        self._write_table(pa.Table.from_pandas(data[COLUMNS].astype(dict(zip(COLUMNS, TYPES))), schema=self.schema, preserve_index=False))
+
+    def _write_table(self, table):
+        if self.writer is None:
+            self.writer = pq.ParquetWriter(self.tmp_path, self.schema)
+        self.writer.write_table(table, row_group_size=self.batch_rows)
+
+    def flush(self):
+        if not self.columns[0]:
+            return
+        self._write_table(pa.Table.from_arrays([pa.array(col, type=typ) for col, typ in zip(self.columns, self.schema.types)], schema=self.schema))
+        self.columns = [[] for _ in COLUMNS]
+
+    def close(self):
+        self.flush()
+        if self.writer is not None:
+            self.writer.close()
+            os.rename(self.tmp_path, self.path)
+
+
+def open_writer(path, fmt=None):
+    "Writer for the output path: Parquet dataset for directories and *.parquet, csv otherwise. '-' is stdout."
+    fmt = fmt or ('parquet' if path != '-' and is_parquet(path) else 'csv')
+    if fmt == 'parquet':
+        return ParquetWriter(path)
+    if path == '-':
+        return CsvWriter(sys.stdout, close_fd=False)
+    return CsvWriter(open(path, 'w'))
+
+
+def _csv_options(path):
+    "read_csv arguments for csv files with or without header"
+    with open(path) as fd:
+        header = fd.readline().startswith(COLUMNS[0] + ',')
+    return {'header': 0 if header else None, 'names': None if header else COLUMNS, 'float_precision': 'round_trip'}
+
+
+def load(path, columns=None):
+    "DataFrame with the given columns from a Parquet dataset/file or a csv file (with or without header)"
+    #pandas is only needed for reading, writers work without it
+    import pandas
+    if is_parquet(path):
+        check_pyarrow()
+        return pq.read_table(path, columns=columns).to_pandas()
+    return pandas.read_csv(path, usecols=columns, **_csv_options(path))
+
+
+def iter_batches(path, columns=None, batch_rows=BATCH_ROWS):
+    "Dicts of NumPy arrays with the given columns, for consecutive batches of at most batch_rows rows"
+    import pandas
+    columns = COLUMNS if columns is None else columns
+    if is_parquet(path):
+        check_pyarrow()
+        for batch in ds.dataset(path, format='parquet').to_batches(columns=columns, batch_size=batch_rows):
+            yield {name: batch.column(name).to_numpy() for name in columns}
+    else:
+        with pandas.read_csv(path, usecols=columns, chunksize=batch_rows, **_csv_options(path)) as reader:
+            for data in reader:
+                yield {name: data[name].to_numpy() for name in columns}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Append csv files to a Parquet dataset")
+    parser.add_argument('data', nargs='+', help="csv files")
+    parser.add_argument('-o', '--output', help="Dataset directory", required=True)
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    writer = ParquetWriter(args.output)
+    for path in args.data:
+        writer.write_frame(load(path))
+    writer.close()
@@ -1,12 +1,17 @@
 #!/usr/bin/env python
 
+import os
 import pandas
 import seaborn
 import argparse
 
+import columnar
+
+from trace_log import is_trace, load, as_columns
+
 def parse_args():
     parser = argparse.ArgumentParser()
-    parser.add_argument('-d', '--data', help='Csv file to plot', required=True)
+    parser.add_argument('-d', '--data', help='Csv, Parquet dataset or trace file to plot', required=True)
     parser.add_argument('-o', '--output', help='Plot output', default='./plot.png')
     parser.add_argument('-r', '--resolution', help='Resolution, in dpi', default=300, type=int)
     parser.add_argument('-b', '--bins', help='Number of bins for histogram', type=int)
@@ -18,7 +23,10 @@ def parse_args():
 
 if __name__ == '__main__':
     args = parse_args() 
-    data = pandas.read_csv(args.data)
+    if os.path.isfile(args.data) and is_trace(args.data):
+        data = pandas.DataFrame(as_columns(load(args.data), args.caption))
+    else:
+        data = columnar.load(args.data, columns=['duration', 'state', 'size', 'chunks', 'scatter'])
 
     kwargs = {}
     if args.bins:
@@ -34,6 +42,8 @@ if __name__ == '__main__':
     elif x_val == 'scatter':
         title = 'request "scatter"'
         xtitle = 'bytes'
+        #Unknown scatter is -1
+        data = data[data['scatter'] >= 0]
     else:
         raise ValueError("Unknown value to plot: {0}".format(x_val))
 
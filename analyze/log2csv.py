@@ -1,17 +1,53 @@
 #!/usr/bin/env python3
+"""
+Extract read or readv request times from XRootD client Dump logs.
+
+Lines are prefiltered with substring checks and parsed with str.find, without regular expressions.
+Timestamps are parsed once per second, only the fractional part is parsed for every line.
+Big log files can be parsed in parallel (-j): the file is split into byte ranges, every worker turns
+its range into a list of events (request start, chunk, request end), and the main process matches
+starts and ends of requests in file order, so requests that cross range boundaries are handled as usual.
+
+Requests in flight are indexed by (handle, request description), as printed in the log. Requests with the same
+key are matched in FIFO order. Scatter of a readv is computed from the chunk list of its description; if the log only
+has the number of chunks, it is taken from 'read buffer for chunk' lines of the same stream since the previous response.
+If there are none, scatter and buf_start are written as -1.
+Requests that never get a response are evicted after --max_age seconds, or when there are more than --max_pending of them.
+
+Output is csv, or a Parquet dataset if the output is a directory or ends with .parquet (see columnar.py).
+Every run appends a new part to the dataset, so log segments can be added as they come.
+"""
 import datetime
 import argparse
+import os
 import sys
-import re
 
+from collections import OrderedDict, deque
 from contextlib import contextmanager
+from multiprocessing import Pool
+
+from columnar import open_writer
+
+
+#Byte ranges parsed by workers are about this size
+RANGE_SIZE = 64*1024*1024
+#Parsed ranges in flight (being parsed or waiting for the matcher) per worker
+RANGES_PER_JOB = 2
+DEF_MAX_PENDING = 100000
+DEF_MAX_AGE = 3600
+
+EV_START, EV_CHUNKS, EV_END = 0, 1, 2
 
 
 def parse_arguments():
     parser = argparse.ArgumentParser()
     parser.add_argument('log', help='Path to log file that should be analized')
-    parser.add_argument('-o', '--output', help='Path to the output file', default='./readv_times.csv')
+    parser.add_argument('-o', '--output', help='Path to the output file, or Parquet dataset directory to append to', default='./readv_times.csv')
+    parser.add_argument('-f', '--format', help='Output format. Default is parquet for directories and *.parquet, csv otherwise', choices=['csv', 'parquet'], default=None)
     parser.add_argument('-r', '--request_type', help='Type of the the request that should be extracted. Default is readv.', default='readv')
+    parser.add_argument('-j', '--jobs', help='Number of processes to parse the log with. Default is 1. Ignored when reading stdin.', default=1, type=int)
+    parser.add_argument('--max_pending', help='Max number of requests in flight. Older ones are dropped. Default is {0}'.format(DEF_MAX_PENDING), default=DEF_MAX_PENDING, type=int)
+    parser.add_argument('--max_age', help='Requests without response for this number of seconds (of log time) are dropped. Default is {0}'.format(DEF_MAX_AGE), default=DEF_MAX_AGE, type=float)
     return parser.parse_args()
 
 
@@ -21,111 +57,304 @@ def timestamp2epoch(stamp):
     return res
 
 
-@contextmanager
-def open_stdout():
-    yield sys.stdout
+class TimestampParser:
+    "timestamp2epoch with a cache of epoch seconds for every 'date time zone' prefix"
+    def __init__(self):
+        self.cache = {}
+
+    def __call__(self, stamp):
+        date_time, _, zone = stamp.rpartition(' ')
+        seconds, _, frac = date_time.partition('.')
+        try:
+            base = self.cache[(seconds, zone)]
+        except KeyError:
+            base = self.cache[(seconds, zone)] = int(timestamp2epoch(seconds + '.0 ' + zone))
+        #Same arithmetic as timedelta.total_seconds(), to get exactly the same floats
+        return (base * 10**6 + int(frac[:6].ljust(6, '0'))) / 10**6
 
 
 @contextmanager
 def open_stdin():
-    yield sys.stdin
-
-
-def log2csv(log_path, csv_path, req_type='readv'):
-    def _extract_key(match):
-        time = timestamp2epoch(match.group('time'))
-        if req_type == 'readv':
-            size = match.group('size')
-            chunks = match.group('chunks')
-            if chunks.endswith(']'):
-                chunks = len(chunks.split(';')) -1
-            key = (size, chunks)
-        elif req_type == 'read':
-            size = match.group('size')
-            offset = match.group('offset')
-            key = (size, offset)
-        return (key, time)
-
-    requests = {}
-    if csv_path == '-':
-        opener = open_stdout
-    else:
-        opener = lambda: open(csv_path, 'w')
+    yield sys.stdin.buffer
+
+
+def parse_chunk_list(chunks):
+    "Number of chunks, first and last+1 byte for '[(offset: 1, size: 2); (offset: 5, size: 1); ]'"
+    nchunks, min_pos, max_end = 0, None, None
+    for part in chunks[1:-1].split(';'):
+        off_pos = part.find('offset: ')
+        size_pos = part.find(', size: ', off_pos)
+        if off_pos < 0 or size_pos < 0:
+            continue
+        off, size = int(part[off_pos + 8:size_pos]), int(part[size_pos + 8:part.find(')', size_pos)])
+        nchunks += 1
+        min_pos = off if min_pos is None else min(min_pos, off)
+        max_end = off + size if max_end is None else max(max_end, off + size)
+    return nchunks, min_pos, max_end
+
+
+def line_stream(line):
+    "Stream the line is about: the first '[...]' after the log header fields, e.g. [host:1094.0]"
+    pos = line.find(b'] [')
+    end = line.find(b']', pos + 3)
+    return line[pos + 3:end].decode('utf-8', 'replace') if pos >= 0 and end > 0 else ''
+
+
+class LineParser:
+    """
+    Turns log lines into events:
+        (EV_START, key, time, (size, nchunks, min_pos, max_end))
+        (EV_CHUNKS, stream, min_pos, max_end)
+        (EV_END, key, time, state, stream)
+    key is (handle, description). min_pos and max_end are None if the description has no chunk list.
+    """
+    def __init__(self, req_type='readv'):
+        if req_type not in ('read', 'readv'):
+            raise ValueError("Unsupported request type {0}: expected read or readv".format(req_type))
+        self.req_type = req_type
+        self.request = 'kXR_{0} (handle: '.format(req_type)
+        self.request_b = self.request.encode('ascii')
+        self.start_marker = 'Message ' + self.request
+        self.end_markers = [('Got a kXR_ok response to request ' + self.request, 0),
+                            ('Got a kXR_error response to request ' + self.request, 1),
+                            ('Handling error while processing ' + self.request, 1)]
+        self.timestamp = TimestampParser()
+
+    def _time(self, line):
+        if not line.startswith('['):
+            return None
+        end = line.find(']')
+        return self.timestamp(line[1:end]) if end > 0 else None
+
+    def _key(self, line, pos):
+        "Parse request description that starts at pos, right after 'handle: '. Return key, size, chunks and end position"
+        if self.req_type == 'readv':
+            chunks_pos = line.find(', chunks: ', pos)
+            size_pos = line.find(', total size: ', chunks_pos)
+            if chunks_pos < 0 or size_pos < 0:
+                return None, None, None, -1
+            chunks = line[chunks_pos + 10:size_pos]
+            size_end = line.find(')', size_pos)
+            size = line[size_pos + 14:size_end]
+            if size_end < 0 or not size.isdigit():
+                return None, None, None, -1
+            return (line[pos:chunks_pos], chunks, size), size, chunks, size_end + 1
+        else:
+            offset_pos = line.find(', offset: ', pos)
+            size_pos = line.find(', size: ', offset_pos)
+            size_end = line.find(')', size_pos)
+            if offset_pos < 0 or size_pos < 0 or size_end < 0:
+                return None, None, None, -1
+            offset, size = line[offset_pos + 10:size_pos], line[size_pos + 8:size_end]
+            if not (offset.isdigit() and size.isdigit()):
+                return None, None, None, -1
+            return (line[pos:offset_pos], offset, size), size, offset, size_end + 1
+
+    def _info(self, size, chunks):
+        "(size, nchunks, min_pos, max_end) of a request. As before, for reads nchunks is the offset"
+        if self.req_type == 'read':
+            return (size, chunks, int(chunks), int(chunks) + int(size))
+        if chunks.endswith(']'):
+            nchunks, min_pos, max_end = parse_chunk_list(chunks)
+            return (size, nchunks, min_pos, max_end)
+        return (size, chunks, None, None)
+
+    def parse(self, lines):
+        "Events for an iterable of lines (bytes)"
+        chunk_stream, chunk_min, chunk_max = None, None, None
+        for bline in lines:
+            if self.request_b in bline:
+                line = bline.decode('utf-8', 'replace')
+                event = None
+                pos = line.rfind(self.start_marker)
+                if pos >= 0:
+                    key, size, chunks, key_end = self._key(line, pos + len(self.start_marker))
+                    if key is not None and line.startswith(' has been successfully sent', key_end):
+                        event = (EV_START, key, self._info(size, chunks))
+                else:
+                    for marker, state in self.end_markers:
+                        pos = line.rfind(marker)
+                        if pos >= 0:
+                            key, _, _, _ = self._key(line, pos + len(marker))
+                            if key is not None:
+                                event = (EV_END, key, (state, line_stream(bline)))
+                            break
+                time = self._time(line) if event is not None else None
+                if time is not None:
+                    if chunk_min is not None:
+                        yield (EV_CHUNKS, chunk_stream, chunk_min, chunk_max)
+                        chunk_min, chunk_max = None, None
+                    kind, key, extra = event
+                    yield (kind, key, time, extra) if kind == EV_START else (kind, key, time) + extra
+            elif self.req_type == 'readv' and b'read buffer for chunk ' in bline:
+                size, _, pos = bline[bline.rfind(b'read buffer for chunk ') + 22:].rstrip(b'\n').partition(b'@')
+                if size.isdigit() and pos.isdigit():
+                    size, pos = int(size), int(pos)
+                    stream = line_stream(bline)
+                    #Consecutive chunk lines of the same stream are merged, only their range matters
+                    if chunk_min is not None and stream != chunk_stream:
+                        yield (EV_CHUNKS, chunk_stream, chunk_min, chunk_max)
+                        chunk_min, chunk_max = None, None
+                    chunk_stream = stream
+                    chunk_min = pos if chunk_min is None else min(chunk_min, pos)
+                    chunk_max = size + pos if chunk_max is None else max(chunk_max, size + pos)
+        if chunk_min is not None:
+            yield (EV_CHUNKS, chunk_stream, chunk_min, chunk_max)
 
+
+def range_lines(path, start, end):
+    "Lines that begin in [start, end) byte range of the file"
+    with open(path, 'rb') as fd:
+        if start > 0:
+            fd.seek(start - 1)
+            pos = start - 1 + len(fd.readline())
+        else:
+            pos = 0
+        for line in fd:
+            if pos >= end:
+                break
+            pos += len(line)
+            yield line
+
+
+def parse_range(task):
+    path, start, end, req_type = task
+    return list(LineParser(req_type).parse(range_lines(path, start, end)))
+
+
+def parallel_events(path, req_type, jobs):
+    """
+    Events of the ranges in file order. A range is submitted only when one is taken by the matcher,
+    so at most RANGES_PER_JOB * jobs parsed ranges are held in memory when the matcher is the slower side.
+    """
+    size = os.stat(path).st_size
+    nranges = max(jobs, -(-size // RANGE_SIZE))
+    bounds = [size * i // nranges for i in range(nranges + 1)]
+    tasks = ((path, bounds[i], bounds[i+1], req_type) for i in range(nranges))
+    with Pool(jobs) as pool:
+        in_flight = deque()
+        for task in tasks:
+            in_flight.append(pool.apply_async(parse_range, (task,)))
+            if len(in_flight) < RANGES_PER_JOB * jobs:
+                continue
+            yield from in_flight.popleft().get()
+        while in_flight:
+            yield from in_flight.popleft().get()
+
+
+class InFlightTable:
+    """
+    Requests that were sent, but got no response yet. Requests with the same key are matched in FIFO order.
+    Entries are kept in start order, so the oldest one is evicted in O(1) when the table is too big or too old.
+    """
+    def __init__(self, max_pending=DEF_MAX_PENDING, max_age=DEF_MAX_AGE):
+        self.max_pending = max_pending
+        self.max_age = max_age
+        self.pending = OrderedDict()
+        self.by_key = {}
+        self.seq = 0
+        self.evicted = 0
+
+    def __len__(self):
+        return len(self.pending)
+
+    def add(self, key, start, info):
+        self.seq += 1
+        self.pending[self.seq] = (key, start, info)
+        try:
+            self.by_key[key].append(self.seq)
+        except KeyError:
+            self.by_key[key] = deque([self.seq])
+        self.evict(start)
+
+    def evict(self, now):
+        while self.pending:
+            seq, (key, start, _) = next(iter(self.pending.items()))
+            if len(self.pending) <= self.max_pending and start >= now - self.max_age:
+                break
+            #The oldest request overall is also the oldest one for its key
+            self._pop(key)
+            self.evicted += 1
+
+    def _pop(self, key):
+        seqs = self.by_key[key]
+        seq = seqs.popleft()
+        if not seqs:
+            del self.by_key[key]
+        return self.pending.pop(seq)
+
+    def pop(self, key):
+        "Oldest request with the given key: (key, start, info), or None"
+        if key not in self.by_key:
+            return None
+        return self._pop(key)
+
+
+def match_events(events, writer, req_type='readv', max_pending=DEF_MAX_PENDING, max_age=DEF_MAX_AGE):
+    "Match request starts and ends, write rows to the writer"
+    inflight = InFlightTable(max_pending, max_age)
+    #Range of chunks received by every stream since its last response, for requests without chunk lists
+    stream_bufs = {}
+    unmatched = 0
+    max_spread = -1
+    biggest_spread_request = 'none'
+    best_buf_start, best_buf_end = -1, -1
+    for event in events:
+        if event[0] == EV_START:
+            _, key, start, info = event
+            inflight.add(key, start, info)
+        elif event[0] == EV_CHUNKS:
+            _, stream, min_pos, max_end = event
+            buf_start, buf_end = stream_bufs.get(stream, (10**100, -1))
+            stream_bufs[stream] = (min(buf_start, min_pos), max(buf_end, max_end))
+        else:
+            _, key, end, res, stream = event
+            buf_start, buf_end = stream_bufs.pop(stream, (10**100, -1))
+            req = inflight.pop(key)
+            if req is None:
+                unmatched += 1
+                continue
+            _, start, (size, nchunks, min_pos, max_end) = req
+            if min_pos is not None:
+                buf_start, buf_end = min_pos, max_end
+            if req_type == 'readv':
+                if buf_end < 0:
+                    #No chunk list and no chunk lines: scatter is unknown
+                    scatter, buf_start = -1, -1
+                else:
+                    scatter = buf_end - buf_start
+                if max_spread < scatter:
+                    max_spread = scatter
+                    best_buf_start, best_buf_end = buf_start, buf_end
+                    biggest_spread_request = (size, nchunks)
+                writer.write( (start, end - start, res, int(size), int(nchunks), scatter, buf_start) )
+            else:
+                writer.write( (start, end - start, res, int(size), int(nchunks), int(size), int(nchunks)) )
+    if unmatched:
+        print("Found {0} request ends without starts. Probably log is incomplete, or multiple error messages are present.".format(unmatched), file=sys.stderr)
+    if inflight.evicted or len(inflight):
+        print("Requests without response: {0} evicted, {1} still pending at the end of log".format(inflight.evicted, len(inflight)), file=sys.stderr)
+    if req_type == 'readv':
+        print("Max spread = {0}, request = {1}, buf_start={2}, buf_end={3}".format(max_spread, biggest_spread_request, best_buf_start, best_buf_end), file=sys.stderr)
+
+
+def log2csv(log_path, output, req_type='readv', jobs=1, max_pending=DEF_MAX_PENDING, max_age=DEF_MAX_AGE, fmt=None):
     if log_path == '-':
         input_opener = open_stdin
     else:
-        input_opener = lambda: open(log_path)
+        input_opener = lambda: open(log_path, 'rb')
 
-    with opener() as csv_fd:
-        with input_opener() as log_fd:
-            timestamp_rexp = r'^\[(?P<time>[0-9]{4}-[0-9]{2}-[0-9]{2} [0-9:\.]+ \+[0-9]+)\]'
-            if req_type == 'readv':
-                req_data_rexp = r'\(handle: [0-9a-fx]+, chunks: (?P<chunks>[0-9 ,\[\]:;ofsetiz()]+), total size: (?P<size>[0-9]+)\)'
-                req_send_rexp = r'Message kXR_readv {0} has been successfully sent'.format(req_data_rexp)
-                req_end_rexp = r'(?:Got a kXR_(?P<state>ok|error) response to request|Handling error while processing) kXR_readv {0}'.format(req_data_rexp)
-            elif req_type == 'read':
-                req_data_rexp = r'\(handle: [0-9a-fx]+, offset: (?P<offset>[0-9]+), size: (?P<size>[0-9]+)\)'
-                req_send_rexp = r'Message kXR_read {0} has been successfully sent'.format(req_data_rexp)
-                req_end_rexp = r'(?:Got a kXR_(?P<state>ok|error) response to request|Handling error while processing) kXR_read {0}'.format(req_data_rexp)
-            else:
-                raise ValueError("Unsupported request type {0}: expected read or readv".format(req_type))
-
-            start_rexp = re.compile(r'{0}.*{1}'.format(timestamp_rexp, req_send_rexp))
-            end_rexp = re.compile(r'{0}.*{1}'.format(timestamp_rexp, req_end_rexp))
-
-            chunk_rexp = re.compile(r'.*read buffer for chunk ([0-9@]+)$')
-
-            lines_written = 0
-
-            max_spread = 0
-            biggest_spread_request = 'none'
-            best_buf_start, best_buf_end = -1, -1
-            for line in log_fd:
-                m = start_rexp.match(line)
-                if m:
-                    buf_start, buf_end = 10**100, -1
-                    key, start = _extract_key(m)
-                    try:
-                        requests[key].append(start)
-                    except KeyError:
-                        requests[key] = [start]
-
-                if req_type == 'readv':
-                    m = chunk_rexp.match(line)
-                    if m:
-                        size, pos = [int(x) for x in m.group(1).strip().split('@')]
-                        if size + pos > buf_end:
-                            buf_end = size + pos
-                        if pos < buf_start:
-                            buf_start = pos
-                        #print("bs={0}, be={1}".format(buf_start, buf_end), file=sys.stderr)
-
-
-                m = end_rexp.match(line)
-                if m:
-                    key, end = _extract_key(m)
-                    if req_type == 'readv':
-                        if max_spread < buf_end - buf_start:
-                            max_spread = buf_end - buf_start
-                            best_buf_start, best_buf_end = buf_start, buf_end
-                            biggest_spread_request = key
-                    res = 0 if m.group('state') == 'ok' else 1
-                    try:
-                        start = requests[key].pop()
-                    except (KeyError, IndexError):
-                        print("Found end of request {0}, but can not find start! Probably log is incomplete, multiple error messages are present.".format(key), file=sys.stderr)
-                    else:
-                        lines_written += 1
-                        if req_type == 'readv':
-                            print('{0},{1},{2},{3},{4},{5},{6}'.format(start, end - start, res, key[0],key[1], buf_end - buf_start, buf_start), file=csv_fd)
-                        else:
-                            print('{0},{1},{2},{3},{4},{5},{6}'.format(start, end - start, res, key[0],key[1], key[0], key[1]), file=csv_fd)
-                        if (lines_written + 1) % 5 == 0:
-                            csv_fd.flush()
-            print("Max spread = {0}, request = {1}, buf_start={2}, buf_end={3}".format(max_spread, key, best_buf_start, best_buf_end), file=sys.stderr)
+    writer = open_writer(output, fmt)
+    try:
+        if jobs > 1 and log_path != '-':
+            match_events(parallel_events(log_path, req_type, jobs), writer, req_type, max_pending, max_age)
+        else:
+            with input_opener() as log_fd:
+                match_events(LineParser(req_type).parse(log_fd), writer, req_type, max_pending, max_age)
+    finally:
+        writer.close()
 
 
 if __name__ == '__main__':
     args = parse_arguments()
-    log2csv(args.log, args.output, req_type=args.request_type)
+    log2csv(args.log, args.output, req_type=args.request_type, jobs=args.jobs, max_pending=args.max_pending, max_age=args.max_age, fmt=args.format)
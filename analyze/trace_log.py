@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+Binary trace of file access requests, written by the test clients themselves instead of XRD_LOGLEVEL=Dump logs.
+
+A trace file is a 16-byte header (magic, format version, record size) followed by fixed-width little-endian records:
+
+    start_ns     int64   request start, nanoseconds since the epoch
+    duration_ns  int64
+    nbytes       int64   total bytes requested
+    min_offset   int64   first byte requested
+    max_offset   int64   last byte requested + 1
+    nchunks      uint32
+    handle       uint32  id of the file handle, to tell requests of different files apart
+    op           uint8   index in OPS
+    status       uint8   0 for success, 1 for failure
+
+Records are appended under a lock, so a writer can be shared by threads. Every process should write its own file.
+Writing only needs the standard library, NumPy is needed to read traces.
+Traces are loaded directly as NumPy structured arrays. Run as a script to convert traces to log2csv.py csv format,
+or to a Parquet dataset (see columnar.py).
+"""
+import os
+import struct
+import argparse
+
+from threading import Lock
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+MAGIC = b'RDVTRACE'
+VERSION = 1
+HEADER = struct.Struct('<8sHH4x')
+RECORD = struct.Struct('<qqqqqIIBB6x')
+if np is not None:
+    DTYPE = np.dtype([
+            ('start_ns', '<i8'),
+            ('duration_ns', '<i8'),
+            ('nbytes', '<i8'),
+            ('min_offset', '<i8'),
+            ('max_offset', '<i8'),
+            ('nchunks', '<u4'),
+            ('handle', '<u4'),
+            ('op', 'u1'),
+            ('status', 'u1'),
+            ('pad', 'V6'),
+        ])
+else:
+    DTYPE = None
+OPS = ['open', 'close', 'stat', 'read', 'readv', 'write', 'copy']
+
+
+def handle_id(obj):
+    return id(obj) & 0xffffffff
+
+
+class TraceWriter:
+    #So that clients that get a writer do not need to import this module
+    handle_id = staticmethod(handle_id)
+
+    def __init__(self, path, buffering=1024*1024):
+        self.path = path
+        self.lock = Lock()
+        self.fd = open(path, 'ab', buffering=buffering)
+        if self.fd.tell() == 0:
+            self.fd.write(HEADER.pack(MAGIC, VERSION, RECORD.size))
+
+    def record(self, op, handle, start_ns, duration_ns, ok, nchunks=0, nbytes=0, min_offset=0, max_offset=0):
+        data = RECORD.pack(start_ns, duration_ns, nbytes, min_offset, max_offset, nchunks, handle, OPS.index(op), 0 if ok else 1)
+        with self.lock:
+            self.fd.write(data)
+
+    def record_chunks(self, op, handle, start_ns, duration_ns, ok, chunks):
+        "Record a request for a list of (offset, size) chunks"
+        if chunks:
+            min_offset = min(off for off, _ in chunks)
+            max_offset = max(off + sz for off, sz in chunks)
+        else:
+            min_offset, max_offset = 0, 0
+        self.record(op, handle, start_ns, duration_ns, ok, len(chunks), sum(sz for _, sz in chunks), min_offset, max_offset)
+
+    def record_plan(self, op, handle, start_ns, duration_ns, ok, plan):
+        "Record a request for a ChunkPlan"
+        self.record(op, handle, start_ns, duration_ns, ok, len(plan), plan.total_bytes, plan.min_offset, plan.max_end)
+
+    def flush(self):
+        with self.lock:
+            self.fd.flush()
+
+    def close(self):
+        with self.lock:
+            self.fd.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def is_trace(path):
+    with open(path, 'rb') as fd:
+        return fd.read(len(MAGIC)) == MAGIC
+
+
+def records(path):
+    "Memory-mapped records of a trace file, in the order they were written"
+    with open(path, 'rb') as fd:
+        magic, version, rec_size = HEADER.unpack(fd.read(HEADER.size))
+    if magic != MAGIC:
+        raise ValueError("{0} is not a trace file".format(path))
+    if version != VERSION or rec_size != RECORD.size:
+        raise ValueError("Unsupported trace format in {0}: version {1}, record size {2}".format(path, version, rec_size))
+    #The last record may be incomplete if the writer was killed
+    count = (os.stat(path).st_size - HEADER.size) // rec_size
+    if count == 0:
+        return np.empty(0, dtype=DTYPE)
+    return np.memmap(path, dtype=DTYPE, mode='r', offset=HEADER.size, shape=(count,))
+
+
+def load(paths):
+    "Load records of one or more trace files into a single structured array, sorted by start time"
+    if isinstance(paths, str):
+        paths = [paths]
+    parts = [records(path) for path in paths]
+    res = np.concatenate(parts) if parts else np.empty(0, dtype=DTYPE)
+    return res[np.argsort(res['start_ns'], kind='stable')]
+
+
+def as_columns(records, op='readv'):
+    """
+    Columns of log2csv.py output for requests of the given type:
+    start,duration,state,size,chunks,scatter,buf_start. As in log2csv, for reads chunks and buf_start are the offset.
+    """
+    records = records[records['op'] == OPS.index(op)]
+    res = {
+            'start': records['start_ns'] / 1e9,
+            'duration': records['duration_ns'] / 1e9,
+            'state': records['status'].astype(np.int64),
+            'size': records['nbytes'],
+        }
+    if op == 'read':
+        res.update(chunks=records['min_offset'], scatter=records['nbytes'], buf_start=records['min_offset'])
+    else:
+        res.update(chunks=records['nchunks'].astype(np.int64), scatter=records['max_offset'] - records['min_offset'], buf_start=records['min_offset'])
+    return res
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Convert trace files to csv or Parquet, in the same format as log2csv.py produces")
+    parser.add_argument('traces', nargs='+', help="Trace files")
+    parser.add_argument('-o', '--output', help="Path to the output file, '-' for stdout. Directories and *.parquet are Parquet datasets", default='./readv_times.csv')
+    parser.add_argument('-r', '--request_type', help="Type of the the request that should be extracted. Default is readv.", choices=OPS, default='readv')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    #Not imported at the top: grid jobs only ship this file, for writing traces
+    from columnar import COLUMNS, open_writer
+    cols = as_columns(load(args.traces), args.request_type)
+    writer = open_writer(args.output)
+    for row in zip(*(cols[name].tolist() for name in COLUMNS)):
+        writer.write(row)
+    writer.close()
@@ -1,51 +1,119 @@
 #!/usr/bin/env python3
+"""
+Per-file statistics of XrdCephOssBufferedFile from gateway logs: client read ops against Ceph read ops.
+
+Every "ceph_close: closed fd N" line starts a new record for the fd (its open sequence), CephIOAdapterRaw::Summary
+lines for the fd that follow are added to it. A record is complete when the fd is closed again or at the end
+of the input, then it is added to the totals of its file. Logs are read line by line (stdin or files), only the
+records of open fds and the totals are kept, so multi-day logs can be piped through:
+
+    zcat xrootd.log-*.gz | ./cache_analyze.py -r '.*/lhcb/.*'
+"""
 import argparse
 import sys
 import re
 
-def do_print(res, rexp=None):
-    max_name_len = 1
-    for fds in res:
-        for k, v in fds.items():
-            if rexp is None or re.match(rexp, v['filename']):
-                if len(v['filename']) > max_name_len:
-                    max_name_len = len(v['filename'])
-    format_string = '{{0:{0}}} {{1:10}} {{2:10}} {{3:10.2f}} {{4:15}}'.format(max_name_len + 5)
-    for fds in res:
-        for fd, stats in fds.items():
-            if rexp is None or re.match(rexp, stats['filename']):
-                print(format_string.format(stats['filename'], stats['ceph_count'], stats['read_count'], (1 - stats['ceph_count']/stats['read_count']) * 100, stats['bytes_read']))
+
+CLOSE_MARK = 'ceph_close: closed fd '
+SUMMARY_MARK = 'CephIOAdapterRaw::Summary fd:'
+#Matched at the position of the marks
+CLOSE_RE = re.compile(r'ceph_close: closed fd ([0-9]+) for file ([^ ]*), read ops count ([0-9]+),')
+SUMMARY_RE = re.compile(r'CephIOAdapterRaw::Summary fd:([0-9]+).*nread:([0-9]+).*bytesread:([0-9]+)')
+
+
+class Totals:
+    "Aggregated records of a file"
+    def __init__(self):
+        self.opens = 0
+        self.read_count = 0
+        self.ceph_count = 0
+        self.bytes_read = 0
+
+    def add(self, rec):
+        self.opens += 1
+        self.read_count += rec['read_count']
+        self.ceph_count += rec['ceph_count']
+        self.bytes_read += rec['bytes_read']
+
+    @property
+    def hit_ratio(self):
+        "Share of client reads that did not go to Ceph, percent"
+        return (1 - self.ceph_count / self.read_count) * 100 if self.read_count else 0.0
+
+    @property
+    def ceph_per_read(self):
+        return self.ceph_count / self.read_count if self.read_count else 0.0
+
+
+def parse(lines, on_record):
+    "Call on_record(record) for every complete close record. Returns number of summaries without a close record"
+    pending = {}
+    seq = {}
+    orphans = 0
+    for line in lines:
+        pos = line.find(CLOSE_MARK)
+        if pos >= 0:
+            m = CLOSE_RE.match(line, pos)
+            if m:
+                fd = int(m.group(1))
+                if fd in pending:
+                    on_record(pending[fd])
+                seq[fd] = seq.get(fd, -1) + 1
+                pending[fd] = {'fd': fd, 'seq': seq[fd], 'filename': m.group(2), 'read_count': int(m.group(3)), 'ceph_count': 0, 'bytes_read': 0}
+            continue
+
+        pos = line.find(SUMMARY_MARK)
+        if pos >= 0:
+            m = SUMMARY_RE.match(line, pos)
+            if m:
+                rec = pending.get(int(m.group(1)))
+                if rec is None:
+                    orphans += 1
+                    continue
+                rec['ceph_count'] += int(m.group(2))
+                rec['bytes_read'] += int(m.group(3))
+    for rec in pending.values():
+        on_record(rec)
+    return orphans
+
+
+def do_print(totals, fd=sys.stdout):
+    max_name_len = max([len(name) for name in totals] + [1])
+    format_string = '{{0:{0}}} {{1:>8}} {{2:>10}} {{3:>10}} {{4:>10}} {{5:>10}} {{6:>15}}'.format(max_name_len + 5)
+    print(format_string.format('file', 'opens', 'reads', 'ceph_ops', 'hit, %', 'ceph/read', 'bytes_read'), file=fd)
+    for name, stats in sorted(totals.items()):
+        print(format_string.format(name, stats.opens, stats.read_count, stats.ceph_count, '{0:.2f}'.format(stats.hit_ratio), '{0:.3f}'.format(stats.ceph_per_read), stats.bytes_read), file=fd)
 
 
 def parse_args():
     parser = argparse.ArgumentParser()
+    parser.add_argument('logs', nargs='*', help="Log files. Default is stdin")
     parser.add_argument('-r', '--rexp', help="Only select filename(s) that matches this regexp (python regexp)", default=None)
+    parser.add_argument('-p', '--per_open', help="Also print every record as soon as it is complete", action='store_true')
     return parser.parse_args()
 
 
+def read_lines(paths):
+    if not paths:
+        yield from sys.stdin
+    for path in paths:
+        with open(path, errors='replace') as fd:
+            yield from fd
+
+
 if __name__ == '__main__':
-    res = []
-    fds = {}
-    last_fd = -1
-    fd = last_fd
     args = parse_args()
-    for line in sys.stdin:
-        m = re.match('.*ceph_close: closed fd ([0-9]+) for file ([^ ]*), read ops count ([0-9]+),.*', line)
-        if m:
-            fd = int(m.group(1))
-            if fd < last_fd:
-                res.append(fds)
-                fds = {}
-            filename = m.group(2)
-            read_count = int(m.group(3))
-            fds[fd] = { 'read_count': read_count, 'ceph_count': 0, 'filename': filename, 'bytes_read': 0 }
-            last_fd = fd
-
-        m = re.match('.*. CephIOAdapterRaw::Summary fd:([0-9]+).*nread:([0-9]+).*bytesread:([0-9]+)', line)
-        if m:
-            fd = int(m.group(1))
-            read_count = int(m.group(2))
-            fds[fd]['ceph_count'] += read_count
-            fds[fd]['bytes_read'] += int(m.group(3))
-
-    do_print(res, rexp=args.rexp)
+    rexp = re.compile(args.rexp) if args.rexp else None
+    totals = {}
+
+    def on_record(rec):
+        if rexp is not None and not rexp.match(rec['filename']):
+            return
+        if args.per_open:
+            print('{filename} fd {fd} seq {seq}: reads {read_count} ceph_ops {ceph_count} bytes_read {bytes_read}'.format(**rec), flush=True)
+        totals.setdefault(rec['filename'], Totals()).add(rec)
+
+    orphans = parse(read_lines(args.logs), on_record)
+    do_print(totals)
+    if orphans:
+        print("{0} summary lines without a preceding close of their fd".format(orphans), file=sys.stderr)
@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+"""
+Submit a campaign of test jobs and harvest their records, without the serial submit-then-dump cycle.
+
+Jobs are submitted as parametric jobs of --batch jobs each (see submit.py), --threads submissions at a time.
+Every job gets its number as the argument. Their statuses are then queried with bulk getJobStatus calls of at most
+--query_size jobs. While no job changes state, the delay between polls doubles, from --interval up to --max_interval;
+it is reset when some job does. Jobs DIRAC does not know are dropped, and polling stops after --max_failures polls
+in a row with failed queries.
+As soon as jobs reach a terminal state, their attributes and parameters are fetched and written:
+
+    -a FILE     attribute dump, as read by job_analyse/merge.py -t attributes
+    -r FILE     parameter dump, as read by job_analyse/merge.py -t parameters
+    -o FILE     job store (job_analyse/job_store.py), with the records merge.py -t all produces.
+                job_analyse must be in PYTHONPATH for it.
+
+    PYTHONPATH=../job_analyse ./bulk_submit.py -N 500 -b 50 -s LCG.RAL.uk -a attrs.txt -r params.txt -o jobs.db test.sh
+"""
+import sys
+import time
+import argparse
+
+from concurrent.futures import ThreadPoolExecutor
+
+from submit import add_job_args, check_dirac, make_job, submit, Dirac
+
+
+#Same as in job_analyse/merge.py
+TERMINAL_STATES = ['Done', 'Failed', 'Rescheduled', 'Completed']
+DEF_BATCH = 50
+DEF_THREADS = 8
+DEF_QUERY_SIZE = 500
+DEF_INTERVAL = 30
+DEF_MAX_INTERVAL = 600
+DEF_MAX_FAILURES = 5
+
+
+def submit_all(dirac, executable, njobs, batch=DEF_BATCH, threads=DEF_THREADS, job_class=None, **job_args):
+    "Submit njobs jobs in parametric batches over a thread pool. Returns the job IDs, failed batches are reported to stderr"
+    starts = list(range(0, njobs, batch))
+
+    def submit_batch(start):
+        job = make_job(executable, multiple=min(batch, njobs - start), first_arg=start, job_class=job_class, **job_args)
+        return submit(dirac, job)
+
+    ids = []
+    with ThreadPoolExecutor(threads) as pool:
+        futures = [pool.submit(submit_batch, start) for start in starts]
+        for start, future in zip(starts, futures):
+            try:
+                ids.extend(future.result())
+            except Exception as e:
+                print("Batch of jobs {0}-{1} was not submitted: {2}".format(start, min(start + batch, njobs) - 1, e), file=sys.stderr)
+    return ids
+
+
+def wait_jobs(dirac, ids, on_terminal, interval=DEF_INTERVAL, max_interval=DEF_MAX_INTERVAL, query_size=DEF_QUERY_SIZE, timeout=None,
+              max_failures=DEF_MAX_FAILURES, sleep=time.sleep):
+    """
+    Poll job statuses with bulk queries until all jobs are in a terminal state, or timeout seconds passed,
+    or max_failures polls in a row had failed queries.
+    on_terminal({JobID: status}) is called with jobs that reached a terminal state after every poll.
+    Jobs missing from a successful reply are not polled anymore.
+    Returns IDs of jobs that are not finished, including the missing ones.
+    """
+    pending = sorted(set(int(x) for x in ids))
+    missing = set()
+    delay = interval
+    failures = 0
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while pending:
+        finished = {}
+        failed = False
+        for pos in range(0, len(pending), query_size):
+            query = pending[pos:pos + query_size]
+            result = dirac.getJobStatus(query)
+            if not result['OK']:
+                print("Status query failed: {0}".format(result.get('Message', result)), file=sys.stderr)
+                failed = True
+                continue
+            value = {int(job_id): val for job_id, val in result['Value'].items()}
+            lost = [x for x in query if x not in value]
+            if lost:
+                print("Jobs unknown to DIRAC, not polled anymore: {0}".format(','.join(str(x) for x in lost)), file=sys.stderr)
+                missing.update(lost)
+            for job_id, val in value.items():
+                if val.get('Status') in TERMINAL_STATES:
+                    finished[job_id] = val['Status']
+        failures = failures + 1 if failed else 0
+        if finished:
+            on_terminal(finished)
+            delay = interval
+        else:
+            delay = min(delay * 2, max_interval)
+        pending = [x for x in pending if x not in finished and x not in missing]
+        if failures >= max_failures:
+            print("Status queries failed {0} times in a row, giving up".format(failures), file=sys.stderr)
+            break
+        if not pending or (deadline is not None and time.monotonic() + delay > deadline):
+            break
+        sleep(delay)
+    return sorted(set(pending) | missing)
+
+
+def fetch_records(dirac, statuses, threads=DEF_THREADS):
+    """
+    (attributes, parameters) dicts by JobID for the jobs: attributes one job per call over a thread pool,
+    parameters with a single bulk call. Parameters get JobID and Status, so that merge.py can use them.
+    """
+    ids = sorted(statuses)
+
+    def get_attrs(job_id):
+        result = dirac.getJobAttributes(job_id)
+        return result['Value'] if result['OK'] else {'JobID': job_id, 'Status': statuses[job_id]}
+
+    with ThreadPoolExecutor(threads) as pool:
+        attrs = dict(zip(ids, pool.map(get_attrs, ids)))
+
+    result = dirac.getJobParameters(ids)
+    value = result['Value'] if result['OK'] else {}
+    if len(ids) == 1 and ids[0] not in value and str(ids[0]) not in value:
+        #Parameters of a single job are not keyed by its ID
+        value = {ids[0]: value}
+    value = {int(k): v for k, v in value.items()}
+    params = {}
+    for job_id in ids:
+        par = dict(value.get(job_id) or {})
+        par.setdefault('JobID', job_id)
+        par.setdefault('Status', attrs[job_id].get('Status', statuses[job_id]))
+        params[job_id] = par
+    return attrs, params
+
+
+class RecordWriter:
+    "Writes harvested records to dumps in the formats merge.py parses, and/or to a job store"
+    def __init__(self, attrs_path=None, params_path=None, store_path=None):
+        self.attrs_fd = open(attrs_path, 'a') if attrs_path else None
+        self.params_fd = open(params_path, 'a') if params_path else None
+        self.store = None
+        if store_path:
+            from job_store import JobStore
+            self.store = JobStore(store_path)
+
+    def write(self, attrs, params):
+        for job_id in sorted(params):
+            if self.attrs_fd:
+                print('=' * 80, file=self.attrs_fd)
+                print('JobID {0}'.format(job_id), file=self.attrs_fd)
+                print(repr(attrs[job_id]), file=self.attrs_fd)
+            if self.params_fd:
+                print(repr({job_id: params[job_id]}), file=self.params_fd)
+        for fd in (self.attrs_fd, self.params_fd):
+            if fd:
+                fd.flush()
+        if self.store is not None:
+            #Same records as merge.py -t all
+            records = []
+            for job_id in sorted(params):
+                rec = dict(params[job_id])
+                for key in ('ApplicationStatus', 'Owner'):
+                    if key in attrs[job_id]:
+                        rec[key] = attrs[job_id][key]
+                records.append(rec)
+            self.store.add(records, replace=True)
+
+    def close(self):
+        for fd in (self.attrs_fd, self.params_fd):
+            if fd:
+                fd.close()
+        if self.store is not None:
+            self.store.close()
+
+
+def run(dirac, ids, writer, threads=DEF_THREADS, **wait_args):
+    "Wait for the jobs and write records of finished ones as they come. Returns IDs of unfinished jobs"
+    def on_terminal(statuses):
+        writer.write(*fetch_records(dirac, statuses, threads))
+        print("{0} jobs finished".format(len(statuses)), file=sys.stderr)
+    return wait_jobs(dirac, ids, on_terminal, **wait_args)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-N', '--njobs', help="Number of jobs to submit. Default is 1", type=int, default=1)
+    parser.add_argument('-b', '--batch', help="Jobs per parametric job. Default is {0}".format(DEF_BATCH), type=int, default=DEF_BATCH)
+    parser.add_argument('-t', '--threads', help="Concurrent DIRAC calls. Default is {0}".format(DEF_THREADS), type=int, default=DEF_THREADS)
+    parser.add_argument('-J', '--job_ids', help="Comma-separated IDs of already submitted jobs to harvest, nothing is submitted", default=None)
+    parser.add_argument('-q', '--query_size', help="Max jobs per status query. Default is {0}".format(DEF_QUERY_SIZE), type=int, default=DEF_QUERY_SIZE)
+    parser.add_argument('-i', '--interval', help="Initial delay between polls, seconds. Default is {0}".format(DEF_INTERVAL), type=float, default=DEF_INTERVAL)
+    parser.add_argument('-I', '--max_interval', help="Max delay between polls, seconds. Default is {0}".format(DEF_MAX_INTERVAL), type=float, default=DEF_MAX_INTERVAL)
+    parser.add_argument('-F', '--max_failures', help="Stop after this many polls in a row with failed status queries. Default is {0}".format(DEF_MAX_FAILURES), type=int, default=DEF_MAX_FAILURES)
+    parser.add_argument('-w', '--timeout', help="Stop waiting after this many seconds. Default is to wait for all jobs", type=float, default=None)
+    parser.add_argument('-a', '--attributes', help="Append attributes of finished jobs to this dump", default=None)
+    parser.add_argument('-r', '--parameters', help="Append parameters of finished jobs to this dump", default=None)
+    parser.add_argument('-o', '--output', help="Add records of finished jobs to this job store", default=None)
+    add_job_args(parser)
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    check_dirac()
+    dirac = Dirac()
+    if args.job_ids:
+        ids = [int(x) for x in args.job_ids.split(',') if x]
+    else:
+        ids = submit_all(dirac, args.executable, args.njobs, args.batch, args.threads,
+                         cpu_time=args.cpu_time, site=args.site, platform=args.platform, name=args.name)
+        print(','.join(str(x) for x in ids))
+        sys.stdout.flush()
+
+    writer = RecordWriter(args.attributes, args.parameters, args.output)
+    try:
+        left = run(dirac, ids, writer, args.threads, interval=args.interval, max_interval=args.max_interval,
+                   query_size=args.query_size, timeout=args.timeout, max_failures=args.max_failures)
+    finally:
+        writer.close()
+    if left:
+        print("Jobs not finished: {0}".format(','.join(str(x) for x in left)), file=sys.stderr)
+        sys.exit(1)
@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+import datetime
+
+from threading import Lock
+
+from bulk_submit import submit_all, wait_jobs, run, RecordWriter
+from job_store import JobStore, parse_dump
+from merge import merge, merge_attrs_and_params
+
+
+class StubJob:
+    "Records what the job factory sets"
+    def __init__(self):
+        self.args = None
+
+    def setParameterSequence(self, name, values):
+        self.args = values
+
+    def setExecutable(self, executable, arguments='', logFile=''):
+        if self.args is None and arguments:
+            self.args = [int(arguments)]
+
+    def __getattr__(self, name):
+        if name.startswith('set'):
+            return lambda *args, **kwargs: None
+        raise AttributeError(name)
+
+
+class StubDirac:
+    """
+    Jobs go Waiting -> Running -> Done (Failed for every 5th job) after polls_to_finish status queries
+    that include them. Calls can come from several threads.
+    """
+    def __init__(self, polls_to_finish=3, fail_batches=()):
+        self.lock = Lock()
+        self.next_id = 1000
+        self.polls = {}
+        self.polls_to_finish = polls_to_finish
+        self.fail_batches = fail_batches
+        self.submitted = []
+        self.status_queries = []
+        self.fail_queries = False
+
+    def submitJob(self, job):
+        with self.lock:
+            if job.args and job.args[0] in self.fail_batches:
+                return {'OK': False, 'Message': 'Stub failure'}
+            parametric = job.args and len(job.args) > 1
+            count = len(job.args) if job.args else 1
+            ids = list(range(self.next_id, self.next_id + count))
+            self.next_id += count
+            self.submitted.append(job.args)
+            for job_id in ids:
+                self.polls[job_id] = 0
+        return {'OK': True, 'Value': ids if parametric else ids[0]}
+
+    def status(self, job_id):
+        polls = self.polls[job_id]
+        if polls < self.polls_to_finish:
+            return 'Waiting' if polls == 0 else 'Running'
+        return 'Failed' if job_id % 5 == 0 else 'Done'
+
+    def getJobStatus(self, ids):
+        with self.lock:
+            self.status_queries.append(list(ids))
+            if self.fail_queries:
+                return {'OK': False, 'Message': 'Stub failure'}
+            known = [job_id for job_id in ids if job_id in self.polls]
+            for job_id in known:
+                self.polls[job_id] += 1
+            return {'OK': True, 'Value': {job_id: {'Status': self.status(job_id), 'MinorStatus': '', 'Site': 'LCG.RAL.uk'} for job_id in known}}
+
+    def getJobAttributes(self, job_id):
+        return {'OK': True, 'Value': {'JobID': job_id, 'Status': self.status(job_id), 'ApplicationStatus': 'Unknown',
+                                      'Owner': 'tester', 'LastUpdateTime': datetime.datetime(2023, 1, 1, 12, 0, job_id % 60)}}
+
+    def getJobParameters(self, ids):
+        return {'OK': True, 'Value': {job_id: {'HostName': 'lcg{0}.gridpp.rl.ac.uk'.format(2200 + job_id % 500),
+                                               'TotalCPUTime(s)': str(job_id % 100), 'WallClockTime(s)': 100.0,
+                                               'timestamp': 1672574400000 + job_id} for job_id in ids}}
+
+
+def test_submit_batches():
+    dirac = StubDirac()
+    ids = submit_all(dirac, 'test.sh', 23, batch=5, threads=4, job_class=StubJob)
+    assert sorted(ids) == list(range(1000, 1023))
+    assert sorted(args[0] for args in dirac.submitted) == [0, 5, 10, 15, 20]
+    assert sorted(len(args) for args in dirac.submitted) == [3, 5, 5, 5, 5]
+
+
+def test_every_job_gets_its_number():
+    for njobs, batch in ((11, 5), (4, 1)):
+        dirac = StubDirac()
+        submit_all(dirac, 'test.sh', njobs, batch=batch, threads=2, job_class=StubJob)
+        assert sorted(x for args in dirac.submitted for x in args) == list(range(njobs))
+
+
+def test_failed_batch_is_skipped(capsys):
+    dirac = StubDirac(fail_batches=(5,))
+    ids = submit_all(dirac, 'test.sh', 15, batch=5, threads=2, job_class=StubJob)
+    assert len(ids) == 10
+    assert 'Batch of jobs 5-9' in capsys.readouterr().err
+
+
+def test_bulk_polling_with_backoff():
+    dirac = StubDirac(polls_to_finish=4)
+    ids = submit_all(dirac, 'test.sh', 12, batch=4, threads=3, job_class=StubJob)
+    finished = {}
+    delays = []
+    left = wait_jobs(dirac, ids, finished.update, interval=1, max_interval=4, query_size=5, sleep=delays.append)
+    assert left == []
+    assert sorted(finished) == sorted(ids)
+    assert all(len(query) <= 5 for query in dirac.status_queries)
+    #3 queries per poll, nothing changes for 3 polls, then everything finishes
+    assert len(dirac.status_queries) == 4 * 3
+    assert delays == [2, 4, 4]
+
+
+def test_timeout_returns_pending():
+    dirac = StubDirac(polls_to_finish=100)
+    ids = submit_all(dirac, 'test.sh', 3, batch=3, job_class=StubJob)
+    left = wait_jobs(dirac, ids, lambda statuses: None, interval=10, max_interval=10, timeout=0, sleep=lambda x: None)
+    assert left == sorted(ids)
+
+
+def test_unknown_jobs_are_dropped(capsys):
+    dirac = StubDirac(polls_to_finish=2)
+    ids = submit_all(dirac, 'test.sh', 4, batch=4, job_class=StubJob)
+    finished = {}
+    left = wait_jobs(dirac, ids + [42], finished.update, interval=1, max_interval=1, sleep=lambda x: None)
+    assert left == [42]
+    assert sorted(finished) == sorted(ids)
+    assert '42' in capsys.readouterr().err
+
+
+def test_failing_queries_stop_polling():
+    dirac = StubDirac()
+    dirac.fail_queries = True
+    ids = submit_all(dirac, 'test.sh', 3, batch=3, job_class=StubJob)
+    left = wait_jobs(dirac, ids, lambda statuses: None, interval=1, max_interval=1, max_failures=3, sleep=lambda x: None)
+    assert left == sorted(ids)
+    assert len(dirac.status_queries) == 3
+
+
+def test_records_for_merge(tmp_path):
+    dirac = StubDirac(polls_to_finish=2)
+    ids = submit_all(dirac, 'test.sh', 30, batch=7, threads=4, job_class=StubJob)
+    attrs_path, params_path, store_path = tmp_path / 'attrs.txt', tmp_path / 'params.txt', tmp_path / 'jobs.db'
+    writer = RecordWriter(str(attrs_path), str(params_path), str(store_path))
+    left = run(dirac, ids, writer, threads=4, interval=1, max_interval=1, sleep=lambda x: None)
+    writer.close()
+    assert left == []
+
+    attrs = merge([parse_dump(str(attrs_path), 'attrs')])
+    params = merge([parse_dump(str(params_path), 'params')])
+    assert sorted(job['JobID'] for job in attrs) == sorted(ids)
+    assert attrs[0]['LastUpdateTime'].year == 2023
+    merge_attrs_and_params(attrs, params)
+
+    with JobStore(str(store_path)) as store:
+        assert len(store) == len(ids)
+        for job in params:
+            rec = store.get(job['JobID'])
+            assert rec['Owner'] == 'tester'
+            assert rec['HostName'] == job['HostName']
+            assert rec['Status'] == ('Failed' if job['JobID'] % 5 == 0 else 'Done')
+        assert len(list(store.select(status='Failed'))) == len([x for x in ids if x % 5 == 0])
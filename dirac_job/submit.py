@@ -1,44 +1,83 @@
 #!/usr/bin/env python3
 import argparse
 
-from DIRAC.Interfaces.API.Dirac import Dirac
-from DIRAC.Interfaces.API.Job import Job
+try:
+    from DIRAC.Interfaces.API.Dirac import Dirac
+    from DIRAC.Interfaces.API.Job import Job
+except ImportError:
+    Dirac = Job = None
 
 DEF_CPUTIME = 300
 DEF_JOBNAME = "test_job"
 
 
-def parse_args():
-    parser = argparse.ArgumentParser()
+def check_dirac():
+    if Dirac is None:
+        raise RuntimeError("DIRAC client is required, set up the DIRAC environment first")
+
+
+def add_job_args(parser):
+    "Options that describe the job, shared with bulk_submit.py"
     parser.add_argument('-s', '--site', help="Site to run job on")
     parser.add_argument('-p', '--platform', help="Platform to use. Default is any platform available", default=None)
     parser.add_argument('-n', '--name', help="Job name. Default is {0}".format(DEF_JOBNAME), default=DEF_JOBNAME)
-    parser.add_argument('-m', '--multiple', help="Submit multiple jobs with the same script. Value gives the number of jobs to submit", type=int, default=1)
     parser.add_argument('-c', '--cpu_time', help="CPU Time for the job. Default is {0}".format(DEF_CPUTIME), default=DEF_CPUTIME, type=int)
     parser.add_argument('executable', help="Script to run")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-m', '--multiple', help="Submit multiple jobs with the same script. Value gives the number of jobs to submit", type=int, default=1)
+    add_job_args(parser)
     return parser.parse_args()
-    
 
-if __name__ == '__main__':
-    args = parse_args()
-    j = Job()
-    j.setCPUTime(args.cpu_time)
-    if args.site:
-        j.setDestination(args.site)
-
-    if args.multiple > 1:
-        j.setInputSandbox(args.executable)
-        j.setParameterSequence("args", [x for x in range(args.multiple)])
-        j.setExecutable(args.executable, arguments="%(args)", logFile="app_log.log")
+
+def make_job(executable, cpu_time=DEF_CPUTIME, site=None, platform=None, name=DEF_JOBNAME, multiple=1, first_arg=None, job_class=None):
+    """
+    Job object for the executable. If multiple > 1, it is a parametric job: the executable is run multiple times,
+    with arguments first_arg, first_arg + 1, ... (from 0 if first_arg is None).
+    A single job gets first_arg as its argument, if it is given.
+    """
+    if job_class is None:
+        check_dirac()
+        job_class = Job
+    j = job_class()
+    j.setCPUTime(cpu_time)
+    if site:
+        j.setDestination(site)
+
+    if multiple > 1:
+        j.setInputSandbox(executable)
+        first_arg = first_arg or 0
+        j.setParameterSequence("args", [x for x in range(first_arg, first_arg + multiple)])
+        j.setExecutable(executable, arguments="%(args)", logFile="app_log.log")
         j.setOutputSandbox(['app_log.log', 'std.out', 'std.err'])
+    elif first_arg is not None:
+        j.setExecutable(executable, arguments=str(first_arg))
     else:
-        j.setExecutable(args.executable)
+        j.setExecutable(executable)
+
+    if platform:
+        j.setPlatform(platform)
 
-    if args.platform:
-        j.setPlatform(args.platform)
+    j.setName(name)
+    return j
 
-    j.setName(args.name)
 
+def submit(dirac, job):
+    "Submit the job, return the list of job IDs (several for parametric jobs)"
+    result = dirac.submitJob(job)
+    if not result['OK']:
+        raise RuntimeError("Failed to submit: {0}".format(result))
+    value = result['Value']
+    return [int(x) for x in value] if isinstance(value, (list, tuple)) else [int(value)]
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    j = make_job(args.executable, args.cpu_time, args.site, args.platform, args.name, args.multiple)
+
+    check_dirac()
     dirac = Dirac()
     result = dirac.submitJob(j)
     if result['OK']:
@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+"""
+asyncio versions of the file access clients.
+
+Requests are submitted through the XRootD callback interface, so many of them can be in flight at the same time.
+Number of requests in flight is limited by a semaphore, that can be shared by several clients.
+"""
+import asyncio
+import sys
+
+from abc import ABC, abstractmethod
+
+from XRootD import client as xrd_client
+
+from file_access_clients import PyXrootdClient
+from readv_planner import ReadvPlan
+
+
+DEF_CONCURRENCY = 128
+
+
+class AsyncFileAccessClient(ABC):
+    def __init__(self, url, concurrency=DEF_CONCURRENCY, limiter=None):
+        """
+        concurrency: maximum number of requests in flight.
+        limiter: asyncio.Semaphore to use instead of a private one, to limit number of requests for several clients together.
+        """
+        self.url = url
+        self.limiter = asyncio.Semaphore(concurrency) if limiter is None else limiter
+
+    @abstractmethod
+    async def read(self, chunks):
+        pass
+
+    @abstractmethod
+    async def readv(self, chunks):
+        pass
+
+    @abstractmethod
+    async def stat_file(self):
+        pass
+
+    async def close(self):
+        pass
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+
+def _set_result(fut, status, response):
+    if not fut.cancelled():
+        fut.set_result( (status, response) )
+
+
+class AsyncPyXrootdClient(AsyncFileAccessClient):
+    def __init__(self, url, concurrency=DEF_CONCURRENCY, limiter=None, readv_gap=None):
+        super().__init__(url, concurrency, limiter)
+        #Synchronous client is only used to get server limits (they are cached there)
+        self.sync_client = PyXrootdClient(url)
+        self.readv_gap = readv_gap
+        self.file = None
+        self.open_lock = asyncio.Lock()
+
+    @staticmethod
+    async def _call(method, *args, **kwargs):
+        "Call XRootD method with a callback and wait for the response"
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        #Callback is executed in one of XRootD threads, pass result to the event loop
+        callback = lambda status, response, hostlist: loop.call_soon_threadsafe(_set_result, fut, status, response)
+        st = method(*args, callback=callback, **kwargs)
+        if not st.ok:
+            return st, None
+        return await fut
+
+    async def _get_file(self):
+        async with self.open_lock:
+            if self.file is None:
+                f = xrd_client.File()
+                async with self.limiter:
+                    st, _ = await self._call(f.open, self.url)
+                if not st.ok:
+                    raise RuntimeError("Can not open file {0}: {1}".format(self.url, st))
+                self.file = f
+        return self.file
+
+    async def _read_chunk(self, f, off, sz):
+        async with self.limiter:
+            st, res = await self._call(f.read, offset=off, size=sz)
+        if not st.ok:
+            raise RuntimeError("Can not read file {0} at {1},{2}: {3}".format(self.url, off, sz, st))
+        return res
+
+    async def _vector_read(self, f, chunks):
+        async with self.limiter:
+            st, res = await self._call(f.vector_read, chunks=chunks)
+        if not st.ok:
+            print("Error while reading chunks {0}".format(chunks), file=sys.stderr)
+            raise RuntimeError("Can not readv file {0}: {1}".format(self.url, st))
+        return [chk.buffer for chk in res.chunks]
+
+    async def read(self, chunks):
+        f = await self._get_file()
+        return await asyncio.gather(*(self._read_chunk(f, off, sz) for off, sz in chunks))
+
+    async def readv(self, chunks):
+        f = await self._get_file()
+        limits = await asyncio.get_running_loop().run_in_executor(None, self.sync_client.get_server_limits)
+        plan = ReadvPlan(chunks, *limits, gap=self.readv_gap)
+        res = await asyncio.gather(*(self._vector_read(f, req) for req in plan.requests))
+        return plan.assemble(res)
+
+    async def stat_file(self):
+        f = await self._get_file()
+        async with self.limiter:
+            st, res = await self._call(f.stat, force=True)
+        if not st.ok:
+            raise RuntimeError("Can not stat file {0}: {1}".format(self.url, st))
+        return res
+
+    async def close(self):
+        async with self.open_lock:
+            if self.file is not None:
+                f, self.file = self.file, None
+                await self._call(f.close)
+
+
+async def read_many(urls, chunks, concurrency=DEF_CONCURRENCY, vector=False):
+    "Read the same chunks from several files at once, with at most concurrency requests in flight overall"
+    limiter = asyncio.Semaphore(concurrency)
+    clients = [AsyncPyXrootdClient(url, limiter=limiter) for url in urls]
+    try:
+        return await asyncio.gather(*( (cl.readv if vector else cl.read)(chunks) for cl in clients ))
+    finally:
+        await asyncio.gather(*(cl.close() for cl in clients))
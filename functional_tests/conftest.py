@@ -1,20 +1,144 @@
+"""
+Readv tests can be run in parallel with pytest-xdist:
+
+    pytest -n auto readv_test.py
+
+The test file is created and uploaded once, by the first worker that needs it, and deleted at the end
+of the session. All workers use the same seed, so they generate identical parametrisations.
+To reproduce a failure, rerun with the seed printed in the report header:
+
+    pytest --readv-seed <seed> 'readv_test.py::TestReadv::test_random_chunks[...]'
+
+If READV_TRACE is set, every xrootd request is written to the binary trace <READV_TRACE>.<worker id>,
+see analyze/trace_log.py. It must be importable, e.g.:
+
+    READV_TRACE=/tmp/readv PYTHONPATH=../analyze pytest readv_test.py
+
+If XRD_STANDIN_DIR is set, the controller starts a stand-in server (xrootd_standin.py) for that directory,
+over xroot and http, and sets TEST_FILE_URL and TEST_FILE_HTTPS_URL (the webdav fallback) for all workers.
+"""
+import os
 import os.path
+import sys
+import json
+import random
+import shutil
 
 import pytest
 
-@pytest.hookimpl(trylast=True)
-def pytest_collection_modifyitems(items):
-   #Make sure that test copy is our first test, and test_delete is the last one.
-   for idx, item in enumerate(items):
-       if item.name == 'test_copy':
-           break
+from tempfile import mkdtemp
+
+
+STANDIN_FILE_PATH = '/lhcb:user/a/arogovsk/readv_test_file'
+#Set by the controller for the stand-in server, passed to xdist workers
+STANDIN_ENV = ['TEST_FILE_URL', 'TEST_FILE_HTTPS_URL', 'FILE_BLOCK_SIZE']
+
+
+def pytest_addoption(parser):
+    parser.addoption('--readv-seed', type=int, default=None, help="Seed for the test file content and random chunks. Default is $TEST_SEED or a random one")
+
+
+def pytest_configure(config):
+    config.addinivalue_line('markers', 'readv: tests that compare read and readv results')
+    config.addinivalue_line('markers', 'slow: tests with many parametrisations')
+
+    if hasattr(config, 'workerinput'):
+        #xdist worker: use the controller's seed and shared directory
+        config.readv_seed = config.workerinput['readv_seed']
+        config.readv_shared_dir = config.workerinput['readv_shared_dir']
+    else:
+        seed = config.getoption('readv_seed')
+        if seed is None:
+            seed = int(os.environ['TEST_SEED']) if 'TEST_SEED' in os.environ else random.randint(0, 2**32)
+        config.readv_seed = seed
+        config.readv_shared_dir = mkdtemp(prefix='readv_test_', dir=os.environ.get('READV_TMPDIR'))
+    #Module-level random parameters must be the same on all workers, otherwise xdist refuses to run
+    random.seed(config.readv_seed)
+
+    #If XRD_STANDIN_DIR is set, run tests against a local stand-in server that serves files from that directory
+    #over xroot and http. It is started once by the controller, workers get its urls.
+    if hasattr(config, 'workerinput'):
+        os.environ.update(config.workerinput['readv_standin_env'])
+    elif os.environ.get('XRD_STANDIN_DIR'):
+        config.readv_standin = start_standin(os.environ['XRD_STANDIN_DIR'])
+
+    trace = os.environ.get('READV_TRACE')
+    if trace:
+        from file_access_clients import PyXrootdClient
+        from trace_log import TraceWriter
+        worker = config.workerinput['workerid'] if hasattr(config, 'workerinput') else 'main'
+        config.readv_tracer = TraceWriter('{0}.{1}'.format(trace, worker))
+        PyXrootdClient.default_tracer = config.readv_tracer
+
+
+def start_standin(directory):
+    "Start stand-in xroot and http servers, set test urls in the environment. Returns the servers"
+    from xrootd_standin import Faults, HTTPServer, Storage, XrootdServer, start_server
+    faults = Faults(
+            latency=float(os.environ.get('XRD_STANDIN_LATENCY', 0)),
+            error_rate=float(os.environ.get('XRD_STANDIN_ERROR_RATE', 0))
+        )
+    storage = Storage(directory)
+    servers = [XrootdServer(('localhost', 0), storage, faults), HTTPServer(('localhost', 0), storage, faults)]
+    for srv in servers:
+        start_server(srv)
+    os.environ['TEST_FILE_URL'] = 'root://localhost:{0}{1}'.format(servers[0].server_address[1], STANDIN_FILE_PATH)
+    os.environ['TEST_FILE_HTTPS_URL'] = 'http://localhost:{0}{1}'.format(servers[1].server_address[1], STANDIN_FILE_PATH)
+    os.environ.setdefault('FILE_BLOCK_SIZE', str(4*1024*1024))
+    return servers
+
+
+def pytest_unconfigure(config):
+    tracer = getattr(config, 'readv_tracer', None)
+    if tracer is not None:
+        tracer.close()
+    for srv in getattr(config, 'readv_standin', []):
+        srv.shutdown()
+        srv.server_close()
+
+
+@pytest.hookimpl(optionalhook=True)
+def pytest_configure_node(node):
+    node.workerinput['readv_seed'] = node.config.readv_seed
+    node.workerinput['readv_shared_dir'] = node.config.readv_shared_dir
+    node.workerinput['readv_standin_env'] = {name: os.environ[name] for name in STANDIN_ENV if name in os.environ}
+
+
+def pytest_report_header(config):
+    return "readv seed: {0} (rerun with --readv-seed {0})".format(config.readv_seed)
+
+
+@pytest.fixture(autouse=True)
+def reseed(request):
+    "Every test gets its own random sequence, independent of the worker and of the order of tests"
+    random.seed('{0}:{1}'.format(request.config.readv_seed, request.node.nodeid))
+
 
-   if idx != 0:
-       items[0], items[idx] = items[idx], items[0]
+def pytest_sessionfinish(session, exitstatus):
+    #Only the controller (or the only process without xdist) cleans up, after all the workers are done
+    config = session.config
+    if hasattr(config, 'workerinput'):
+        return
+    state_path = os.path.join(config.readv_shared_dir, 'state.json')
+    if os.path.exists(state_path):
+        from file_access_clients import make_client
+        with open(state_path) as fd:
+            state = json.load(fd)
+        if state['upload_res'] == 0:
+            res, message = make_client(os.environ.get('TEST_FILE_URL', state['url']), https_url=os.environ.get('TEST_FILE_HTTPS_URL')).delete_file()
+            config.readv_delete_result = (res, message)
+            if res != 0:
+                session.exitstatus = pytest.ExitCode.TESTS_FAILED
+    if session.testsfailed == 0:
+        shutil.rmtree(config.readv_shared_dir, ignore_errors=True)
 
-   for idx, item in enumerate(items):
-       if item.name == 'test_delete':
-           break
 
-   if idx != len(items) - 1:
-       items[-1], items[idx] = items[idx], items[-1]
+def pytest_terminal_summary(terminalreporter, config):
+    #Only if some test used the xrootd clients, they can not be imported without XRootD
+    clients = sys.modules.get('file_access_clients')
+    if clients is not None:
+        terminalreporter.write_line("xrootd handle pool: {0}".format(clients.PyXrootdClient.default_pool.stats))
+        clients.PyXrootdClient.default_pool.close_all()
+    if hasattr(config, 'readv_delete_result'):
+        res, message = config.readv_delete_result
+        terminalreporter.write_line("Test file deletion {0}: {1}".format('succeeded' if res == 0 else 'FAILED', message))
@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+"""
+Interface of the file access clients. It does not need the XRootD bindings, so that clients of other protocols
+(https_client.py) can be used without them.
+"""
+from abc import ABC, abstractmethod
+
+try:
+    from urlparse import urlparse
+except ImportError:
+    from urllib.parse import urlparse
+
+
+class FileAccessClient(ABC):
+    def __init__(self, url):
+        self.url = url
+        purl = urlparse(self.url)
+        self.protocol = purl.scheme
+        self.netloc = purl.netloc
+        self.path = purl.path
+
+    @property
+    def server_url(self):
+        return self.protocol + '://' + self.netloc
+
+    @abstractmethod
+    def read(self, chunks):
+        pass
+
+    @abstractmethod
+    def readv(self, chunks):
+        pass
+
+    @abstractmethod
+    def upload_file(self, local_path):
+        pass
+
+    @abstractmethod
+    def download_file(self, local_path):
+        pass
+
+    @abstractmethod
+    def delete_file(self):
+        pass
+
+    @abstractmethod
+    def stat_file(self):
+        pass
+
+    @abstractmethod
+    def get_file_checksum(self):
+        pass
+
+    def get_max_iov(self):
+        pass
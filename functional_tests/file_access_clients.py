@@ -1,62 +1,19 @@
 #!/usr/bin/env python
 #from __future__ import print_function
 import re
+import time
 import subprocess
 
-from abc import ABC, abstractmethod
+from collections import OrderedDict
+from contextlib import contextmanager
+from threading import Lock, Thread
+from concurrent.futures import Future, ThreadPoolExecutor, wait, FIRST_COMPLETED
 
 from XRootD import client as xrd_client
 from XRootD.client.flags import QueryCode
 
-
-try:
-    from urlparse import urlparse
-except ImportError:
-    from urllib.parse import urlparse
-
-
-class FileAccessClient(ABC):
-    def __init__(self, url):
-        self.url = url
-        purl = urlparse(self.url)
-        self.protocol = purl.scheme
-        self.netloc = purl.netloc
-        self.path = purl.path
-
-    @property
-    def server_url(self):
-        return self.protocol + '://' + self.netloc
-
-    @abstractmethod
-    def read(self, chunks):
-        pass
-
-    @abstractmethod
-    def readv(self, chunks):
-        pass
-
-    @abstractmethod
-    def upload_file(self, local_path):
-        pass
-
-    @abstractmethod
-    def download_file(self, local_path):
-        pass
-
-    @abstractmethod
-    def delete_file(self):
-        pass
-
-    @abstractmethod
-    def stat_file(self):
-        pass
-
-    @abstractmethod
-    def get_file_checksum(self):
-        pass
-
-    def get_max_iov(self):
-        pass
+from file_access_base import FileAccessClient
+from readv_planner import ReadvPlan
 
 
 class GfalCMDClient(FileAccessClient):
@@ -108,40 +65,181 @@ class GfalCMDClient(FileAccessClient):
 
 
 
+class FilePool:
+    """
+    Pool of open xrootd file handles, keyed by url.
+
+    Handles are kept open between calls and reused. Handles that were not used for idle_timeout
+    seconds are closed, and if there are more than max_open handles the least recently used one is closed.
+    Handles that are checked out by handle() are never closed under their users: they are skipped by
+    expiration, and closed on release if they were invalidated meanwhile.
+    """
+    def __init__(self, max_open=16, idle_timeout=300):
+        self.max_open = max_open
+        self.idle_timeout = idle_timeout
+        self.handles = OrderedDict()
+        #Number of users of every checked out handle, and handles to close when the last one is done
+        self.in_use = {}
+        self.to_close = set()
+        self.lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _close(f):
+        try:
+            f.close()
+        except Exception:
+            pass
+
+    def _expire(self, now):
+        for url, (f, last_used) in list(self.handles.items()):
+            if now - last_used <= self.idle_timeout and len(self.handles) <= self.max_open:
+                break
+            if f in self.in_use:
+                continue
+            del self.handles[url]
+            self.evictions += 1
+            self._close(f)
+
+    def _checkout(self, f):
+        self.in_use[f] = self.in_use.get(f, 0) + 1
+        return f
+
+    def get(self, url):
+        "Open handle for the url. It is checked out, and must be given back with release()"
+        now = time.monotonic()
+        with self.lock:
+            self._expire(now)
+            if url in self.handles:
+                self.hits += 1
+                f, _ = self.handles.pop(url)
+                self.handles[url] = (f, now)
+                return self._checkout(f)
+
+        f = xrd_client.File()
+        st, _ = f.open(url)
+        if not st.ok:
+            raise RuntimeError("Can not open file {0}: {1}".format(url, st))
+
+        with self.lock:
+            self.misses += 1
+            if url in self.handles:
+                #Somebody opened the same url concurrently, use theirs
+                self._close(f)
+                f, _ = self.handles.pop(url)
+            self.handles[url] = (f, now)
+            self._checkout(f)
+            self._expire(now)
+        return f
+
+    def release(self, f):
+        with self.lock:
+            self.in_use[f] -= 1
+            if self.in_use[f] > 0:
+                return
+            del self.in_use[f]
+            if f not in self.to_close:
+                return
+            self.to_close.discard(f)
+        self._close(f)
+
+    def invalidate(self, url):
+        with self.lock:
+            try:
+                f, _ = self.handles.pop(url)
+            except KeyError:
+                return
+            if f in self.in_use:
+                self.to_close.add(f)
+                return
+        self._close(f)
+
+    @contextmanager
+    def handle(self, url):
+        f = self.get(url)
+        try:
+            yield f
+        except Exception:
+            self.invalidate(url)
+            raise
+        finally:
+            self.release(f)
+
+    def close_all(self):
+        with self.lock:
+            handles = [f for f, _ in self.handles.values() if f not in self.in_use]
+            self.to_close.update(f for f, _ in self.handles.values() if f in self.in_use)
+            self.handles.clear()
+        for f in handles:
+            self._close(f)
+
+    @property
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions, 'open': len(self.handles)}
+
+
 class PyXrootdClient(FileAccessClient):
+    #Shared by all clients, so that different client objects for the same url reuse the handle
+    default_pool = FilePool()
+    #(readv_iov_max, readv_ior_max) for every server we talked to
+    server_limits = {}
+    #TraceWriter used by clients created without an explicit tracer
+    default_tracer = None
+
+    def __init__(self, url, pool=None, readv_gap=None, readv_threads=4, tracer=None):
+        """
+        readv_gap: None (default) means that chunks are sent as they are, only split to fit server limits.
+                   Otherwise chunks are sorted, and the ones that are at most this number of bytes apart are read as a single chunk.
+        readv_threads: how many readv requests may be sent in parallel, if chunks do not fit in a single one.
+        tracer: TraceWriter (see analyze/trace_log.py) that gets a record for every request sent to the server.
+        """
+        super().__init__(url)
+        self.pool = self.default_pool if pool is None else pool
+        self.readv_gap = readv_gap
+        self.readv_threads = readv_threads
+        self.tracer = self.default_tracer if tracer is None else tracer
+
+    def _trace(self, op, f, start_ns, start, ok, chunks=()):
+        if self.tracer is not None:
+            self.tracer.record_chunks(op, self.tracer.handle_id(f), start_ns, time.perf_counter_ns() - start, ok, chunks)
+
     def read(self, chunks):
         res = []
-        with xrd_client.File() as f:
-            st, _ = f.open(self.url)
-            if not st.ok:
-                raise RuntimeError("Can not open file {0} for read: {1}".format(self.url, st))
-
+        with self.pool.handle(self.url) as f:
             for off, sz in chunks:
+                start_ns, start = time.time_ns(), time.perf_counter_ns()
                 st, tres = f.read(offset=off, size=sz)
+                self._trace('read', f, start_ns, start, st.ok, [(off, sz)])
                 if not st.ok:
                     raise RuntimeError("Can not read file {0} at {1},{2}: {3}".format(self.url, off, sz, st))
                 res.append(tres)
 
         return res
 
-    def readv(self, chunks):
-        res = []
-        with xrd_client.File() as f:
-            st, _ = f.open(self.url)
-            if not st.ok:
-                raise RuntimeError("Can not open file {0} for readv: {1}".format(self.url, st))
-
-            st, tres = f.vector_read(chunks)
-            if not st.ok:
-                print("Error while reading chunks {0}".format(chunks))
-                raise RuntimeError("Can not readv file {0}: {1}".format(self.url, st))
+    def _vector_read(self, f, chunks):
+        start_ns, start = time.time_ns(), time.perf_counter_ns()
+        st, tres = f.vector_read(chunks)
+        self._trace('readv', f, start_ns, start, st.ok, chunks)
+        if not st.ok:
+            print("Error while reading chunks {0}".format(chunks))
+            raise RuntimeError("Can not readv file {0}: {1}".format(self.url, st))
+        return [chk.buffer for chk in tres.chunks]
 
-        for chk in tres.chunks:
-            res.append(chk.buffer)
+    def readv(self, chunks):
+        plan = ReadvPlan(chunks, *self.get_server_limits(), gap=self.readv_gap)
+        with self.pool.handle(self.url) as f:
+            if len(plan.requests) <= 1 or self.readv_threads <= 1:
+                res = [self._vector_read(f, req) for req in plan.requests]
+            else:
+                with ThreadPoolExecutor(max_workers=min(self.readv_threads, len(plan.requests))) as executor:
+                    res = list(executor.map(lambda req: self._vector_read(f, req), plan.requests))
 
-        return res
+        return plan.assemble(res)
 
     def upload_file(self, local_path):
+        self.pool.invalidate(self.url)
         fs = xrd_client.FileSystem(self.server_url)
         st, resp = fs.copy(local_path, self.url)
         return (0 if st.ok else 1, resp)
@@ -154,6 +252,7 @@ class PyXrootdClient(FileAccessClient):
     def delete_file(self):
         #For safety: do not delete anything except my files
         if re.match('/lhcb:user/a/arogovsk.*', self.path):
+            self.pool.invalidate(self.url)
             fs = xrd_client.FileSystem(self.server_url)
             st, resp = fs.rm(self.path)
             if st.ok:
@@ -165,11 +264,10 @@ class PyXrootdClient(FileAccessClient):
         return res
 
     def stat_file(self):
-        with xrd_client.File() as f:
-            st, _ = f.open(self.url)
-            if not st.ok:
-                raise RuntimeError("Can not open file {0} for stat: {1}".format(self.url, st))
-            st, res = f.stat()
+        with self.pool.handle(self.url) as f:
+            start_ns, start = time.time_ns(), time.perf_counter_ns()
+            st, res = f.stat(force=True)
+            self._trace('stat', f, start_ns, start, st.ok)
             if not st.ok:
                 raise RuntimeError("Can not stat file {0}: {1}".format(self.url, st))
             return res
@@ -186,12 +284,24 @@ class PyXrootdClient(FileAccessClient):
                 break
         return (0, csum)
 
-    def get_max_iov(self):
+    def get_server_limits(self):
+        "Return (readv_iov_max, readv_ior_max) for the server"
+        try:
+            return self.server_limits[self.server_url]
+        except KeyError:
+            pass
         fs = xrd_client.FileSystem(self.server_url)
-        status, response = fs.query(QueryCode.CONFIG, 'readv_iov_max')
-        if not status.ok:
-            raise RuntimeError("Can not query server: {0}".format(status))
-        return int(response.strip())
+        res = []
+        for param in ('readv_iov_max', 'readv_ior_max'):
+            status, response = fs.query(QueryCode.CONFIG, param)
+            if not status.ok:
+                raise RuntimeError("Can not query server: {0}".format(status))
+            res.append(int(response.strip()))
+        self.server_limits[self.server_url] = tuple(res)
+        return self.server_limits[self.server_url]
+
+    def get_max_iov(self):
+        return self.get_server_limits()[0]
 
     @property
     def https_url(self):
@@ -214,26 +324,178 @@ class PyXrootdClient(FileAccessClient):
         return 'https://' + netloc + self.path
 
 
+class ClientHealth:
+    """
+    Latency and error statistics of a single client, plus a circuit breaker:
+    after failure_threshold consecutive failures the client is skipped for cooldown seconds.
+    Then a single probe call is let through, its success closes the breaker, a failure opens it again.
+    """
+    def __init__(self, failure_threshold=3, cooldown=60, alpha=0.2):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.alpha = alpha
+        self.calls = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.avg_latency = None
+        self.max_latency = 0
+        self.open_until = 0
+        self.probing = False
+        self.lock = Lock()
+
+    def record(self, ok, latency):
+        with self.lock:
+            self.probing = False
+            self.calls += 1
+            self.max_latency = max(self.max_latency, latency)
+            if self.avg_latency is None:
+                self.avg_latency = latency
+            else:
+                self.avg_latency = (1 - self.alpha) * self.avg_latency + self.alpha * latency
+            if ok:
+                self.consecutive_failures = 0
+            else:
+                self.failures += 1
+                self.consecutive_failures += 1
+                if self.consecutive_failures >= self.failure_threshold:
+                    self.open_until = time.monotonic() + self.cooldown
+
+    @property
+    def breaker_open(self):
+        return self.consecutive_failures >= self.failure_threshold
+
+    @property
+    def available(self):
+        "False if circuit breaker is open, and it is not the time for a probe or the probe is in flight"
+        return not self.breaker_open or (not self.probing and time.monotonic() >= self.open_until)
+
+    def acquire(self):
+        "Whether a call may be made now. If it is the probe, other calls are refused until it is recorded"
+        with self.lock:
+            if not self.breaker_open:
+                return True
+            if self.probing or time.monotonic() < self.open_until:
+                return False
+            self.probing = True
+            return True
+
+    @property
+    def healthy(self):
+        return self.available and self.consecutive_failures == 0
+
+    @property
+    def stats(self):
+        return {
+                'calls': self.calls,
+                'failures': self.failures,
+                'avg_latency': self.avg_latency,
+                'max_latency': self.max_latency,
+                'available': self.available,
+            }
+
+
 class FallbackClient:
-    def __init__(self, clients, fallback_methods=None):
+    #Running these on two clients at once is not safe (both write the same remote or local file), they are never hedged
+    NOT_HEDGED = ('upload_file', 'delete_file', 'download_file')
+    #These return the result itself and raise on errors, instead of returning (status, response)
+    RETURN_VALUE = ('stat_file',)
+
+    def __init__(self, clients, fallback_methods=None, hedge_delay=None, failure_threshold=3, cooldown=60):
+        """
+        hedge_delay: if None, clients are tried one after another. Otherwise the next client is started if
+                     the previous one did not finish in hedge_delay seconds (or at once, if the previous one is unhealthy),
+                     and the first successful result is used. Methods from NOT_HEDGED are always tried one after another.
+        failure_threshold, cooldown: client that failed failure_threshold times in a row is skipped for cooldown seconds.
+        """
         self.clients = clients
         if fallback_methods is None:
             self.fallback_methods = FileAccessClient.__abstractmethods__
         else:
             self.fallback_methods = fallback_methods
+        self.hedge_delay = hedge_delay
+        self.health = [ClientHealth(failure_threshold, cooldown) for _ in clients]
 
+    @property
+    def stats(self):
+        return [h.stats for h in self.health]
+
+    def _candidates(self):
+        """
+        (clients to try in order, force). Clients with open circuit breaker are skipped, unless all of them are:
+        then all are tried anyway (force).
+        """
+        res = [(cl, h) for cl, h in zip(self.clients, self.health) if h.available]
+        return (res, False) if res else (list(zip(self.clients, self.health)), True)
+
+    @staticmethod
+    def _call(cl, health, method_name, args, kwargs, force=False):
+        if not health.acquire() and not force:
+            #Somebody else took the probe since the candidates were selected
+            return 1, RuntimeError("Circuit breaker of {0} is open".format(type(cl).__name__))
+        start = time.monotonic()
+        try:
+            res = getattr(cl, method_name)(*args, **kwargs)
+            st, resp = (0, res) if method_name in FallbackClient.RETURN_VALUE else res
+        except Exception as exc:
+            st, resp = 1, exc
+        health.record(st == 0, time.monotonic() - start)
+        return st, resp
+
+    def _fail(self, method_name, fails):
+        exc_text = '\n\n\n'.join("ecode: {0}\noutput: {1}".format(*x) for x in fails)
+        raise RuntimeError(f"None of the clients was able to execute method {method_name}:\n{exc_text}")
 
     def fallback_method(self, method_name, *args, **kwargs):
+        if self.hedge_delay is not None and method_name not in self.NOT_HEDGED:
+            return self.hedged_method(method_name, *args, **kwargs)
         fails = []
-        for cl in self.clients:
-            st, resp = getattr(cl, method_name)(*args, **kwargs)
+        candidates, force = self._candidates()
+        for cl, health in candidates:
+            st, resp = self._call(cl, health, method_name, args, kwargs, force)
             if st != 0:
                 fails.append( (st, resp) )
             else:
-                return (st, resp)
-        exc_text = '\n\n\n'.join("ecode: {0}\noutput: {1}".format(*x) for x in fails)
-        raise RuntimeError(f"None of the clients was able to execute method {method_name}:\n{exc_text}")
+                return self._result(method_name, st, resp)
+        self._fail(method_name, fails)
 
+    def _result(self, method_name, st, resp):
+        return resp if method_name in self.RETURN_VALUE else (st, resp)
+
+    def _start(self, cl, health, method_name, args, kwargs, force):
+        """
+        Future for the call, made in its own thread: calls that hang or lost the race are left running,
+        and must not delay the next ones.
+        """
+        fut = Future()
+
+        def run():
+            fut.set_result(self._call(cl, health, method_name, args, kwargs, force))
+        Thread(target=run, daemon=True).start()
+        return fut
+
+    def hedged_method(self, method_name, *args, **kwargs):
+        fails = []
+        candidates, force = self._candidates()
+        pending = set()
+        idx = 0
+        while True:
+            if idx < len(candidates):
+                cl, health = candidates[idx]
+                pending.add(self._start(cl, health, method_name, args, kwargs, force))
+                idx += 1
+            if not pending:
+                self._fail(method_name, fails)
+            if idx < len(candidates):
+                #Do not wait for a client that is known to have problems
+                timeout = self.hedge_delay if candidates[idx - 1][1].healthy else 0
+            else:
+                timeout = None
+            done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            for fut in done:
+                st, resp = fut.result()
+                if st == 0:
+                    return self._result(method_name, st, resp)
+                fails.append( (st, resp) )
 
     def __getattr__(self, attr):
         if attr in self.fallback_methods:
@@ -241,3 +503,23 @@ class FallbackClient:
         else:
             res = getattr(self.clients[0], attr)
         return res
+
+
+def make_client(url, hedge_delay=None, https_url=None):
+    """
+    Client for the url: https urls are accessed directly, for xroot urls webdav is used
+    as a fallback for uploads, downloads, deletes, stat and checksum. With hedge_delay, stat and checksum
+    are also sent to webdav if xrootd did not answer in hedge_delay seconds.
+    https_url: webdav url of the same file, by default it is made from the xroot one.
+    """
+    from https_client import HTTPSClient
+
+    if url.startswith('https'):
+        return HTTPSClient(url)
+    root_client = PyXrootdClient(url)
+    https_client = HTTPSClient(root_client.https_url if https_url is None else https_url)
+    return FallbackClient(
+            clients=[root_client, https_client],
+            fallback_methods=['upload_file', 'download_file', 'delete_file', 'stat_file', 'get_file_checksum'],
+            hedge_delay=hedge_delay
+        )
@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+import os
+import zlib
+
+import pytest
+
+from random import randint, Random
+
+from https_client import HTTPSClient, HTTPConnectionPool
+from xrootd_standin import Faults, HTTPServer, Storage, start_server
+
+
+FILE_PATH = '/lhcb:user/lhcb/user/a/arogovsk/https_test_file'
+FILE_SIZE = 3*1024*1024 + 17
+
+
+@pytest.fixture(scope='module')
+def content():
+    return Random(1094).randbytes(FILE_SIZE)
+
+
+@pytest.fixture(scope='module')
+def server(content, tmp_path_factory):
+    root = tmp_path_factory.mktemp('storage')
+    path = root / FILE_PATH.lstrip('/')
+    path.parent.mkdir(parents=True)
+    path.write_bytes(content)
+    srv = HTTPServer(('127.0.0.1', 0), Storage(str(root)), Faults())
+    start_server(srv)
+    yield srv
+    srv.shutdown()
+    srv.server_close()
+
+
+@pytest.fixture
+def client(server):
+    pool = HTTPConnectionPool()
+    yield HTTPSClient('http://127.0.0.1:{0}{1}'.format(server.server_port, FILE_PATH), pool=pool, max_ranges=16)
+    pool.close_all()
+
+
+def test_stat(client):
+    assert client.stat_file().size == FILE_SIZE
+
+
+def test_checksum(client, content):
+    assert client.get_file_checksum() == (0, '{0:08x}'.format(zlib.adler32(content)))
+
+
+def test_read(client, content):
+    chunks = [(0, 10), (FILE_SIZE - 5, 5), (1000, 1)]
+    assert client.read(chunks) == [content[off:off+sz] for off, sz in chunks]
+
+
+@pytest.mark.parametrize('nchunks', [1, 2, 100, 1000])
+def test_readv(client, content, nchunks):
+    chunks = [(randint(0, FILE_SIZE - 1025), randint(1, 1024)) for _ in range(nchunks)]
+    assert client.readv(chunks) == [content[off:off+sz] for off, sz in chunks]
+
+
+@pytest.mark.parametrize('gap', [0, 4096])
+def test_readv_merged(server, content, gap):
+    cl = HTTPSClient('http://127.0.0.1:{0}{1}'.format(server.server_port, FILE_PATH), pool=HTTPConnectionPool(), max_ranges=16, readv_gap=gap)
+    chunks = [(randint(0, FILE_SIZE - 1025), randint(1, 1024)) for _ in range(100)]
+    assert cl.readv(chunks) == [content[off:off+sz] for off, sz in chunks]
+    cl.pool.close_all()
+
+
+def test_keepalive(client):
+    client.read([(i, 1) for i in range(10)])
+    assert client.pool.stats['created'] == 1
+    assert client.pool.stats['reused'] == 9
+
+
+def test_upload_download(client, server, tmp_path):
+    src = tmp_path / 'src'
+    dst = tmp_path / 'dst'
+    src.write_bytes(os.urandom(1024*1024))
+    upload = HTTPSClient(client.url + '_upload', pool=client.pool)
+    assert upload.upload_file(str(src))[0] == 0
+    assert upload.download_file(str(dst))[0] == 0
+    assert dst.read_bytes() == src.read_bytes()
+    assert upload.delete_file()[0] == 0
+    with pytest.raises(ValueError):
+        upload.stat_file()
+
+
+def test_injected_errors(server):
+    cl = HTTPSClient('http://127.0.0.1:{0}{1}'.format(server.server_port, FILE_PATH))
+    server.faults.error_rate = 1
+    try:
+        with pytest.raises(RuntimeError):
+            cl.readv([(0, 10), (100, 10)])
+    finally:
+        server.faults.error_rate = 0
+
+
+def test_delete_refused(server):
+    cl = HTTPSClient('http://127.0.0.1:{0}/lhcb:user/lhcb/other'.format(server.server_port))
+    assert cl.delete_file()[0] == 1
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+"""
+Planner for vector reads.
+
+Turns an arbitrary list of (offset, size) chunks into a set of readv requests that fit server limits
+(readv_iov_max chunks per request, readv_ior_max bytes per chunk) and reassembles the responses
+back into buffers for the original chunks, in the original order.
+"""
+from bisect import bisect_right
+
+
+def merge_chunks(chunks, gap=0):
+    """
+    Sort chunks and merge the ones that overlap or are at most gap bytes apart.
+    Returns list of [start, end) ranges. Zero-length chunks are ignored.
+    If gap is None, chunks are neither sorted nor merged.
+    """
+    if gap is None:
+        return [(off, off + sz) for off, sz in chunks if sz > 0]
+
+    res = []
+    for off, sz in sorted(chunks):
+        if sz <= 0:
+            continue
+        if res and off <= res[-1][1] + gap:
+            if off + sz > res[-1][1]:
+                res[-1][1] = off + sz
+        else:
+            res.append([off, off + sz])
+    return [(a, b) for a, b in res]
+
+
+def split_ranges(ranges, ior_max):
+    "Split ranges into (offset, size) pieces not bigger than ior_max. Returns pieces and the range index of every piece."
+    pieces = []
+    owners = []
+    for idx, (start, end) in enumerate(ranges):
+        for off in range(start, end, ior_max):
+            pieces.append( (off, min(ior_max, end - off)) )
+            owners.append(idx)
+    return pieces, owners
+
+
+class ReadvPlan:
+    def __init__(self, chunks, iov_max, ior_max, gap=0):
+        if iov_max <= 0 or ior_max <= 0:
+            raise ValueError("Wrong server limits: iov_max={0}, ior_max={1}".format(iov_max, ior_max))
+        self.chunks = list(chunks)
+        self.gap = gap
+        self.ranges = merge_chunks(self.chunks, gap)
+        self.pieces, self.owners = split_ranges(self.ranges, ior_max)
+        self.requests = [self.pieces[i:i + iov_max] for i in range(0, len(self.pieces), iov_max)]
+
+    @property
+    def nbytes(self):
+        "Number of bytes that will be actually read"
+        return sum(end - start for start, end in self.ranges)
+
+    def _range_buffers(self, responses):
+        res = [[] for _ in self.ranges]
+        bufs = [buf for resp in responses for buf in resp]
+        if len(bufs) != len(self.pieces):
+            raise RuntimeError("Expected {0} buffers, got {1}".format(len(self.pieces), len(bufs)))
+        for (off, sz), owner, buf in zip(self.pieces, self.owners, bufs):
+            if len(buf) != sz:
+                raise RuntimeError("Short read at {0},{1}: got {2} bytes".format(off, sz, len(buf)))
+            res[owner].append(buf)
+        return [x[0] if len(x) == 1 else b''.join(x) for x in res]
+
+    def assemble(self, responses):
+        """
+        Build buffers for the original chunks.
+        responses should contain list of buffers for every request from self.requests, in the same order.
+        """
+        data = self._range_buffers(responses)
+        res = []
+        if self.gap is None:
+            it = iter(data)
+            for _, sz in self.chunks:
+                res.append(next(it) if sz > 0 else b'')
+            return res
+
+        starts = [x[0] for x in self.ranges]
+        for off, sz in self.chunks:
+            if sz <= 0:
+                res.append(b'')
+                continue
+            idx = bisect_right(starts, off) - 1
+            pos = off - starts[idx]
+            buf = data[idx]
+            res.append(buf if pos == 0 and sz == len(buf) else buf[pos:pos + sz])
+        return res
@@ -6,22 +6,100 @@ import os
 import sys
 import zlib
 import pytest
+import mmap
+import json
+import fcntl
+import hashlib
 import subprocess
+import numpy as np
 
 from itertools import product
-from random import randint
-from tempfile import mkstemp
+from random import randint, getrandbits
+from contextlib import contextmanager
 from abc import ABC, abstractmethod
 
 from XRootD import client as xrd_client
 from XRootD.client.flags import QueryCode
 
-from file_access_clients import FallbackClient, PyXrootdClient, GfalCMDClient
+from file_access_clients import make_client
 
 
 TEST_FILE_SIZE = 1000*1024*1024
 CACHE_SIZE = 4*1024*1024
 BUFFER_SIZE = 1024*1024
+#Test file is generated and checksummed in blocks of this size
+CONTENT_BLOCK_SIZE = 4*1024*1024
+
+
+class SeededContent:
+    """
+    Deterministic pseudo-random file content. Every block is generated from (seed, block number),
+    so the file and its checksum are computed without keeping the whole content in memory.
+    """
+    def __init__(self, size, seed, block_size=CONTENT_BLOCK_SIZE):
+        self.size = size
+        self.seed = seed
+        self.block_size = block_size
+
+    def block(self, idx):
+        length = min(self.block_size, self.size - idx * self.block_size)
+        return hashlib.shake_128(b'%d:%d' % (self.seed, idx)).digest(length)
+
+    def blocks(self):
+        for idx in range((self.size + self.block_size - 1) // self.block_size):
+            yield self.block(idx)
+
+    def adler32(self):
+        cksum = 1
+        for data in self.blocks():
+            cksum = zlib.adler32(data, cksum)
+        return '{0:08x}'.format(cksum)
+
+
+@contextmanager
+def shared_lock(shared_dir):
+    "Lock shared by all pytest-xdist workers"
+    with open(os.path.join(shared_dir, 'lock'), 'w') as fd:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+
+
+@pytest.fixture(scope='session')
+def shared_test_file(request):
+    """
+    Create and upload the test file once for all workers. The first worker does the job and saves
+    the result in the shared directory, the others just read it. The file is deleted by conftest
+    at the end of the session.
+    """
+    shared_dir = request.config.readv_shared_dir
+    state_path = os.path.join(shared_dir, 'state.json')
+    with shared_lock(shared_dir):
+        if os.path.exists(state_path):
+            with open(state_path) as fd:
+                return json.load(fd)
+
+        content = SeededContent(TEST_FILE_SIZE, request.config.readv_seed)
+        path = os.path.join(shared_dir, 'test_file')
+        bytes_written = 0
+        with open(path, 'wb') as fd:
+            for data in content.blocks():
+                bytes_written += fd.write(data)
+
+        url = os.environ['TEST_FILE_URL']
+        upload_res, upload_message = make_client(url, https_url=os.environ.get('TEST_FILE_HTTPS_URL')).upload_file(path)
+        state = {
+                'path': path,
+                'size': bytes_written,
+                'url': url,
+                'upload_res': upload_res,
+                'upload_message': str(upload_message),
+            }
+        with open(state_path, 'w') as fd:
+            json.dump(state, fd)
+        return state
 
 
 class TestReadv:
@@ -32,23 +110,35 @@ class TestReadv:
             cksum = '0' * (8 - len(cksum)) + cksum
         return cksum
 
+    @staticmethod
+    def adler32_file(path):
+        "Checksum file in fixed-size blocks, so that memory usage does not depend on file size"
+        cksum = 1
+        with open(path, 'rb') as fd:
+            while True:
+                data = fd.read(CONTENT_BLOCK_SIZE)
+                if not data:
+                    break
+                cksum = zlib.adler32(data, cksum)
+        return '{0:08x}'.format(cksum)
+
     @pytest.fixture(scope='class')
-    def test_file_content(self):
-        return os.urandom(TEST_FILE_SIZE)
+    def test_seed(self, request):
+        "Seed for the test file content, see --readv-seed"
+        return request.config.readv_seed
+
+    @pytest.fixture(scope='class')
+    def test_file_content(self, test_seed):
+        return SeededContent(TEST_FILE_SIZE, test_seed)
 
     @pytest.fixture(scope='class')
     def test_file_checksum(self, test_file_content):
-        return self.adler32(test_file_content)
+        return test_file_content.adler32()
 
     @pytest.fixture(scope='class')
-    def test_file_creation_result(self, test_file_content, request):
-        fd, testfile = mkstemp(dir='/tmp/arogovsk')
-        bytes_written = os.write(fd, test_file_content)
-        os.close(fd)
-        assert bytes_written == TEST_FILE_SIZE
-        yield bytes_written, testfile
-        if request.node.session.testsfailed == 0:
-            os.unlink(testfile)
+    def test_file_creation_result(self, shared_test_file):
+        assert shared_test_file['size'] == TEST_FILE_SIZE
+        return shared_test_file['size'], shared_test_file['path']
 
     @pytest.fixture(scope='class')
     def test_file(self, test_file_creation_result):
@@ -58,6 +148,20 @@ class TestReadv:
     def test_file_size(self, test_file_creation_result):
         return test_file_creation_result[0]
 
+    @pytest.fixture(scope='class')
+    def local_reference(self, test_file):
+        "Local test file, memory-mapped once for the whole class"
+        with open(test_file, 'rb') as fd:
+            mm = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(mm)
+        yield view
+        view.release()
+        try:
+            mm.close()
+        except BufferError:
+            #Slices are still referenced, e.g. from a failed test traceback. Let gc close it.
+            pass
+
     @pytest.fixture
     def download_path(self, test_file, scope='class'):
         path = test_file + '_download'
@@ -78,22 +182,20 @@ class TestReadv:
             cls.buffer_size = BUFFER_SIZE
         cls.block_size = int(cls.block_size)
 
-        #Get client
+        #If HEDGE_DELAY is set, start webdav stat/checksum if xrootd did not answer in that many seconds
+        hedge_delay = os.environ.get('HEDGE_DELAY')
+        cls.client = make_client(cls.url, hedge_delay=float(hedge_delay) if hedge_delay else None, https_url=os.environ.get('TEST_FILE_HTTPS_URL'))
         if cls.url.startswith('https'):
-            cls.client = GfalCMDClient(cls.url)
             cls.max_iov = 1024
         else:
-            root_client = PyXrootdClient(cls.url)
-            https_client = GfalCMDClient(root_client.https_url)
-            cls.client = FallbackClient(clients=[root_client, https_client], fallback_methods=['upload_file', 'delete_file'])
             cls.max_iov = cls.client.get_max_iov()
 
     @pytest.fixture
-    def file_stat(self):
+    def file_stat(self, shared_test_file):
         return self.client.stat_file()
 
     @pytest.fixture
-    def file_checksum(self):
+    def file_checksum(self, shared_test_file):
         return self.client.get_file_checksum()
 
     @pytest.fixture
@@ -128,29 +230,29 @@ class TestReadv:
                 )
         )
     def random_chunks(self, test_file_size, request):
-        chunks = set()
         n, min_size, max_size, request_end = request.param
-        for _ in range(n):
-            if request_end > max_size:
-                b = max(request_end - max_size, 0)
-            else:
-                b = 0
-                max_size = request_end
-            chunks.add( (randint(0, b), randint(min_size, max_size)) )
-        chunks = [x for x in chunks]
-        chunks = sorted(chunks, key=lambda x: x[0])
-        return chunks
+        if request_end > max_size:
+            b = max(request_end - max_size, 0)
+        else:
+            b = 0
+            max_size = request_end
+        return self.unique_chunks(self.rng().integers(0, b, size=n, endpoint=True), self.rng().integers(min_size, max_size, size=n, endpoint=True))
 
     @pytest.fixture(params=[i for i in range(1, 1025)])
     def random_chunks_one_byte(self, test_file_size, request):
         "Random chunks with 1 byte length"
-        chunks = set()
         n = request.param
-        for _ in range(n):
-            chunks.add( (randint(0, test_file_size - 1), 1) )
-        chunks = [x for x in chunks]
-        chunks = sorted(chunks, key=lambda x: x[0])
-        return chunks
+        return self.unique_chunks(self.rng().integers(0, test_file_size - 1, size=n, endpoint=True), np.ones(n, dtype=np.int64))
+
+    @staticmethod
+    def rng():
+        "NumPy generator seeded from random, so that chunks are reproducible with the test seed"
+        return np.random.default_rng(getrandbits(64))
+
+    @staticmethod
+    def unique_chunks(offsets, lengths):
+        "Deduplicated list of chunks, sorted by offset"
+        return [tuple(x) for x in np.unique(np.stack( (offsets, lengths), axis=1 ), axis=0).tolist()]
 
     @pytest.fixture
     def block_borders(self, test_file_size):
@@ -162,15 +264,33 @@ class TestReadv:
         nchunks = test_file_size // block_size
         chunks = [(i*self.file_size, self.block_size)]
 
-    def read_local(self, chunks, localfile):
-        res = []
-        with open(localfile, 'rb') as fd:
-            for off, sz in chunks:
-                fd.seek(off)
-                res.append(fd.read(sz))
-        return res
+    def read_local(self, chunks, local):
+        "Slices of the memory-mapped local file, no data is copied"
+        return [local[off:off+sz] for off, sz in chunks]
+
+    @staticmethod
+    def first_mismatch(a, b):
+        "Position of the first differing byte of two buffers, or None if they are equal"
+        a, b = memoryview(a), memoryview(b)
+        if a == b:
+            return None
+        #Bisect on zero-copy slices instead of comparing byte by byte
+        lo, hi = 0, min(len(a), len(b))
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if a[lo:mid+1] == b[lo:mid+1]:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def assert_same(self, chunk, data1, data2, name1, name2):
+        pos = self.first_mismatch(data1, data2)
+        assert pos is None, "{0} and {1} differ for chunk {2}: first mismatch at offset {3} (lengths {4} and {5})".format(
+                name1, name2, chunk, chunk[0] + pos, len(data1), len(data2)
+            )
 
-    def do_compare(self, chunks, localfile, chunks2=None, chunks3=None):
+    def do_compare(self, chunks, local, chunks2=None, chunks3=None):
         assert len(chunks) > 0
 
         if chunks2 is None:
@@ -180,26 +300,24 @@ class TestReadv:
 
         r1 = self.client.read(chunks)
         r2 = self.client.readv(chunks2)
-        r3 = self.read_local(chunks3, localfile)
+        r3 = self.read_local(chunks3, local)
         print("CHUNKS=", chunks)
-        for d1, d2, d3 in zip(r1, r2, r3):
-            assert d1 == d2
-            assert d2 == d3
+        assert len(r1) == len(r2) == len(r3)
+        for chunk, d1, d2, d3 in zip(chunks, r1, r2, r3):
+            self.assert_same(chunk, d1, d2, 'read', 'readv')
+            self.assert_same(chunk, d2, d3, 'readv', 'local file')
 
-    def test_copy(self, test_file):
-        "Test copy"
-        copy_res, copy_message = self.client.upload_file(test_file)
-        print(copy_message)
-        assert copy_res == 0
+    def test_copy(self, shared_test_file):
+        "Test copy. Upload is done once per session by shared_test_file, here we only check the result"
+        print(shared_test_file['upload_message'])
+        assert shared_test_file['upload_res'] == 0
 
     def test_download(self, test_file, download_path, file_checksum):
         "Test file download"
         copy_res, copy_message = self.client.download_file(download_path)
         print(copy_message)
         assert copy_res == 0
-        with open(download_path, 'rb') as fd:
-            content = fd.read()
-        local_cksum = self.adler32(content)
+        local_cksum = self.adler32_file(download_path)
         assert local_cksum == file_checksum[1]
 
     def test_filesize(self, file_stat, test_file_size):
@@ -213,61 +331,53 @@ class TestReadv:
         assert file_checksum[1] == test_file_checksum
 
     @pytest.mark.readv
-    def test_single_chunk(self, single_chunk, test_file):
+    def test_single_chunk(self, single_chunk, local_reference):
         "Test readv with one chunk"
-        self.do_compare(single_chunk, test_file)
+        self.do_compare(single_chunk, local_reference)
 
     @pytest.mark.readv
-    def test_bug_chunks(self, bug_chunks, test_file):
+    def test_bug_chunks(self, bug_chunks, local_reference):
         "Test readv with chunks that cause failure previously due to a bug"
-        self.do_compare(bug_chunks, test_file)
+        self.do_compare(bug_chunks, local_reference)
 
     @pytest.mark.readv
-    def test_max_chunks(self, max_stable_chunks, test_file, test_file_size):
+    def test_max_chunks(self, max_stable_chunks, local_reference, test_file_size):
         "Test readv with maximum number of chunks"
         assert max_stable_chunks[-1][0] + max_stable_chunks[-1][1] == test_file_size
         assert len(max_stable_chunks) == self.max_iov
-        self.do_compare(max_stable_chunks, test_file)
+        self.do_compare(max_stable_chunks, local_reference)
 
     @pytest.mark.readv
     @pytest.mark.slow
-    def test_random_chunks(self, random_chunks, test_file):
+    def test_random_chunks(self, random_chunks, local_reference):
         "Test readv with random chunks"
-        self.do_compare(random_chunks, test_file)
+        self.do_compare(random_chunks, local_reference)
 
     @pytest.mark.readv
     @pytest.mark.slow
-    def test_random_chunks_one_byte(self, random_chunks_one_byte, test_file):
+    def test_random_chunks_one_byte(self, random_chunks_one_byte, local_reference):
         "Test readv with random chunks of 1 byte length"
-        self.do_compare(random_chunks_one_byte, test_file)
+        self.do_compare(random_chunks_one_byte, local_reference)
 
     @pytest.mark.readv
-    def test_block_plus_one_chunks(self, block_borders, test_file):
+    def test_block_plus_one_chunks(self, block_borders, local_reference):
         "Test readv with chunks spanning multiple blocks"
-        self.do_compare(block_borders, test_file)
+        self.do_compare(block_borders, local_reference)
 
     @pytest.mark.readv
     @pytest.mark.xfail(strict=True)
-    def test_consistency(self, block_borders, test_file, test_file_size):
+    def test_consistency(self, block_borders, local_reference, test_file_size):
         "Make sure that compare function does compare something"
         if test_file_size >= 3*1024:
             chunks = [(0, 1024)]
             chunks2 = [(1025, 2048)]
             chunks3 = [(2049,3072)]
-            self.do_compare(chunks, test_file, chunks2=chunks2, chunks3=chunks3)
-
-    def test_delete(self):
-        "Test file deletion"
-        res, message = self.client.delete_file()
-        print(message)
-        assert res == 0
+            self.do_compare(chunks, local_reference, chunks2=chunks2, chunks3=chunks3)
 
 
 if __name__ == '__main__':
     url = sys.argv[1]
-    cl_root = PyXrootdClient(url)
-    cl_gfal = GfalCMDClient(cl_root.https_url)
-    client = FallbackClient(clients=[cl_root, cl_gfal])
+    client = make_client(url)
     TestReadv.setup_class()
     tcl = TestReadv()
     #print(client.upload_file('/etc/centos-release'))
@@ -0,0 +1,598 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for an XRootD data server, for hermetic client benchmarks.
+
+Implements the part of the xroot protocol that the file access clients use: handshake, protocol, login,
+open, stat, read, readv, write, truncate, sync, close, rm, config queries (readv_iov_max, readv_ior_max)
+and adler32 checksum queries. Optionally serves the same files over plain HTTP (ranged and multi-range GET,
+HEAD with Digest, PUT, DELETE), so that the HTTPS client and the fallback path can be tested too.
+
+Files are taken from a local directory. Latency, bandwidth and errors can be injected for every request.
+
+Usage example:
+    ./xrootd_standin.py -d /tmp/standin -p 1094 -l 0.02 -b $((100*1024*1024))
+    TEST_FILE_URL=root://localhost:1094/lhcb:user/a/arogovsk/testfile FILE_BLOCK_SIZE=4194304 pytest readv_test.py
+"""
+import argparse
+import os
+import random
+import socket
+import socketserver
+import struct
+import sys
+import threading
+import time
+import zlib
+
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+#Request codes
+kXR_query = 3001
+kXR_close = 3003
+kXR_protocol = 3006
+kXR_login = 3007
+kXR_mkdir = 3008
+kXR_open = 3010
+kXR_ping = 3011
+kXR_read = 3013
+kXR_rm = 3014
+kXR_sync = 3016
+kXR_stat = 3017
+kXR_write = 3019
+kXR_endsess = 3023
+kXR_readv = 3025
+kXR_truncate = 3028
+
+REQUEST_NAMES = {
+        kXR_query: 'query', kXR_close: 'close', kXR_protocol: 'protocol', kXR_login: 'login', kXR_mkdir: 'mkdir',
+        kXR_open: 'open', kXR_ping: 'ping', kXR_read: 'read', kXR_rm: 'rm', kXR_sync: 'sync', kXR_stat: 'stat',
+        kXR_write: 'write', kXR_endsess: 'endsess', kXR_readv: 'readv', kXR_truncate: 'truncate',
+    }
+
+#Response codes
+kXR_ok = 0
+kXR_oksofar = 4000
+kXR_error = 4003
+
+#Error codes
+kXR_ArgInvalid = 3000
+kXR_FileNotOpen = 3004
+kXR_IOError = 3007
+kXR_NotFound = 3011
+kXR_ServerError = 3012
+kXR_Unsupported = 3013
+kXR_isDirectory = 3016
+kXR_ItExists = 3018
+
+#Open options
+kXR_delete = 0x0002
+kXR_force = 0x0004
+kXR_new = 0x0008
+kXR_open_updt = 0x0020
+kXR_mkpath = 0x0100
+kXR_retstat = 0x0400
+
+#Stat flags
+kXR_isDir = 2
+kXR_readable = 16
+kXR_writable = 32
+
+#Query types
+kXR_Qcksum = 3
+kXR_Qconfig = 7
+
+PROTOCOL_VERSION = 0x00000400
+kXR_DataServer = 1
+kXR_isServer = 0x00000001
+
+REQUEST_HEADER = struct.Struct('>2sH16si')
+RESPONSE_HEADER = struct.Struct('>2sHi')
+READV_ELEMENT = struct.Struct('>4siq')
+
+DEF_IOV_MAX = 1024
+DEF_IOR_MAX = 2097136
+#Responses bigger than this are sent in several kXR_oksofar frames
+MAX_FRAME = 8*1024*1024
+HTTP_BLOCK_SIZE = 4*1024*1024
+
+
+class XrdError(Exception):
+    def __init__(self, code, message):
+        super().__init__(message)
+        self.code = code
+        self.message = message
+
+
+class Faults:
+    "Latency, bandwidth and error injection, shared by all connections of a server"
+    def __init__(self, latency=0, jitter=0, bandwidth=None, error_rate=0, error_ops=None, seed=None):
+        """
+        latency, jitter: every request is delayed once by latency + uniform(0, jitter) seconds (see latency()).
+        bandwidth: bytes per second for data sent or received by the server, None means unlimited (see transfer()).
+        error_rate: probability of failing a request with kXR_IOError. Only requests in error_ops
+                    (e.g. ['read', 'readv']) are failed, if it is given.
+        """
+        self.base_latency = latency
+        self.jitter = jitter
+        self.bandwidth = bandwidth
+        self.error_rate = error_rate
+        self.error_ops = None if error_ops is None else set(error_ops)
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.link_free_at = 0
+
+    def latency(self):
+        "Round trip delay, called once per request"
+        delay = self.base_latency
+        if self.jitter:
+            with self.lock:
+                delay += self.random.uniform(0, self.jitter)
+        if delay > 0:
+            time.sleep(delay)
+
+    def transfer(self, nbytes):
+        "Time to send nbytes over the link, it can be called for every block of a request"
+        if not self.bandwidth or not nbytes:
+            return
+        with self.lock:
+            #All requests share a single link, so transfers are queued one after another
+            now = time.monotonic()
+            self.link_free_at = max(self.link_free_at, now) + nbytes / self.bandwidth
+            delay = self.link_free_at - now
+        time.sleep(delay)
+
+    def check(self, op):
+        if self.error_rate and (self.error_ops is None or op in self.error_ops):
+            with self.lock:
+                fail = self.random.random() < self.error_rate
+            if fail:
+                raise XrdError(kXR_IOError, "Injected error for {0}".format(op))
+
+
+class Storage:
+    "Local directory that plays the role of the storage"
+    def __init__(self, root, iov_max=DEF_IOV_MAX, ior_max=DEF_IOR_MAX):
+        self.root = os.path.abspath(root)
+        self.iov_max = iov_max
+        self.ior_max = ior_max
+        self.checksums = {}
+        self.lock = threading.Lock()
+
+    def local_path(self, path):
+        path = path.split('?', 1)[0].rstrip('\0')
+        res = os.path.normpath(os.path.join(self.root, path.lstrip('/')))
+        if res != self.root and not res.startswith(self.root + os.sep):
+            raise XrdError(kXR_ArgInvalid, "Path {0} is outside of the storage".format(path))
+        return res
+
+    def stat(self, lpath):
+        try:
+            st = os.stat(lpath)
+        except FileNotFoundError:
+            raise XrdError(kXR_NotFound, "No such file or directory: {0}".format(lpath))
+        flags = kXR_readable | kXR_writable | (kXR_isDir if os.path.isdir(lpath) else 0)
+        return "{0} {1} {2} {3}".format(st.st_ino, st.st_size, flags, int(st.st_mtime))
+
+    def adler32(self, lpath):
+        try:
+            st = os.stat(lpath)
+        except FileNotFoundError:
+            raise XrdError(kXR_NotFound, "No such file or directory: {0}".format(lpath))
+        key = (lpath, st.st_mtime_ns, st.st_size)
+        with self.lock:
+            if key in self.checksums:
+                return self.checksums[key]
+        cksum = 1
+        with open(lpath, 'rb') as fd:
+            while True:
+                data = fd.read(HTTP_BLOCK_SIZE)
+                if not data:
+                    break
+                cksum = zlib.adler32(data, cksum)
+        res = '{0:08x}'.format(cksum)
+        with self.lock:
+            self.checksums[key] = res
+        return res
+
+    def config(self, keys):
+        res = ''
+        for key in keys.split('\n'):
+            key = key.strip()
+            if key == 'readv_iov_max':
+                res += '{0}\n'.format(self.iov_max)
+            elif key == 'readv_ior_max':
+                res += '{0}\n'.format(self.ior_max)
+            elif key:
+                #This is what the real server does for unknown keys
+                res += key + '\n'
+        return res
+
+
+class XrootdHandler(socketserver.BaseRequestHandler):
+    "Serves a single client connection. Requests are executed in parallel, so many of them may be in flight."
+
+    def setup(self):
+        self.send_lock = threading.Lock()
+        self.files = {}
+        self.files_lock = threading.Lock()
+        self.next_handle = 1
+        self.storage = self.server.storage
+        self.faults = self.server.faults
+
+    def recv_exact(self, n):
+        buf = bytearray()
+        while len(buf) < n:
+            data = self.request.recv(n - len(buf))
+            if not data:
+                raise EOFError
+            buf += data
+        return bytes(buf)
+
+    def send(self, streamid, status, *payload):
+        dlen = sum(len(x) for x in payload)
+        with self.send_lock:
+            self.request.sendall(RESPONSE_HEADER.pack(streamid, status, dlen) + b''.join(payload))
+
+    def send_frames(self, streamid, parts):
+        "Send list of buffers, splitting them in kXR_oksofar frames at part boundaries"
+        frame, size = [], 0
+        for part in parts:
+            if frame and size + len(part) > MAX_FRAME:
+                self.send(streamid, kXR_oksofar, *frame)
+                frame, size = [], 0
+            frame.append(part)
+            size += len(part)
+        self.send(streamid, kXR_ok, *frame)
+
+    def send_error(self, streamid, code, message):
+        self.send(streamid, kXR_error, struct.pack('>i', code), message.encode('utf-8') + b'\0')
+
+    def handle(self):
+        try:
+            hs = struct.unpack('>5i', self.recv_exact(20))
+            if hs != (0, 0, 0, 4, 2012):
+                return
+            self.request.sendall(RESPONSE_HEADER.pack(b'\0\0', kXR_ok, 8) + struct.pack('>ii', PROTOCOL_VERSION, kXR_DataServer))
+            with ThreadPoolExecutor(max_workers=self.server.threads) as executor:
+                while True:
+                    streamid, reqid, body, dlen = REQUEST_HEADER.unpack(self.recv_exact(REQUEST_HEADER.size))
+                    data = self.recv_exact(dlen) if dlen > 0 else b''
+                    executor.submit(self.dispatch, streamid, reqid, body, data)
+        except (EOFError, ConnectionError):
+            pass
+        finally:
+            with self.files_lock:
+                for fd, _ in self.files.values():
+                    os.close(fd)
+                self.files.clear()
+
+    def dispatch(self, streamid, reqid, body, data):
+        op = REQUEST_NAMES.get(reqid)
+        try:
+            if op is None:
+                raise XrdError(kXR_Unsupported, "Request {0} is not supported".format(reqid))
+            if op not in ('protocol', 'login', 'ping', 'endsess', 'close'):
+                self.faults.check(op)
+            self.faults.latency()
+            getattr(self, 'do_' + op)(streamid, body, data)
+        except XrdError as exc:
+            self.send_error(streamid, exc.code, exc.message)
+        except OSError as exc:
+            self.send_error(streamid, kXR_IOError, str(exc))
+        except (EOFError, ConnectionError):
+            pass
+        except Exception as exc:
+            print("Request {0} failed: {1!r}".format(op, exc), file=sys.stderr)
+            self.send_error(streamid, kXR_ServerError, str(exc))
+
+    def get_file(self, fhandle):
+        with self.files_lock:
+            try:
+                return self.files[fhandle]
+            except KeyError:
+                raise XrdError(kXR_FileNotOpen, "Invalid file handle")
+
+    def do_protocol(self, streamid, body, data):
+        self.send(streamid, kXR_ok, struct.pack('>ii', PROTOCOL_VERSION, kXR_isServer))
+
+    def do_login(self, streamid, body, data):
+        self.send(streamid, kXR_ok, os.urandom(16))
+
+    def do_ping(self, streamid, body, data):
+        self.send(streamid, kXR_ok)
+
+    do_endsess = do_ping
+
+    def do_open(self, streamid, body, data):
+        mode, options = struct.unpack('>HH', body[:4])
+        lpath = self.storage.local_path(data.decode('utf-8'))
+        if os.path.isdir(lpath):
+            raise XrdError(kXR_isDirectory, "{0} is a directory".format(lpath))
+        if options & (kXR_new | kXR_delete | kXR_open_updt):
+            if options & kXR_mkpath:
+                os.makedirs(os.path.dirname(lpath), exist_ok=True)
+            flags = os.O_RDWR
+            if options & kXR_new:
+                flags |= os.O_CREAT | os.O_EXCL
+            if options & kXR_delete:
+                flags |= os.O_CREAT | os.O_TRUNC
+        else:
+            flags = os.O_RDONLY
+        try:
+            fd = os.open(lpath, flags, 0o644)
+        except FileNotFoundError:
+            raise XrdError(kXR_NotFound, "No such file or directory: {0}".format(lpath))
+        except FileExistsError:
+            raise XrdError(kXR_ItExists, "File exists: {0}".format(lpath))
+        with self.files_lock:
+            fhandle = struct.pack('>I', self.next_handle)
+            self.next_handle += 1
+            self.files[fhandle] = (fd, lpath)
+        resp = [fhandle, struct.pack('>i', 0), b'\0\0\0\0']
+        if options & kXR_retstat:
+            resp.append(self.storage.stat(lpath).encode('ascii') + b'\0')
+        self.send(streamid, kXR_ok, *resp)
+
+    def do_close(self, streamid, body, data):
+        with self.files_lock:
+            try:
+                fd, _ = self.files.pop(body[:4])
+            except KeyError:
+                raise XrdError(kXR_FileNotOpen, "Invalid file handle")
+        os.close(fd)
+        self.send(streamid, kXR_ok)
+
+    def do_stat(self, streamid, body, data):
+        if data:
+            lpath = self.storage.local_path(data.decode('utf-8'))
+        else:
+            _, lpath = self.get_file(body[12:16])
+        self.send(streamid, kXR_ok, self.storage.stat(lpath).encode('ascii') + b'\0')
+
+    def do_read(self, streamid, body, data):
+        fhandle, offset, rlen = struct.unpack('>4sqi', body)
+        fd, _ = self.get_file(fhandle)
+        buf = os.pread(fd, rlen, offset)
+        self.faults.transfer(len(buf))
+        self.send_frames(streamid, [buf[i:i + MAX_FRAME] for i in range(0, len(buf), MAX_FRAME)] or [b''])
+
+    def do_readv(self, streamid, body, data):
+        if len(data) % READV_ELEMENT.size != 0:
+            raise XrdError(kXR_ArgInvalid, "Wrong readv request length")
+        nelem = len(data) // READV_ELEMENT.size
+        if nelem > self.storage.iov_max:
+            raise XrdError(kXR_ArgInvalid, "Too many readv elements: {0} > {1}".format(nelem, self.storage.iov_max))
+        parts = []
+        nbytes = 0
+        for fhandle, rlen, offset in READV_ELEMENT.iter_unpack(data):
+            if rlen > self.storage.ior_max:
+                raise XrdError(kXR_ArgInvalid, "Readv element too long: {0} > {1}".format(rlen, self.storage.ior_max))
+            fd, _ = self.get_file(fhandle)
+            buf = os.pread(fd, rlen, offset)
+            parts.append(READV_ELEMENT.pack(fhandle, len(buf), offset) + buf)
+            nbytes += len(buf)
+        self.faults.transfer(nbytes)
+        self.send_frames(streamid, parts)
+
+    def do_write(self, streamid, body, data):
+        fhandle, offset = struct.unpack('>4sq', body[:12])
+        fd, _ = self.get_file(fhandle)
+        self.faults.transfer(len(data))
+        os.pwrite(fd, data, offset)
+        self.send(streamid, kXR_ok)
+
+    def do_sync(self, streamid, body, data):
+        fd, _ = self.get_file(body[:4])
+        os.fsync(fd)
+        self.send(streamid, kXR_ok)
+
+    def do_truncate(self, streamid, body, data):
+        fhandle, length = struct.unpack('>4sq', body[:12])
+        if data:
+            os.truncate(self.storage.local_path(data.decode('utf-8')), length)
+        else:
+            fd, _ = self.get_file(fhandle)
+            os.ftruncate(fd, length)
+        self.send(streamid, kXR_ok)
+
+    def do_rm(self, streamid, body, data):
+        try:
+            os.unlink(self.storage.local_path(data.decode('utf-8')))
+        except FileNotFoundError:
+            raise XrdError(kXR_NotFound, "No such file: {0}".format(data.decode('utf-8')))
+        self.send(streamid, kXR_ok)
+
+    def do_mkdir(self, streamid, body, data):
+        os.makedirs(self.storage.local_path(data.decode('utf-8')), exist_ok=True)
+        self.send(streamid, kXR_ok)
+
+    def do_query(self, streamid, body, data):
+        infotype = struct.unpack('>H', body[:2])[0]
+        args = data.decode('utf-8').rstrip('\0')
+        if infotype == kXR_Qconfig:
+            resp = self.storage.config(args).encode('ascii')
+        elif infotype == kXR_Qcksum:
+            resp = 'adler32 {0}'.format(self.storage.adler32(self.storage.local_path(args))).encode('ascii') + b'\0'
+        else:
+            raise XrdError(kXR_Unsupported, "Query type {0} is not supported".format(infotype))
+        self.send(streamid, kXR_ok, resp)
+
+
+class XrootdServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, storage, faults, threads=64):
+        self.storage = storage
+        self.faults = faults
+        self.threads = threads
+        super().__init__(address, XrootdHandler)
+
+    def server_bind(self):
+        self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        super().server_bind()
+
+
+class HTTPHandler(BaseHTTPRequestHandler):
+    "WebDAV-like access to the same storage, with Range and Want-Digest support"
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status, headers=None, body=b''):
+        headers = {} if headers is None else headers
+        self.send_response(status)
+        for k, v in headers.items():
+            self.send_header(k, v)
+        if 'Content-Length' not in headers:
+            self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if self.command != 'HEAD' and body:
+            self.wfile.write(body)
+
+    def _prepare(self, op):
+        "Inject faults, return local path or None if the error was already sent"
+        try:
+            self.server.faults.check(op)
+            self.server.faults.latency()
+            return self.server.storage.local_path(self.path)
+        except XrdError as exc:
+            self._send(500 if exc.code == kXR_IOError else 400, body=exc.message.encode('utf-8'))
+            return None
+
+    def do_HEAD(self):
+        lpath = self._prepare('stat')
+        if lpath is None:
+            return
+        if not os.path.isfile(lpath):
+            return self._send(404)
+        headers = {'Content-Length': str(os.stat(lpath).st_size), 'Accept-Ranges': 'bytes'}
+        if 'adler32' in self.headers.get('Want-Digest', '').lower():
+            headers['Digest'] = 'adler32=' + self.server.storage.adler32(lpath)
+        self._send(200, headers)
+
+    def do_GET(self):
+        rng = self.headers.get('Range')
+        lpath = self._prepare('read' if rng is None else 'readv')
+        if lpath is None:
+            return
+        if not os.path.isfile(lpath):
+            return self._send(404)
+        size = os.stat(lpath).st_size
+        with open(lpath, 'rb') as fd:
+            if rng is None:
+                self.send_response(200)
+                self.send_header('Content-Length', str(size))
+                self.end_headers()
+                while True:
+                    data = fd.read(HTTP_BLOCK_SIZE)
+                    if not data:
+                        break
+                    self.server.faults.transfer(len(data))
+                    self.wfile.write(data)
+                return
+            ranges = []
+            for r in rng.split('=', 1)[1].split(','):
+                a, b = r.strip().split('-')
+                ranges.append( (int(a), min(int(b), size - 1)) )
+            if len(ranges) == 1:
+                a, b = ranges[0]
+                body = os.pread(fd.fileno(), b - a + 1, a)
+                self.server.faults.transfer(len(body))
+                return self._send(206, {'Content-Range': 'bytes {0}-{1}/{2}'.format(a, b, size)}, body)
+            boundary = 'STANDIN_BOUNDARY'
+            parts = []
+            for a, b in ranges:
+                parts.append('--{0}\r\nContent-Type: application/octet-stream\r\nContent-Range: bytes {1}-{2}/{3}\r\n\r\n'.format(boundary, a, b, size).encode('ascii'))
+                parts.append(os.pread(fd.fileno(), b - a + 1, a) + b'\r\n')
+            parts.append('--{0}--\r\n'.format(boundary).encode('ascii'))
+            body = b''.join(parts)
+            self.server.faults.transfer(len(body))
+            self._send(206, {'Content-Type': 'multipart/byteranges; boundary={0}'.format(boundary)}, body)
+
+    def do_PUT(self):
+        lpath = self._prepare('write')
+        if lpath is None:
+            return
+        length = int(self.headers['Content-Length'])
+        os.makedirs(os.path.dirname(lpath), exist_ok=True)
+        with open(lpath, 'wb') as fd:
+            while length > 0:
+                data = self.rfile.read(min(length, HTTP_BLOCK_SIZE))
+                if not data:
+                    break
+                self.server.faults.transfer(len(data))
+                fd.write(data)
+                length -= len(data)
+        self._send(201)
+
+    def do_DELETE(self):
+        lpath = self._prepare('rm')
+        if lpath is None:
+            return
+        try:
+            os.unlink(lpath)
+        except FileNotFoundError:
+            return self._send(404)
+        self._send(204)
+
+
+class HTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, storage, faults):
+        self.storage = storage
+        self.faults = faults
+        super().__init__(address, HTTPHandler)
+
+
+def start_server(server):
+    "Run server in a background thread, return the thread"
+    thr = threading.Thread(target=server.serve_forever, name=type(server).__name__, daemon=True)
+    thr.start()
+    return thr
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-d', '--directory', help="Directory with the files to serve", required=True)
+    parser.add_argument('-H', '--host', help="Address to listen on. Default is localhost", default='localhost')
+    parser.add_argument('-p', '--port', help="xroot port. Default is 1094", type=int, default=1094)
+    parser.add_argument('-P', '--http_port', help="If given, serve the same files over http on this port", type=int, default=None)
+    parser.add_argument('-l', '--latency', help="Delay every request by this many seconds", type=float, default=0)
+    parser.add_argument('-j', '--jitter', help="Add random delay up to this many seconds", type=float, default=0)
+    parser.add_argument('-b', '--bandwidth', help="Bandwidth limit, bytes/s", type=int, default=None)
+    parser.add_argument('-e', '--error_rate', help="Fraction of requests to fail", type=float, default=0)
+    parser.add_argument('-E', '--error_ops', help="Comma-separated list of requests that may fail, e.g. read,readv. Default is all", default=None)
+    parser.add_argument('-s', '--seed', help="Random seed for jitter and errors", type=int, default=None)
+    parser.add_argument('--iov_max', help="readv_iov_max. Default is {0}".format(DEF_IOV_MAX), type=int, default=DEF_IOV_MAX)
+    parser.add_argument('--ior_max', help="readv_ior_max. Default is {0}".format(DEF_IOR_MAX), type=int, default=DEF_IOR_MAX)
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    storage = Storage(args.directory, iov_max=args.iov_max, ior_max=args.ior_max)
+    faults = Faults(
+            latency=args.latency,
+            jitter=args.jitter,
+            bandwidth=args.bandwidth,
+            error_rate=args.error_rate,
+            error_ops=args.error_ops.split(',') if args.error_ops else None,
+            seed=args.seed
+        )
+    servers = [XrootdServer((args.host, args.port), storage, faults)]
+    if args.http_port:
+        servers.append(HTTPServer((args.host, args.http_port), storage, faults))
+    for srv in servers:
+        start_server(srv)
+        print("Listening on {0}:{1} ({2})".format(*srv.server_address[:2], type(srv).__name__), file=sys.stderr)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        for srv in servers:
+            srv.shutdown()
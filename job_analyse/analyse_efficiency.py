@@ -1,11 +1,11 @@
 #!/usr/bin/env python3
-import re
-import sys
-import json
 import argparse
 
 from datetime import datetime
 
+from job_store import load_jobs
+from efficiency import GROUPS, jobs_frame, efficiency
+
 def parse_args():
     parser = argparse.ArgumentParser()
     g = parser.add_mutually_exclusive_group()
@@ -15,84 +15,62 @@ def parse_args():
     g1.add_argument("-s", "--strict", help="Strict mode. For failed jobs cputime is set to 0.", action='store_true')
     g1.add_argument("-l", "--loose", help="Loose mode. Only consider successfull jobs.", action='store_true')
     parser.add_argument("-m", "--merge", help="Merge all hosts into a single group.", action='store_true')
+    parser.add_argument("-g", "--group", help="Comma-separated groupings, from {0}. Default is host".format(','.join(GROUPS)), default='host')
+    parser.add_argument("-f", "--freq", help="Time bucket for 'time' grouping, pandas frequency. Default is 1D", default='1D')
+    parser.add_argument("-A", "--all_modes", help="Print a table with efficiencies of all modes and failure rates.", action='store_true')
     parser.add_argument("-S", "--since", help="Only consider jobs finished after <DD>-<MM>-<YYYY>T<HH>:<MM>.", default=None)
     parser.add_argument("-U", "--until", help="Only consider jobs finished before <DD>-<MM>-<YYYY>T<HH>:<MM>.", default=None)
-    parser.add_argument("file", help="File to parse")
+    parser.add_argument("file", help="Json file from merge.py ('-' for stdin), or a job store")
     return parser.parse_args()
 
 
 if __name__ == '__main__':
     args = parse_args()
-    if args.file == '-':
-        data = json.loads(sys.stdin.read())
-    else:
-        with open(args.file) as fd:
-            data = json.loads(fd.read())
     if args.boundaries:
         bot_border, up_border = (int (x) for x in args.boundaries.split(','))
     else:
         bot_border, up_border = -1, 10**10
 
-    res = {}
     if args.node:
         nodes = args.node.split(',')
     else:
         nodes = None
-    host_rexp = re.compile('.*(lcg([0-9]+))\.gridpp.rl.ac.uk$')
 
     start_ts = int(datetime.strptime(args.since, '%d-%m-%YT%H:%M').strftime("%s")) if args.since else None
     end_ts = int(datetime.strptime(args.until, '%d-%m-%YT%H:%M').strftime("%s")) if args.until else None
+    #Job timestamps are in ms. For stores the time range is selected by the index.
+    data = load_jobs(args.file, since=start_ts * 1000 if start_ts else None, until=end_ts * 1000 if end_ts else None,
+                     status='Done' if args.loose else None)
 
-    for job in data:
-        try:
-            cputime = float(job['TotalCPUTime(s)'])
-            walltime = job['WallClockTime(s)']
-            host_str = job['HostName']
-            status = job['Status']
-        except KeyError:
-            continue
-        if start_ts or end_ts:
-            try:
-                job_ts = job['timestamp']
-            except KeyError:
-                continue
-            job_ts = job_ts / 1000
-            if (start_ts and start_ts > job_ts) or (end_ts and end_ts < job_ts):
-                continue
-
-        if args.loose and status != 'Done':
-            continue
-        m = host_rexp.match(job['HostName'])
-        if m:
-            host = m.group(1)
-            num = int(m.group(2))
-        else:
-            continue
-
-        failed = 0
-        if status == 'Failed':
-            failed = 1
-            if args.strict:
-                cputime = 0
+    jobs = jobs_frame(data)
+    jobs = jobs[jobs['host'].notna()]
+    if start_ts or end_ts:
+        job_ts = jobs['timestamp'] / 1000
+        keep = job_ts.notna()
+        if start_ts:
+            keep &= job_ts >= start_ts
+        if end_ts:
+            keep &= job_ts <= end_ts
+        jobs = jobs[keep]
+    if args.loose:
+        jobs = jobs[jobs['status'] == 'Done']
 
-        #Process individual jobs, do not save anything
-        if nodes and host in nodes:
-            print(job['JobID'], host, cputime / walltime) 
-        #Process nodes
+    #Process individual jobs
+    if nodes:
+        jobs = jobs[jobs['host'].isin(nodes)].dropna(subset=['status', 'cputime', 'walltime'])
+        cputime = jobs['cputime'].where(~(args.strict & (jobs['status'] == 'Failed')), 0.0)
+        for job_id, host, eff in zip(jobs['JobID'], jobs['host'], cputime / jobs['walltime']):
+            print(job_id, host, eff)
+    #Process groups
+    else:
+        jobs = jobs[(jobs['host_num'] >= bot_border) & (jobs['host_num'] <= up_border)]
+        res = efficiency(jobs, ['all'] if args.merge else args.group.split(','), args.freq)
+        #No row if no job is in the range
+        if args.merge and args.boundaries is not None and len(res) == 1:
+            res.index = [args.boundaries]
+        if args.all_modes:
+            print(res.to_string())
         else:
-            if num >= bot_border and num <= up_border:
-               if args.merge:
-                   key = 'all' if args.boundaries is None else args.boundaries
-               else:
-                   key = host
-               if key in res:
-                   res[key]['CPUTime'] += cputime
-                   res[key]['WALLTime'] += walltime
-                   res[key]['cnt'] += 1
-                   res[key]['failed'] += failed
-               else:
-                   res[key] = {'CPUTime': cputime, 'WALLTime': walltime, 'cnt': 1, 'failed': failed}
- 
-    if not nodes:
-        for key, res in res.items():
-            print(res['CPUTime'] / res['WALLTime'], key, res['cnt'], res['failed'])
+            eff = res['strict_efficiency'] if args.strict else res['efficiency']
+            for key, val, cnt, failed in zip(res.index, eff, res['jobs'], res['failed']):
+                print(val, ','.join(str(k) for k in key) if isinstance(key, tuple) else key, cnt, failed)
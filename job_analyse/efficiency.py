@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+CPU/wall efficiency of jobs with pandas: jobs are loaded once into a DataFrame, then aggregated by any grouping
+(host, hardware generation, time bucket, site, job type, status, or all jobs together).
+
+All modes are computed in the same pass:
+
+    efficiency          sum of CPU time over sum of wall time of all jobs
+    strict_efficiency   CPU time of failed jobs is taken as 0
+    loose_efficiency    only successful (Done) jobs are considered
+
+Run as a script to print a table:
+
+    ./efficiency.py -g gen,site jobs.db
+"""
+import argparse
+
+import numpy as np
+import pandas
+
+from job_store import load_jobs
+
+
+#Last worker node number of every hardware generation
+WN_GENS = [ (2270, '2017-dell'), (2326, '2017-xma'), (2386, '2018-xma'), (2434, '2019-dell'), (2537, '2020-xma'), (2642, '2021-xma')]
+#Hosts that are counted as worker nodes, with their short name and number
+HOST_REXP = r'(lcg([0-9]+))\.gridpp.rl.ac.uk$'
+GROUPS = ['all', 'host', 'gen', 'time', 'site', 'job_type', 'status']
+#Record key for every column
+KEYS = [('JobID', 'JobID'), ('status', 'Status'), ('hostname', 'HostName'), ('site', 'Site'), ('job_type', 'JobType'),
+        ('cputime', 'TotalCPUTime(s)'), ('walltime', 'WallClockTime(s)'), ('timestamp', 'timestamp')]
+
+
+def get_gen(wn):
+    "Index of the generation of the worker node number in WN_GENS, len(WN_GENS) for newer ones"
+    idx = 0
+    for border, _ in WN_GENS:
+        if wn <= border:
+            break
+        idx += 1
+    return idx
+
+
+def _to_float(value):
+    "float() of numbers and numeric strings (exactly as in the records), NaN for anything else"
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def jobs_frame(jobs):
+    """
+    DataFrame with a row for every job record: JobID, status, hostname, site, job_type, cputime, walltime,
+    timestamp (ms), time (datetime), host ('lcg<N>' for worker nodes, otherwise NaN), host_num (N for any
+    host with 'lcg<N>' in its name, otherwise -1) and gen (index in WN_GENS, -1 without host_num).
+    """
+    numeric = ('cputime', 'walltime', 'timestamp')
+    df = pandas.DataFrame({col: [_to_float(job.get(key)) if col in numeric else job.get(key) for job in jobs] for col, key in KEYS})
+    df['time'] = pandas.to_datetime(df['timestamp'], unit='ms')
+    hostname = df['hostname'].astype('string')
+    df['host'] = hostname.str.extract(HOST_REXP, expand=True)[0].astype(object)
+    df['host_num'] = pandas.to_numeric(hostname.str.extract(r'lcg([0-9]+)', expand=False), errors='coerce').fillna(-1).astype(np.int64)
+    #Same as get_gen: first generation whose border is not below the number
+    gens = np.searchsorted([border for border, _ in WN_GENS], df['host_num'].to_numpy(), side='left')
+    df['gen'] = np.where(df['host_num'] >= 0, gens, -1)
+    return df
+
+
+def efficiency(df, by=('host',), freq='1D'):
+    """
+    Efficiencies, job counts and failure rate for every group. by is a list of GROUPS, 'time' is bucketed by freq.
+    Jobs without status are skipped. Jobs without CPU or wall time are counted in jobs, failed, done and
+    failure_rate, but not in the times and efficiencies. Jobs with a missing key form their own (NaN) group.
+    Groups are in the order they first appear.
+    """
+    df = df.dropna(subset=['status'])
+    failed = df['status'] == 'Failed'
+    done = df['status'] == 'Done'
+    timed = df['cputime'].notna() & df['walltime'].notna()
+    cputime = df['cputime'].where(timed, 0.0)
+    walltime = df['walltime'].where(timed, 0.0)
+    cols = pandas.DataFrame({
+            'cputime': cputime,
+            'walltime': walltime,
+            'strict_cputime': cputime.where(~failed, 0.0),
+            'done_cputime': cputime.where(done, 0.0),
+            'done_walltime': walltime.where(done, 0.0),
+            'jobs': 1,
+            'failed': failed.astype(np.int64),
+            'done': done.astype(np.int64),
+        })
+    keys = []
+    for group in by:
+        if group not in GROUPS:
+            raise ValueError("Unknown grouping {0}, should be one of {1}".format(group, GROUPS))
+        if group == 'all':
+            keys.append(pandas.Series('all', index=df.index, name='all'))
+        elif group == 'time':
+            keys.append(df['time'].dt.floor(freq))
+        else:
+            keys.append(df[group])
+    res = cols.groupby(keys, sort=False, dropna=False).sum()
+    res['efficiency'] = res['cputime'] / res['walltime']
+    res['strict_efficiency'] = res['strict_cputime'] / res['walltime']
+    res['loose_efficiency'] = res['done_cputime'] / res['done_walltime']
+    res['failure_rate'] = res['failed'] / res['jobs']
+    return res[['efficiency', 'strict_efficiency', 'loose_efficiency', 'jobs', 'failed', 'done', 'failure_rate', 'cputime', 'walltime']]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-g", "--group", help="Comma-separated groupings, from {0}. Default is host".format(','.join(GROUPS)), default='host')
+    parser.add_argument("-f", "--freq", help="Time bucket for 'time' grouping, pandas frequency. Default is 1D", default='1D')
+    parser.add_argument("-o", "--output", help="Save the table to this csv file instead of printing it", default=None)
+    parser.add_argument("file", help="Json file from merge.py ('-' for stdin), or a job store")
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    res = efficiency(jobs_frame(load_jobs(args.file)), args.group.split(','), args.freq)
+    if args.output:
+        res.to_csv(args.output)
+    else:
+        print(res.to_string())
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+import math
+
+import pytest
+
+from efficiency import WN_GENS, get_gen, jobs_frame, efficiency
+
+
+def job(job_id, host, status, cputime, walltime, timestamp=1700000000000, **kwargs):
+    res = {'JobID': job_id, 'HostName': host, 'Status': status, 'timestamp': timestamp}
+    if cputime is not None:
+        res['TotalCPUTime(s)'] = cputime
+    if walltime is not None:
+        res['WallClockTime(s)'] = walltime
+    res.update(kwargs)
+    return res
+
+
+JOBS = [
+        job(1, 'lcg2200.gridpp.rl.ac.uk', 'Done', 80, 100),
+        job(2, 'lcg2200.gridpp.rl.ac.uk', 'Failed', 50, 100),
+        job(3, 'lcg2200.gridpp.rl.ac.uk', 'Failed', None, None),
+        job(4, 'lcg2600.gridpp.rl.ac.uk', 'Done', '30', '60'),
+        job(5, 'lcg2600.gridpp.rl.ac.uk', None, 10, 10),
+        job(6, 'other.host', 'Done', 10, 20),
+    ]
+
+
+def test_modes_and_counts():
+    res = efficiency(jobs_frame(JOBS), ['host'])
+    assert list(res.index) == ['lcg2200', 'lcg2600', None] or math.isnan(res.index[2])
+    row = res.loc['lcg2200']
+    assert row['efficiency'] == pytest.approx(130 / 200)
+    assert row['strict_efficiency'] == pytest.approx(80 / 200)
+    assert row['loose_efficiency'] == pytest.approx(80 / 100)
+    #Failed job without times is counted, but does not change the times
+    assert (row['jobs'], row['failed'], row['done']) == (3, 2, 1)
+    assert row['failure_rate'] == pytest.approx(2 / 3)
+    #Job without status is skipped, numeric strings are parsed
+    row = res.loc['lcg2600']
+    assert (row['jobs'], row['cputime'], row['walltime']) == (1, 30, 60)
+
+
+def test_missing_key_group():
+    res = efficiency(jobs_frame(JOBS), ['host'])
+    assert len(res) == 3
+    assert res['jobs'].sum() == 5
+    assert res['efficiency'].iloc[2] == pytest.approx(0.5)
+
+
+def test_gen_and_all():
+    df = jobs_frame(JOBS)
+    assert list(df['gen']) == [get_gen(2200)] * 3 + [get_gen(2600)] * 2 + [-1]
+    res = efficiency(df, ['gen'])
+    assert list(res.index) == [get_gen(2200), get_gen(2600), -1]
+    assert get_gen(WN_GENS[-1][0] + 1) == len(WN_GENS)
+    res = efficiency(df, ['all'])
+    assert list(res.index) == ['all']
+    assert res.loc['all', 'jobs'] == 5
+
+
+def test_time_buckets():
+    day = 86400 * 1000
+    jobs = [job(i, 'lcg2200.gridpp.rl.ac.uk', 'Done', 1, 2, timestamp=1699920000000 + i * day // 2) for i in range(4)]
+    res = efficiency(jobs_frame(jobs), ['time'], '1D')
+    assert list(res['jobs']) == [2, 2]
+
+
+def test_empty():
+    res = efficiency(jobs_frame([]), ['host', 'time'])
+    assert len(res) == 0
+    assert 'efficiency' in res.columns
+
+
+def test_unknown_group():
+    with pytest.raises(ValueError):
+        efficiency(jobs_frame(JOBS), ['cluster'])
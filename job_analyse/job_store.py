@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+"""
+Job records store: DIRAC attribute/parameter dumps are parsed once into an SQLite file, keyed by JobID
+and indexed by host, status and timestamp, so that analysis scripts load only the jobs they need.
+
+Records are kept as json, in the same form merge.py prints them (datetimes as strings).
+Dumps are parsed with a literal parser that only accepts Python literals and datetime constructors, not eval.
+
+merge.py writes terminal jobs to a store with -o jobs.db. Run this as a script to load raw dumps as they are:
+
+    ./job_store.py -o jobs.db -t attributes attrs_*.txt
+"""
+import re
+import ast
+import sys
+import json
+import sqlite3
+import argparse
+import datetime
+
+
+SQLITE_MAGIC = b'SQLite format 3\x00'
+#Constructors allowed in dumps, by their dotted name
+ALLOWED_CALLS = {
+        'datetime.datetime': datetime.datetime,
+        'datetime.date': datetime.date,
+        'datetime.timedelta': datetime.timedelta,
+        'datetime': datetime.datetime,
+    }
+#Indexed columns: name, record key
+INDEXED = [('host', 'HostName'), ('status', 'Status'), ('timestamp', 'timestamp')]
+
+
+def _dotted_name(node):
+    if isinstance(node, ast.Name):
+        return node.id
+    if isinstance(node, ast.Attribute):
+        base = _dotted_name(node.value)
+        return None if base is None else base + '.' + node.attr
+    return None
+
+
+def _convert(node):
+    if isinstance(node, ast.Constant):
+        return node.value
+    if isinstance(node, ast.Dict):
+        return {_convert(k): _convert(v) for k, v in zip(node.keys, node.values)}
+    if isinstance(node, (ast.List, ast.Tuple, ast.Set)):
+        items = [_convert(v) for v in node.elts]
+        return {ast.List: list, ast.Tuple: tuple, ast.Set: set}[type(node)](items)
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.USub, ast.UAdd)):
+        val = _convert(node.operand)
+        if isinstance(val, (int, float)):
+            return -val if isinstance(node.op, ast.USub) else val
+    if isinstance(node, ast.Call) and _dotted_name(node.func) in ALLOWED_CALLS:
+        args = [_convert(a) for a in node.args]
+        kwargs = {kw.arg: _convert(kw.value) for kw in node.keywords}
+        return ALLOWED_CALLS[_dotted_name(node.func)](*args, **kwargs)
+    raise ValueError("Unsupported expression in dump: {0}".format(ast.dump(node)[:200]))
+
+
+def parse_literal(text):
+    "Value of a Python literal, that can also contain datetime constructors"
+    return _convert(ast.parse(text.strip(), mode='eval').body)
+
+
+def parse_dump(filename, dtype='attrs'):
+    """
+    Yield job records of a dump. Attribute dumps are dicts separated by '====' lines (followed by a title line),
+    parameter dumps are '{<JobID>: {...}}' blocks.
+    """
+    if dtype == 'attrs':
+        rexp = re.compile(r'^=+$')
+        parser = parse_literal
+    elif dtype == 'params':
+        rexp = re.compile(r'^\{[0-9]+: \{')
+        parser = lambda x: next(iter(parse_literal(x).values()))
+    else:
+        raise ValueError("Unexpected value for dtype: {0}".format(dtype))
+
+    data = []
+    with open(filename) as fd:
+        for line in fd:
+            if rexp.match(line):
+                if data:
+                    yield _parse_block(parser, data, filename)
+                if dtype == 'attrs':
+                    data = []
+                    fd.readline()
+                else:
+                    data = [line]
+            else:
+                data.append(line)
+    if data and ''.join(data).strip():
+        yield _parse_block(parser, data, filename)
+
+
+def _parse_block(parser, data, filename):
+    text = ''.join(data)
+    try:
+        return parser(text)
+    except (SyntaxError, ValueError) as e:
+        raise ValueError("Failed to parse a record of {0}: {1}\n{2}".format(filename, e, text)) from e
+
+
+def is_store(path):
+    if path == '-':
+        return False
+    try:
+        with open(path, 'rb') as fd:
+            return fd.read(len(SQLITE_MAGIC)) == SQLITE_MAGIC
+    except FileNotFoundError:
+        return path.endswith('.db')
+
+
+class JobStore:
+    def __init__(self, path):
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.execute('CREATE TABLE IF NOT EXISTS jobs (JobID INTEGER PRIMARY KEY, host TEXT, status TEXT, timestamp REAL, data TEXT NOT NULL)')
+        for col, _ in INDEXED:
+            self.db.execute('CREATE INDEX IF NOT EXISTS jobs_{0} ON jobs ({0})'.format(col))
+
+    @staticmethod
+    def _row(job):
+        ts = job.get('timestamp')
+        return (int(job['JobID']), job.get('HostName'), job.get('Status'),
+                ts if isinstance(ts, (int, float)) else None, json.dumps(job, default=str))
+
+    def add(self, jobs, replace=False):
+        "Add records with a JobID. Records for JobIDs already in the store are ignored, unless replace is set. Returns number of rows written"
+        with self.db:
+            cur = self.db.executemany('INSERT OR {0} INTO jobs VALUES (?, ?, ?, ?, ?)'.format('REPLACE' if replace else 'IGNORE'),
+                                      (self._row(job) for job in jobs if 'JobID' in job))
+        return cur.rowcount
+
+    def get(self, job_id):
+        row = self.db.execute('SELECT data FROM jobs WHERE JobID = ?', (int(job_id),)).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def select(self, host=None, status=None, since=None, until=None, ids=None):
+        """
+        Yield records, in JobID order. host and status can be a value or a list of values,
+        since and until are timestamps (in ms, as in the records), jobs without timestamp are skipped if any is given.
+        """
+        cond, params = [], []
+        for col, val in (('host', host), ('status', status), ('JobID', ids)):
+            if val is None:
+                continue
+            vals = [val] if isinstance(val, (str, int)) else list(val)
+            cond.append('{0} IN ({1})'.format(col, ','.join('?' * len(vals))))
+            params.extend(vals)
+        if since is not None:
+            cond.append('timestamp >= ?')
+            params.append(since)
+        if until is not None:
+            cond.append('timestamp <= ?')
+            params.append(until)
+        query = 'SELECT data FROM jobs' + (' WHERE ' + ' AND '.join(cond) if cond else '') + ' ORDER BY JobID'
+        for row in self.db.execute(query, params):
+            yield json.loads(row[0])
+
+    def __len__(self):
+        return self.db.execute('SELECT COUNT(*) FROM jobs').fetchone()[0]
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def load_jobs(path, **filters):
+    """
+    List of job records from a store, a json file written by merge.py, or '-' for json on stdin.
+    filters are passed to JobStore.select, for json files they are not applied.
+    """
+    if is_store(path):
+        with JobStore(path) as store:
+            return list(store.select(**filters))
+    if path == '-':
+        return json.loads(sys.stdin.read())
+    with open(path) as fd:
+        return json.load(fd)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Load DIRAC dumps into a job store. Use merge.py for selecting terminal jobs and joining attributes with parameters")
+    parser.add_argument('-o', '--output', help="Store file", required=True)
+    parser.add_argument('-t', '--type', help="Dump type", choices=['attributes', 'parameters'], default='attributes')
+    parser.add_argument('-r', '--replace', help="Replace records already in the store", action='store_true')
+    parser.add_argument('files', help="Dump files", nargs='+')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    dtype = 'attrs' if args.type == 'attributes' else 'params'
+    with JobStore(args.output) as store:
+        for filename in args.files:
+            store.add(parse_dump(filename, dtype), replace=args.replace)
+        print("{0} jobs in {1}".format(len(store), args.output))
@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+
+import seaborn
+import argparse
+
+from matplotlib import pyplot
+
+from job_store import load_jobs
+from efficiency import WN_GENS, jobs_frame
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-g', '--group', help='How to group bins. Either WN or GEN', choices=['WN', 'GEN'], default='WN')
+    parser.add_argument('-o', '--output', help='Path to the output file', required=True)
+    parser.add_argument('-r', '--resolution', help="Plot's resolution", default=300, type=int)
+    parser.add_argument('-n', '--normalize', help="Normalize bins, to show relative results", action='store_true')
+    parser.add_argument('file', help="Json file from merge.py ('-' for stdin), or a job store")
+    args = parser.parse_args()
+    return args
+
+if __name__ == '__main__':
+    args = parse_args()
+
+    jobs = jobs_frame(load_jobs(args.file))
+    data = jobs[['JobID', 'status', 'host_num', 'gen']].rename(columns={'JobID': 'ID', 'host_num': 'host'})
+
+    title='Number of jobs'
+    ytitle = 'Count'
+    if args.normalize:
+        title='Jobs per ' + args.group
+        ytitle = 'Fraction'
+        #Every generation sums up to 1
+        norm_coeffs = (1.0 / data.groupby('gen')['gen'].transform('size')).tolist()
+
+    x_data = 'host' if args.group == 'WN' else 'gen'
+    xticks = [i for i in range(len(WN_GENS))]
+    if x_data == 'host':
+        kwargs = {'binwidth': 1}
+    else:
+        x_data = 'gen'
+        kwargs = {'multiple': 'stack'}
+        if args.normalize:
+            kwargs['weights'] =  norm_coeffs
+            kwargs['bins'] = data['gen'].nunique()
+            kwargs['shrink'] = 0.8
+            xticks = [i*0.83+0.42 for i in range(len(WN_GENS))]
+
+    plt = seaborn.displot(data, x=x_data, hue='status', **kwargs) #, palette=["#00ff00", "#ff0000"])
+    plt.set(title=title)
+    plt.set_ylabels(ytitle)
+    if args.group == 'WN':
+        pyplot.xticks([x[0] for x in WN_GENS], [i[1] for i in WN_GENS], rotation=90)
+    else:
+        pyplot.xticks(xticks, [i[1] for i in WN_GENS], rotation=90)
+    plt.savefig(args.output, dpi=args.resolution)
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+Readv chunk lists stored as NumPy offset/length arrays.
+
+Generators produce whole plans with a few vectorised calls, instead of one randint call per chunk.
+Plans are converted to the list of tuples that vector_read expects only right before the request is sent.
+"""
+import numpy as np
+
+
+class ChunkPlan:
+    def __init__(self, offsets, lengths):
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.lengths = np.asarray(lengths, dtype=np.int64)
+        if self.offsets.shape != self.lengths.shape:
+            raise ValueError("Offsets and lengths should have the same shape: {0} != {1}".format(self.offsets.shape, self.lengths.shape))
+
+    @classmethod
+    def from_list(cls, chunks):
+        arr = np.asarray(chunks, dtype=np.int64).reshape(-1, 2)
+        return cls(arr[:, 0], arr[:, 1])
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __getitem__(self, idx):
+        return ChunkPlan(self.offsets[idx], self.lengths[idx])
+
+    @property
+    def ends(self):
+        return self.offsets + self.lengths
+
+    @property
+    def total_bytes(self):
+        return int(self.lengths.sum())
+
+    @property
+    def min_offset(self):
+        "0 for an empty plan"
+        return int(self.offsets.min()) if len(self) else 0
+
+    @property
+    def max_end(self):
+        return int(self.ends.max()) if len(self) else 0
+
+    @property
+    def scatter(self):
+        "Distance between the first and the last byte requested"
+        return self.max_end - self.min_offset
+
+    def sorted(self):
+        "Plan sorted by offset, then by length"
+        order = np.lexsort( (self.lengths, self.offsets) )
+        return self[order]
+
+    def unique(self):
+        "Plan without duplicate chunks. Order of the first occurrences is kept."
+        #lexsort is stable, so the first chunk of every group of equal ones is its first occurrence
+        order = np.lexsort( (self.lengths, self.offsets) )
+        offsets, lengths = self.offsets[order], self.lengths[order]
+        keep = np.ones(len(order), dtype=bool)
+        keep[1:] = (offsets[1:] != offsets[:-1]) | (lengths[1:] != lengths[:-1])
+        return self[np.sort(order[keep])]
+
+    def overlap_mask(self):
+        "For the sorted plan, True for every chunk that overlaps with any of the previous ones"
+        plan = self.sorted()
+        max_prev_end = np.maximum.accumulate(plan.ends)
+        res = np.zeros(len(plan), dtype=bool)
+        res[1:] = plan.offsets[1:] < max_prev_end[:-1]
+        return res
+
+    def has_overlaps(self):
+        return bool(self.overlap_mask().any())
+
+    def to_list(self):
+        "List of (offset, length) tuples, as vector_read wants it"
+        return list(zip(self.offsets.tolist(), self.lengths.tolist()))
+
+
+def random_plan(n, size, scatter, max_len, interval=None, rng=None):
+    """
+    n random chunks (duplicates removed) with lengths from 1 to max_len.
+    Offsets are taken from interval, if given, otherwise from a random window of scatter bytes.
+    """
+    rng = np.random.default_rng() if rng is None else rng
+    if interval is None:
+        if size > scatter:
+            center = int(rng.integers(scatter // 2, size - scatter // 2, endpoint=True))
+            a, b = center - scatter // 2, center + scatter // 2
+        else:
+            a, b = 0, size - max_len
+            if b < 0:
+                raise ValueError("File size too small: {0} while max chunk len is {1}".format(size, max_len))
+    else:
+        a, b = interval
+    offsets = rng.integers(a, b, size=n, endpoint=True)
+    lengths = rng.integers(1, max_len, size=n, endpoint=True)
+    return ChunkPlan(offsets, lengths).unique()
+
+
+def jobsim_plan(n, size, scatter, max_len, max_iter, itr, rng=None):
+    "Imitate a job that reads the file from the beginning to the end, with random chunks in a moving window"
+    if itr > max_iter:
+        itr = 1
+    if scatter + max_len + 1 > size:
+        raise ValueError("File size is too small: {0} while scatter is {1}".format(size, scatter))
+
+    if itr == 1:
+        interval = (0, scatter)
+    elif itr == 2:
+        interval = (size - scatter - max_len - 1, size - 1 - max_len)
+    else:
+        start = int( (size - scatter) * itr / max_iter )
+        interval = ( min(start, size - max_len - 2) , min(start + scatter, size - max_len - 1))
+    return random_plan(n, None, None, max_len, interval, rng=rng)
+
+
+def border_plan(n, size, block_size=8*1024*1024, rng=None):
+    "2-byte chunks crossing every block border, plus 1-byte random chunks up to n chunks in total"
+    rng = np.random.default_rng() if rng is None else rng
+    if size < block_size or size < n:
+        raise ValueError("File too small for border test")
+
+    borders = np.arange(1, size // block_size, dtype=np.int64) * block_size - 1
+    if size % block_size != 0:
+        borders = np.append(borders, (size // block_size) * block_size - 1)
+    offsets = np.unique(borders)
+    lengths = np.full(len(offsets), 2, dtype=np.int64)
+
+    #1-byte chunks can not coincide with 2-byte ones, so only deduplicate them among themselves
+    rand = np.empty(0, dtype=np.int64)
+    while len(offsets) + len(rand) < n:
+        need = n - len(offsets) - len(rand)
+        rand = np.unique(np.concatenate( (rand, rng.integers(0, size - 1, size=2*need, endpoint=True)) ))
+    rand = rng.permutation(rand)[:max(n - len(offsets), 0)]
+
+    return ChunkPlan(np.concatenate( (offsets, rand) ), np.concatenate( (lengths, np.ones(len(rand), dtype=np.int64)) ))
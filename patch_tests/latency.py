@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+"""
+Latency histograms for readv tests.
+
+Histogram is a high-dynamic-range (log-linear) histogram of nanosecond durations: values are grouped
+by power of two, and every group is split into 2**(sub_bits - 1) linear buckets, so the relative error
+of any percentile is below 2**(1 - sub_bits) (less than 2% with the default 7 bits) and memory does not depend
+on the number of values recorded.
+
+LatencyRecorder keeps one histogram per (request type, chunk count bucket, bytes bucket). Recorders can be merged,
+and saved to/loaded from json, so results of different threads, processes or jobs can be combined:
+
+    ./latency.py job1.json job2.json
+"""
+import sys
+import json
+import atexit
+import argparse
+
+from threading import Lock, Thread, Event
+from time import perf_counter_ns
+
+
+PERCENTILES = (50, 90, 99, 99.9)
+
+
+class Histogram:
+    def __init__(self, sub_bits=7, max_value=2**42):
+        self.sub_bits = sub_bits
+        self.max_value = max_value
+        self.half = 2**(sub_bits - 1)
+        self.counts = [0] * (self.index(max_value) + 1)
+        self.total = 0
+        self.sum = 0
+        self.min = None
+        self.max = None
+
+    def index(self, value):
+        shift = value.bit_length() - self.sub_bits
+        if shift <= 0:
+            return value
+        return shift * self.half + (value >> shift)
+
+    def bucket_range(self, idx):
+        "Lowest and highest values that go to the bucket idx"
+        if idx < 2 * self.half:
+            return idx, idx
+        shift = idx // self.half - 1
+        mantissa = idx - shift * self.half
+        return mantissa << shift, ((mantissa + 1) << shift) - 1
+
+    def record(self, value, count=1):
+        value = min(max(int(value), 0), self.max_value)
+        self.counts[self.index(value)] += count
+        self.total += count
+        self.sum += value * count
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def percentile(self, pct):
+        "Highest value equivalent to the pct-th percentile, or None if the histogram is empty"
+        if self.total == 0:
+            return None
+        need = max(int(self.total * pct / 100 + 0.5), 1)
+        seen = 0
+        for idx, cnt in enumerate(self.counts):
+            seen += cnt
+            if seen >= need:
+                return min(self.bucket_range(idx)[1], self.max)
+        return self.max
+
+    @property
+    def mean(self):
+        return self.sum / self.total if self.total else None
+
+    def merge(self, other):
+        if (other.sub_bits, other.max_value) != (self.sub_bits, self.max_value):
+            raise ValueError("Can not merge histograms with different configuration")
+        for idx, cnt in enumerate(other.counts):
+            if cnt:
+                self.counts[idx] += cnt
+        self.total += other.total
+        self.sum += other.sum
+        for attr, func in (('min', min), ('max', max)):
+            values = [v for v in (getattr(self, attr), getattr(other, attr)) if v is not None]
+            setattr(self, attr, func(values) if values else None)
+        return self
+
+    def to_dict(self):
+        return {
+                'sub_bits': self.sub_bits,
+                'max_value': self.max_value,
+                'counts': {idx: cnt for idx, cnt in enumerate(self.counts) if cnt},
+                'total': self.total,
+                'sum': self.sum,
+                'min': self.min,
+                'max': self.max,
+            }
+
+    @classmethod
+    def from_dict(cls, data):
+        res = cls(data['sub_bits'], data['max_value'])
+        for idx, cnt in data['counts'].items():
+            res.counts[int(idx)] = cnt
+        res.total, res.sum, res.min, res.max = data['total'], data['sum'], data['min'], data['max']
+        return res
+
+
+def size_bucket(value):
+    "Smallest power of two that is not less than value"
+    return 1 << max(int(value) - 1, 0).bit_length()
+
+
+class LatencyRecorder:
+    "Thread-safe set of histograms keyed by (op, chunk count bucket, bytes bucket)"
+    def __init__(self, sub_bits=7):
+        self.sub_bits = sub_bits
+        self.hists = {}
+        self.nbytes = {}
+        self.lock = Lock()
+        self.start = perf_counter_ns()
+
+    def record(self, op, nchunks, nbytes, duration_ns):
+        key = (op, size_bucket(nchunks), size_bucket(nbytes))
+        with self.lock:
+            try:
+                hist = self.hists[key]
+            except KeyError:
+                hist = self.hists[key] = Histogram(self.sub_bits)
+                self.nbytes[key] = 0
+            hist.record(duration_ns)
+            self.nbytes[key] += nbytes
+
+    def hook(self, op='readv'):
+        "on_request callback for do_readvs. Failed requests are recorded separately, as <op>_err"
+        def on_request(start_ns, duration_ns, ok, plan):
+            self.record(op if ok else op + '_err', len(plan), plan.total_bytes, duration_ns)
+        return on_request
+
+    def swap(self):
+        "Return recorder with everything recorded so far and start from scratch"
+        res = LatencyRecorder(self.sub_bits)
+        with self.lock:
+            res.hists, self.hists = self.hists, {}
+            res.nbytes, self.nbytes = self.nbytes, {}
+            res.start, self.start = self.start, perf_counter_ns()
+        return res
+
+    def merge(self, other):
+        with self.lock:
+            for key, hist in other.hists.items():
+                if key in self.hists:
+                    self.hists[key].merge(hist)
+                    self.nbytes[key] += other.nbytes[key]
+                else:
+                    self.hists[key] = Histogram(hist.sub_bits, hist.max_value).merge(hist)
+                    self.nbytes[key] = other.nbytes[key]
+            self.start = min(self.start, other.start)
+        return self
+
+    def to_dict(self):
+        with self.lock:
+            return {'sub_bits': self.sub_bits, 'elapsed_ns': perf_counter_ns() - self.start,
+                    'hists': [ [list(key), hist.to_dict(), self.nbytes[key]] for key, hist in self.hists.items() ]}
+
+    @classmethod
+    def from_dict(cls, data):
+        res = cls(data['sub_bits'])
+        for key, hist, nbytes in data['hists']:
+            res.hists[tuple(key)] = Histogram.from_dict(hist)
+            res.nbytes[tuple(key)] = nbytes
+        res.start = perf_counter_ns() - data['elapsed_ns']
+        return res
+
+    def report(self, elapsed_ns=None):
+        "Percentiles (in seconds) and throughput for every key and for all requests of every type"
+        elapsed_ns = perf_counter_ns() - self.start if elapsed_ns is None else elapsed_ns
+        with self.lock:
+            rows = [ (key, hist, self.nbytes[key]) for key, hist in sorted(self.hists.items()) ]
+        totals = {}
+        for (op, _, _), hist, nbytes in rows:
+            if op not in totals:
+                totals[op] = [Histogram(hist.sub_bits, hist.max_value), 0]
+            totals[op][0].merge(hist)
+            totals[op][1] += nbytes
+        rows += [ ((op, 'all', 'all'), hist, nbytes) for op, (hist, nbytes) in sorted(totals.items()) ]
+
+        lines = ['{0:8} {1:>8} {2:>12} {3:>9} '.format('op', 'chunks<=', 'bytes<=', 'count') +
+                 ' '.join('{0:>10}'.format('p{0}'.format(p)) for p in PERCENTILES) + ' {0:>10} {1:>10} {2:>10}'.format('max', 'req/s', 'MiB/s')]
+        elapsed = max(elapsed_ns, 1) / 1e9
+        for (op, chunks, nbytes_bucket), hist, nbytes in rows:
+            lines.append('{0:8} {1:>8} {2:>12} {3:>9} '.format(op, chunks, nbytes_bucket, hist.total) +
+                         ' '.join('{0:>10.6f}'.format(hist.percentile(p) / 1e9) for p in PERCENTILES) +
+                         ' {0:>10.6f} {1:>10.2f} {2:>10.2f}'.format(hist.max / 1e9, hist.total / elapsed, nbytes / elapsed / 1024**2))
+        return '\n'.join(lines)
+
+
+class Reporter:
+    """
+    Print interval reports of the recorder every interval seconds, and the report of the whole run at exit.
+    If json_path is given, the whole run is also saved there, to be merged with other runs later.
+    """
+    def __init__(self, recorder, interval=None, out=sys.stderr, json_path=None):
+        self.recorder = recorder
+        self.total = LatencyRecorder(recorder.sub_bits)
+        self.interval = interval
+        self.out = out
+        self.json_path = json_path
+        self.stopped = Event()
+        self.thread = None
+        self.lock = Lock()
+        self.done = False
+
+    def start(self):
+        if self.interval:
+            self.thread = Thread(target=self._run, name='latency_reporter', daemon=True)
+            self.thread.start()
+        atexit.register(self.stop)
+        return self
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            self.dump_interval()
+
+    def dump_interval(self):
+        with self.lock:
+            part = self.recorder.swap()
+            elapsed = perf_counter_ns() - part.start
+            self.total.merge(part)
+        print("Latency, last {0:.1f} s:\n{1}".format(elapsed / 1e9, part.report(elapsed)), file=self.out, flush=True)
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+        with self.lock:
+            if self.done:
+                return
+            self.done = True
+            self.total.merge(self.recorder.swap())
+        print("Latency, whole run:\n{0}".format(self.total.report()), file=self.out, flush=True)
+        if self.json_path:
+            with open(self.json_path, 'w') as fd:
+                json.dump(self.total.to_dict(), fd)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Merge latency histograms saved by readv tests and print the report")
+    parser.add_argument('files', nargs='+', help="json files with saved histograms")
+    parser.add_argument('-o', '--output', help="Save merged histograms to this file", default=None)
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    res = None
+    for path in args.files:
+        with open(path) as fd:
+            rec = LatencyRecorder.from_dict(json.load(fd))
+        #Jobs are assumed to run in parallel, so merge keeps the longest of them for throughput
+        res = rec if res is None else res.merge(rec)
+    print(res.report())
+    if args.output:
+        with open(args.output, 'w') as fd:
+            json.dump(res.to_dict(), fd)
@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+"""
+Load generator: many readv streams in a few processes, each running a number of threads.
+
+Every stream is a do_readvs loop over one or more files. In closed-loop mode a stream sends the next readv
+as soon as the previous one finishes; in open-loop mode readvs are sent at a given rate, independently
+of how fast the server responds. Streams may be started gradually (ramp-up).
+
+Requests are timed in the streams themselves, with nanosecond resolution, and all records are written
+to a single csv file in the same format as analyze/log2csv.py produces, so no debug logs are needed:
+
+    start,duration,state,size,chunks,scatter,buf_start
+
+Binary traces (-x) need analyze/trace_log.py, next to this script or in PYTHONPATH.
+"""
+import argparse
+import multiprocessing
+import queue
+import sys
+
+from contextlib import nullcontext
+from threading import Thread
+from time import sleep, time_ns, perf_counter_ns
+
+import numpy as np
+
+from XRootD import client
+
+from readv_only_test import do_readvs, random_line
+from chunk_plan import ChunkPlan
+from latency import LatencyRecorder, Reporter
+
+
+#How many records a stream collects before sending them to the writer
+BATCH_SIZE = 64
+#How long processes wait for each other before starting the streams
+START_TIMEOUT = 600
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    g = parser.add_mutually_exclusive_group(required=True)
+    g.add_argument('-l', '--url_list', help="list of urls that can be used for tests")
+    g.add_argument('-u', '--url', help="Url to use for tests. '{stream}' in the url is replaced by the stream number, starting from 1.")
+    parser.add_argument('-o', '--output', help="Output csv file, '-' for stdout. Default is ./readv_times.csv", default='./readv_times.csv')
+    parser.add_argument('-P', '--processes', help="Number of worker processes. Default is 4", default=4, type=int)
+    parser.add_argument('-T', '--threads', help="Number of streams in every process. Default is 8", default=8, type=int)
+    parser.add_argument('-n', '--ntimes', help="How many readvs should be issued for a single url. Default is 100", default=100, type=int)
+    parser.add_argument('-N', '--nfiles', help="How many files every stream should test. Default is 1", default=1, type=int)
+    parser.add_argument('-t', '--test_type', help="Which test to perform. copy reads whole files sequentially, like xrdcp does.", choices=['random', 'border', 'lhcb_job', 'copy'], default='random')
+    parser.add_argument('-s', '--silent', help="Do not print chunks of failed requests.", action='store_true')
+    parser.add_argument('-S', '--scatter', help="Scatter of the readv chunks. Default if 4MB.", type=int, default=4*1024*1024)
+    parser.add_argument('-c', '--chunks_sorted', help="Sort chunks in requests.", action='store_true')
+    parser.add_argument('-C', '--chunks_number', help="Number of chunks in a single request.", type=int, default=1024)
+    parser.add_argument('-L', '--max_len', help="Max chunk length. Default is 8192", type=int, default=8192)
+    parser.add_argument('-B', '--block_size', help="Read size for copy test. Default is 8MB", type=int, default=8*1024*1024)
+    parser.add_argument('-m', '--mode', help="closed: next readv is sent when the previous one is done; open: readvs are sent at a fixed rate", choices=['closed', 'open'], default='closed')
+    parser.add_argument('-r', '--rate', help="Total readv rate for open mode, requests per second", type=float, default=None)
+    parser.add_argument('-p', '--poisson', help="In open mode, use exponential intervals between requests instead of fixed ones", action='store_true')
+    parser.add_argument('-R', '--ramp_up', help="Start streams evenly during this number of seconds. Default is 0", type=float, default=0)
+    parser.add_argument('-w', '--wait_time', help="Seconds to wait after every readv", type=float, default=None)
+    parser.add_argument('-i', '--report_interval', help="Print latency percentiles every this number of seconds. Default is 10", type=float, default=10)
+    parser.add_argument('-x', '--trace', help="Write binary traces of all requests, to <trace>.<process number> files. See analyze/trace_log.py", default=None)
+    parser.add_argument('-j', '--latency_json', help="Save latency histograms of the whole run to this json file, see latency.py", default=None)
+    args = parser.parse_args()
+    if args.mode == 'open' and not args.rate:
+        parser.error("--rate is required in open mode")
+    return args
+
+
+def pacer(rate, start, poisson=False, rng=None):
+    "Planned perf_counter_ns() send times for requests sent at the given rate (per second)"
+    rng = np.random.default_rng() if rng is None else rng
+    interval = 1e9 / rate
+    t = start
+    while True:
+        t += rng.exponential(interval) if poisson else interval
+        yield int(t)
+
+
+class Recorder:
+    "Collects records of a stream and sends them to the writer in batches"
+    def __init__(self, out_queue, batch_size=BATCH_SIZE):
+        self.out_queue = out_queue
+        self.batch_size = batch_size
+        self.records = []
+
+    def __call__(self, start_ns, duration_ns, ok, plan):
+        self.records.append( (start_ns, duration_ns, 0 if ok else 1, plan.total_bytes, len(plan), plan.scatter, plan.min_offset) )
+        if len(self.records) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self.records:
+            self.out_queue.put(self.records)
+            self.records = []
+
+
+def copy_file(file_url, block_size, on_request, tracer=None):
+    "Read the whole file sequentially, record it as a single request"
+    with client.File() as f:
+        handle = tracer.handle_id(f) if tracer is not None else 0
+        start = perf_counter_ns()
+        start_ns = time_ns()
+        status, _ = f.open(file_url)
+        if tracer is not None:
+            tracer.record('open', handle, start_ns, perf_counter_ns() - start, status.ok)
+        if not status.ok:
+            raise ValueError(f"Failed to open file {file_url}: {status}")
+        status, stat = f.stat()
+        if not status.ok:
+            raise ValueError(f"Failed to stat file {file_url}: {status}")
+        offsets, lengths = [], []
+        ok = True
+        offset = 0
+        while offset < stat.size:
+            read_start_ns, read_start = time_ns(), perf_counter_ns()
+            status, data = f.read(offset=offset, size=block_size)
+            #data is None if the read failed
+            ok = status.ok and len(data) > 0
+            if tracer is not None:
+                nbytes = len(data) if status.ok else 0
+                tracer.record('read', handle, read_start_ns, perf_counter_ns() - read_start, ok, 1, nbytes, offset, offset + nbytes)
+            if not ok:
+                break
+            offsets.append(offset)
+            lengths.append(len(data))
+            offset += len(data)
+        duration_ns = perf_counter_ns() - start
+    plan = ChunkPlan(offsets, lengths)
+    on_request(start_ns, duration_ns, ok, plan)
+    if tracer is not None:
+        tracer.record_plan('copy', handle, start_ns, duration_ns, ok, plan)
+    return 0 if ok else 1
+
+
+def run_stream(args, idx, nstreams, start_ns, out_queue, results, tracer):
+    delay = start_ns + int(args.ramp_up * 1e9 * idx / nstreams) - time_ns()
+    if delay > 0:
+        sleep(delay / 1e9)
+    recorder = Recorder(out_queue)
+    pace = pacer(args.rate / nstreams, perf_counter_ns(), args.poisson) if args.mode == 'open' else None
+    res = 0
+    try:
+        for _ in range(args.nfiles):
+            url = args.url.replace('{stream}', str(idx + 1)) if args.url else random_line(args.url_list).strip()
+            try:
+                if args.test_type == 'copy':
+                    tres = copy_file(url, args.block_size, recorder, tracer)
+                else:
+                    tres = do_readvs(url, max_len=args.max_len, test_type=args.test_type, silent=args.silent, ntimes=args.ntimes,
+                                     scatter=args.scatter, sorted_chunks=args.chunks_sorted, nchunks=args.chunks_number,
+                                     wait_time=args.wait_time, pacer=pace, on_request=recorder, verbose=False, tracer=tracer)
+            except (ValueError, RuntimeError) as ex:
+                print(f"Stream {idx}: {url} failed: {ex}", file=sys.stderr)
+                tres = 1
+            res = max(res, tres)
+    finally:
+        recorder.flush()
+    results[idx % args.threads] = res
+
+
+def run_worker(args, proc_idx, barrier, out_queue):
+    nstreams = args.processes * args.threads
+    results = [1] * args.threads
+    tracer = None
+    if args.trace:
+        from trace_log import TraceWriter
+        tracer = TraceWriter(f'{args.trace}.{proc_idx}')
+    try:
+        barrier.wait(timeout=START_TIMEOUT)
+        start_ns = time_ns()
+        threads = [Thread(target=run_stream, args=(args, proc_idx * args.threads + i, nstreams, start_ns, out_queue, results, tracer), name=f'stream_{i}') for i in range(args.threads)]
+        for thr in threads:
+            thr.start()
+        for thr in threads:
+            thr.join()
+    finally:
+        if tracer is not None:
+            tracer.close()
+        #Tell the writer that this worker is done
+        out_queue.put(None)
+    sys.exit(max(results))
+
+
+def write_records(fd, records):
+    for start, duration, state, size, nchunks, scatter, buf_start in records:
+        print('{0}.{1:09d},{2}.{3:09d},{4},{5},{6},{7},{8}'.format(*divmod(start, 10**9), *divmod(duration, 10**9), state, size, nchunks, scatter, buf_start), file=fd)
+
+
+def run(args):
+    #XRootD client starts its own threads, which do not survive fork
+    ctx = multiprocessing.get_context('spawn')
+    out_queue = ctx.Queue()
+    barrier = ctx.Barrier(args.processes)
+    procs = [ctx.Process(target=run_worker, args=(args, i, barrier, out_queue), name=f'load_gen_{i}') for i in range(args.processes)]
+    for proc in procs:
+        proc.start()
+
+    op = 'copy' if args.test_type == 'copy' else 'readv'
+    recorder = LatencyRecorder()
+    reporter = Reporter(recorder, interval=args.report_interval, json_path=args.latency_json)
+    nreq, nfailed = 0, 0
+    running = len(procs)
+    with (open(args.output, 'w') if args.output != '-' else nullcontext(sys.stdout)) as fd:
+        while running > 0:
+            try:
+                records = out_queue.get(timeout=1)
+            except queue.Empty:
+                if not any(proc.is_alive() for proc in procs):
+                    break
+                continue
+            if records is None:
+                running -= 1
+                continue
+            if nreq == 0:
+                #Throughput is counted from the first request, not from the process start
+                recorder.start = perf_counter_ns() - (time_ns() - min(rec[0] for rec in records))
+                reporter.total.start = recorder.start
+                reporter.start()
+            write_records(fd, records)
+            for _, duration, state, size, nchunks, _, _ in records:
+                nreq += 1
+                nfailed += state
+                recorder.record(op if state == 0 else op + '_err', nchunks, size, duration)
+
+    res = 0
+    for proc in procs:
+        proc.join()
+        if proc.exitcode != 0:
+            res = 16
+    print(f"Requests: {nreq}, failed: {nfailed}, streams: {args.processes * args.threads}", file=sys.stderr)
+    if nreq:
+        reporter.stop()
+    return res
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    sys.exit(run(args))
@@ -9,11 +9,16 @@ from os import stat
 
 from threading import Thread
 from queue import Queue
-from time import time, sleep
+from time import sleep, time_ns, perf_counter_ns
+
+import numpy as np
 
 from XRootD import client
 from XRootD.client.flags import QueryCode
 
+from chunk_plan import random_plan, border_plan, jobsim_plan
+from latency import LatencyRecorder, Reporter
+
 
 def get_server_limits(url):
     cl = client.FileSystem(url)
@@ -62,65 +67,13 @@ def parse_args():
             default=4000000
         )
     parser.add_argument('-w', '--wait_time', help="Seconds to wait after every readv", type=int, default=None)
+    parser.add_argument('-i', '--report_interval', help="Print latency percentiles every this number of seconds. They are always printed at exit", type=float, default=None)
+    parser.add_argument('-x', '--trace', help="Write binary trace of all requests to this file, see analyze/trace_log.py. It is shipped next to this script in grid jobs, use PYTHONPATH=../analyze otherwise", default=None)
+    parser.add_argument('-j', '--latency_json', help="Save latency histograms to this json file at exit, see latency.py", default=None)
     args = parser.parse_args()
     return args
 
 
-def random_chunks(n, size, scatter, max_len, interval=None):
-    chunks = set()
-    if interval is None:
-        if size > scatter:
-            center = randint(scatter // 2, size - scatter // 2)
-            a, b =center - scatter // 2, center + scatter // 2
-        else:
-            a, b = 0, size - max_len
-            if b < 0:
-                raise ValueError("File size too small: {0} while max chunk len is {1}".format(size, max_len))
-    else:
-        a, b = interval
-    for _ in range(n):
-        chunk_len = randint(1, max_len)
-        offset = randint(a, b)
-        chunks.add( (offset, chunk_len) )
-    return [x for x in chunks]
-
-
-def jobsim_chunks(n, size, scatter, max_len, max_iter, itr):
-    #if hasattr(jobsim_chunks, "iter"):
-    #    jobsim_chunks.iter += 1
-    #else:
-    #    jobsim_chunks.iter = 1
-    if itr > max_iter:
-        itr = 1
-    if scatter + max_len + 1 > size:
-        raise ValueError("File size is too small: {0} while scatter is {1}".format(size, scatter))
-
-    if itr == 1:
-        interval = (0, scatter)
-    elif itr == 2:
-        interval = (size - scatter - max_len - 1, size - 1 - max_len)
-    else:
-        start = int( (size - scatter) * itr / max_iter )
-        interval = ( min(start, size - max_len - 2) , min(start + scatter, size - max_len - 1))
-    return random_chunks(n, None, None, max_len, interval)
-
-
-def border_chunks(n, size, block_size=8*1024*1024):
-    chunks = set()
-    if size < block_size or size < n:
-        raise ValueError("File too small for border test")
-
-    for i in range(1, size // block_size):
-        chunks.add( (i*block_size-1, 2) )
-
-    if size % block_size != 0:
-        chunks.add( ((size // block_size)*block_size-1, 2) )
-
-    while len(chunks) < n:
-        chunks.add( (randint(0, size-1), 1) )
-    return [x for x in chunks]
-
-
 def random_file_from_dump(dump_url):
     def get_lines(f, offset, length):
         status, chunk = f.read(offset=offset, size=length)
@@ -185,49 +138,83 @@ def check_file(dump_url):
     return res
 
 
-def do_readvs(file_url, scatter=128*1024*1024 + 1024*16, ntimes=2, nchunks=1024, max_len=1024, test_type='random', silent=False, sorted_chunks=True, wait_time=None):
+def do_readvs(file_url, scatter=128*1024*1024 + 1024*16, ntimes=2, nchunks=1024, max_len=1024, test_type='random', silent=False, sorted_chunks=True, wait_time=None, pacer=None, on_request=None, verbose=True, tracer=None, cpu_queue=None):
+    """
+    Issue ntimes readvs for file_url.
+    pacer, if given, is an iterator of perf_counter_ns() times at which readvs should be sent (open-loop load).
+    If a readv is sent late, its duration is counted from the planned time, so that slow responses are not hidden.
+    on_request, if given, is called after every readv as on_request(start_ns, duration_ns, ok, plan),
+    with start_ns in nanoseconds since the epoch.
+    tracer, if given, is a TraceWriter that gets open, stat and readv records.
+    cpu_queue, if given, gets an item after every readv, for count_primes to synchronise with.
+    """
     #Dummy sum operation, to do some CPU work and prevent job from stalling
-    global queue
     dummy_sum = 0
     with client.File() as f:
-        f.open(file_url)
+        handle = tracer.handle_id(f) if tracer is not None else 0
+        start_ns, start = time_ns(), perf_counter_ns()
+        status, _ = f.open(file_url)
+        if tracer is not None:
+            tracer.record('open', handle, start_ns, perf_counter_ns() - start, status.ok)
+        start_ns, start = time_ns(), perf_counter_ns()
         status, stat = f.stat()
+        if tracer is not None:
+            tracer.record('stat', handle, start_ns, perf_counter_ns() - start, status.ok)
         res = 0
-        print("Stat status:",  status, file_url, file=sys.stderr)
+        if verbose:
+            print("Stat status:",  status, file_url, file=sys.stderr)
         if not status.ok:
             raise ValueError(f"Failed to stat file {file_url}")
         size = stat.size
         avg_time = 0
+        rng = np.random.default_rng()
         for itr in range(ntimes):
             if test_type == 'random':
-                chunks = random_chunks(nchunks, size, scatter, max_len)
+                plan = random_plan(nchunks, size, scatter, max_len, rng=rng)
             elif test_type == 'border':
-                chunks = border_chunks(nchunks, size)
+                plan = border_plan(nchunks, size, rng=rng)
             elif test_type == 'lhcb_job':
-                chunks = jobsim_chunks(nchunks, size, scatter, max_len, ntimes, itr=itr)
+                plan = jobsim_plan(nchunks, size, scatter, max_len, ntimes, itr=itr, rng=rng)
             else:
                 raise ValueError("Wrong test type: {0}".format(test_type))
 
             if sorted_chunks:
-                chunks = sorted(chunks, key=lambda x: x[0])
-
-            start = time()
-            #sleep(0.6)
+                plan = plan.sorted()
+            chunks = plan.to_list()
+
+            start = perf_counter_ns()
+            if pacer is not None:
+                planned = next(pacer)
+                if planned > start:
+                    sleep( (planned - start) / 1e9 )
+                    start = perf_counter_ns()
+                lag = max(start - planned, 0)
+            else:
+                lag = 0
+            start_ns = time_ns() - lag
             status, response = f.vector_read(chunks=chunks)
-            queue.put_nowait(1)
-            duration =  time() - start
+            if cpu_queue is not None:
+                cpu_queue.put_nowait(1)
+            duration_ns = perf_counter_ns() - start + lag
+            duration = duration_ns / 1e9
             avg_time += duration
+            if on_request is not None:
+                on_request(start_ns, duration_ns, status.ok, plan)
+            if tracer is not None:
+                tracer.record_plan('readv', handle, start_ns, duration_ns, status.ok, plan)
             if not status.ok:
                 print(f"Failed to readv file, status={status}, resp={response}, chunks={chunks if not silent else len(chunks)}")
                 res = 1
-            else:
-                print(f"Readv finished successfully: {status}, min_offset={min(x[0] for x in chunks)}, max_offset={max(x[1] + x[0] for x in chunks)}, lasted {duration} secs", file=sys.stderr)
+            elif verbose:
+                print(f"Readv finished successfully: {status}, min_offset={plan.min_offset}, max_offset={plan.max_end}, lasted {duration} secs", file=sys.stderr)
             if wait_time:
-                print("Sleeping start", file=sys.stderr)
+                if verbose:
+                    print("Sleeping start", file=sys.stderr)
                 sleep(wait_time)
-                print("Sleeping end", file=sys.stderr)
-        print(f"Average readv time: {avg_time / ntimes}")
-    #jobsim_chunks.iter = 0
+                if verbose:
+                    print("Sleeping end", file=sys.stderr)
+        if verbose:
+            print(f"Average readv time: {avg_time / ntimes}")
     return res
 
 def count_primes(n, barrier):
@@ -260,6 +247,12 @@ if __name__ == '__main__':
     if args.add_compute_work:
         thr = Thread(target=count_primes, name="Dummy_cpu", args=[100000000000, args.barrier])
         thr.start()
+    recorder = LatencyRecorder()
+    reporter = Reporter(recorder, interval=args.report_interval, json_path=args.latency_json).start()
+    tracer = None
+    if args.trace:
+        from trace_log import TraceWriter
+        tracer = TraceWriter(args.trace)
     res = 0
     for _ in range(args.nfiles):
         if args.url:
@@ -276,10 +269,13 @@ if __name__ == '__main__':
                     url = None
         if url is None:
             url = args.dump_url
-        tres = do_readvs(url, max_len=8192, test_type=args.test_type, silent=args.silent, ntimes=args.ntimes, scatter=args.scatter, sorted_chunks=args.chunks_sorted, nchunks=args.chunks_number, wait_time=args.wait_time)
+        tres = do_readvs(url, max_len=8192, test_type=args.test_type, silent=args.silent, ntimes=args.ntimes, scatter=args.scatter, sorted_chunks=args.chunks_sorted, nchunks=args.chunks_number, wait_time=args.wait_time, on_request=recorder.hook(), tracer=tracer, cpu_queue=queue if args.add_compute_work else None)
         if tres == 1:
             res = 16
     fin = True
     queue.put_nowait(1)
     thr.join()
+    reporter.stop()
+    if tracer is not None:
+        tracer.close()
     sys.exit(res)
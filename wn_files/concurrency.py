@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Number of open files over time, from parser.py output (lines of '<open ts> <close ts> <fd> <path> ...', byte counters are not used).
+
+Opens and closes are turned into sorted +1/-1 event arrays, their cumulative sum is the open-file count
+after every event time. The count is a step function, so it can be resampled to fixed bins exactly:
+the max of every bin, and the mean weighted by time. Percentiles are weighted by time too.
+
+    ./concurrency.py -g files.txt
+"""
+import sys
+import argparse
+
+import numpy as np
+import pandas
+
+
+#Name of the group when files are not split by VO, and for paths without a VO prefix
+ALL = 'all'
+OTHER = 'other'
+DEF_PERCENTILES = (50, 90, 99)
+
+
+def load_intervals(path, group_by_vo=False):
+    "DataFrame with start, end and vo of every file, '-' is stdin"
+    data = pandas.read_csv(sys.stdin if path == '-' else path, sep=' ', header=None, usecols=[0, 1, 3],
+                           names=['start', 'end', 'path'], dtype={0: np.int64, 1: np.int64, 3: str})
+    if group_by_vo:
+        data['vo'] = data['path'].str.extract(r'^([a-z0-9A-Z]+):', expand=False).fillna(OTHER)
+    else:
+        data['vo'] = ALL
+    return data
+
+
+def open_counts(start, end):
+    "(times, counts): number of open files from every time up to the next one. Files are open in [start, end)"
+    ev_time = np.concatenate( (np.asarray(start), np.asarray(end)) )
+    ev_delta = np.concatenate( (np.ones(len(start), dtype=np.int64), -np.ones(len(end), dtype=np.int64)) )
+    order = np.argsort(ev_time, kind='stable')
+    times = ev_time[order]
+    counts = np.cumsum(ev_delta[order])
+    #Only the count after the last event of the same time
+    last = np.concatenate( (times[1:] != times[:-1], [True]) )
+    return times[last], counts[last]
+
+
+def value_at(times, counts, at):
+    "Count at the given times, 0 before the first event"
+    idx = np.searchsorted(times, at, side='right') - 1
+    return np.where(idx >= 0, counts[np.maximum(idx, 0)], 0)
+
+
+def resample(times, counts, edges):
+    "(max, mean) count in every [edges[i], edges[i+1]) bin"
+    edges = np.asarray(edges)
+    at_start = value_at(times, counts, edges[:-1])
+    #Max: count at the start of the bin and after every event inside it
+    inside = (times >= edges[0]) & (times < edges[-1])
+    bins = np.searchsorted(edges, times[inside], side='right') - 1
+    peak = at_start.copy()
+    np.maximum.at(peak, bins, counts[inside])
+    #Mean: integral of the step function over the bin
+    area = np.concatenate( ([0], np.cumsum(counts[:-1] * np.diff(times))) ).astype(np.float64)
+
+    def integral(t):
+        idx = np.searchsorted(times, t, side='right') - 1
+        ok = idx >= 0
+        res = np.zeros(len(t))
+        res[ok] = area[idx[ok]] + counts[idx[ok]] * (t[ok] - times[idx[ok]])
+        return res
+    mean = np.diff(integral(edges)) / np.diff(edges)
+    return peak, mean
+
+
+def summary(times, counts, percentiles=DEF_PERCENTILES):
+    "Peak count and its first time, time-weighted mean and percentiles of the count between the first and the last event"
+    if len(times) < 2:
+        return {'peak': int(counts.max()) if len(counts) else 0, 'peak_time': int(times[0]) if len(times) else None, 'mean': 0.0}
+    durations = np.diff(times)
+    values = counts[:-1]
+    res = {'peak': int(counts.max()), 'peak_time': int(times[np.argmax(counts)]), 'mean': float((values * durations).sum() / durations.sum())}
+    order = np.argsort(values, kind='stable')
+    cum = np.cumsum(durations[order]) / durations.sum()
+    for q in percentiles:
+        res['p{0}'.format(q)] = int(values[order][min(np.searchsorted(cum, q / 100.0), len(cum) - 1)])
+    return res
+
+
+def concurrency(data, nbins=1000, bin_width=None):
+    """
+    {vo: result} for every vo of load_intervals data, and for all of them together if there are several.
+    result has times, counts (exact step function), edges, peak and mean (per bin), and summary.
+    Bins are the same for all VOs: bin_width seconds, or nbins over the whole time range.
+    """
+    lo, hi = int(data['start'].min()), int(data['end'].max())
+    if bin_width is None:
+        bin_width = max((hi - lo) / nbins, 1)
+    edges = lo + np.arange(int(np.ceil((hi - lo) / bin_width)) + 1) * bin_width
+    if len(edges) < 2:
+        edges = np.array([lo, lo + bin_width])
+    groups = [(vo, part) for vo, part in data.groupby('vo', sort=True)]
+    if len(groups) > 1:
+        groups.append( (ALL, data) )
+    res = {}
+    for vo, part in groups:
+        times, counts = open_counts(part['start'].to_numpy(), part['end'].to_numpy())
+        peak, mean = resample(times, counts, edges)
+        res[vo] = {'times': times, 'counts': counts, 'edges': edges, 'peak': peak, 'mean': mean, 'summary': summary(times, counts)}
+    return res
+
+
+def print_summary(res, fd=sys.stdout):
+    names = ['peak', 'mean'] + ['p{0}'.format(q) for q in DEF_PERCENTILES]
+    print('{0:>12} {1}'.format('vo', ' '.join('{0:>10}'.format(n) for n in names + ['peak time'])), file=fd)
+    for vo, val in res.items():
+        stats = val['summary']
+        peak_time = '-' if stats['peak_time'] is None else stats['peak_time']
+        print('{0:>12} {1} {2:>10}'.format(vo, ' '.join('{0:>10.1f}'.format(stats.get(n, 0)) for n in names), peak_time), file=fd)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('file', help="parser.py output, '-' for stdin")
+    parser.add_argument('-g', '--group_by_vo', help='Report each vo separately', action='store_true')
+    parser.add_argument('-b', '--bin', help='Also print per-bin max and mean counts for bins of this width, seconds', type=float, default=None)
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    res = concurrency(load_intervals(args.file, args.group_by_vo), bin_width=args.bin)
+    print_summary(res)
+    if args.bin:
+        for vo, val in res.items():
+            for start, peak, mean in zip(val['edges'][:-1], val['peak'], val['mean']):
+                print(vo, int(start), peak, '{0:.2f}'.format(mean))
@@ -1,18 +1,45 @@
 #!/usr/bin/env python3
+"""
+Open and close times of files from gateway logs, one line per file: '<open ts> <close ts> <fd> <path> <read_B> <readV_B> <readAIO_B>'.
 
+Lines are prefiltered by literal substrings, the regexes are matched from their position. A record is printed
+as soon as the Summary line of the file is seen, opens without it are dropped after --max_age seconds (of log time)
+or when there are more than --max_open of them. Timestamps are parsed with a strptime format learned from
+the first ones, dateutil is only used for timestamps no known format matches.
+
+    zcat xrootd.log-*.gz | ./parser.py - > files.txt
+"""
 import re
 import sys
-import pytz
 import argparse
 import datetime
 
+from collections import OrderedDict
 from contextlib import contextmanager
 from dateutil import parser as time_parser
 
+
+OPEN_MARK = 'opened in read mode'
+CLOSE_MARK = 'XrdCephOssBufferedFile::Summary'
+#Matched at the position of the host name, found from the marks
+HOST_RE = re.compile(' lcg[0-9]+')
+OPEN_RE = re.compile(r'.*File descriptor ([0-9]+) associated to file ([^ ]+) opened in read mode$')
+CLOSE_RE = re.compile(r'.*XrdCephOssBufferedFile::Summary: \{"fd":(?P<fd>[0-9]+), "Elapsed_time_ms":(?P<elapsed_time>[0-9]+), "path":"(?P<path>[^"]+)", read_B:(?P<read_b>[0-9]+), readV_B:(?P<readv_b>[0-9]+), readAIO_B:(?P<readaio_b>[0-9]+), writeB:(?P<write_b>[0-9]+), writeAIO_B:(?P<writeaio_b>[0-9]+)')
+TIME_FORMATS = ['%Y-%m-%d %H:%M:%S.%f %z', '%Y-%m-%d %H:%M:%S %z', '%Y-%m-%d %H:%M:%S.%f', '%Y-%m-%d %H:%M:%S',
+                '%Y-%m-%dT%H:%M:%S.%f%z', '%Y-%m-%dT%H:%M:%S%z', '%Y-%m-%dT%H:%M:%S.%f', '%Y-%m-%dT%H:%M:%S',
+                '%y%m%d %H:%M:%S']
+#Fractions of seconds, times are whole seconds
+FRACTION_RE = re.compile(r'(:[0-9]{2})\.[0-9]+')
+DEF_MAX_OPEN = 1000000
+DEF_MAX_AGE = 7 * 86400
+
+
 def parse_args():
     parser = argparse.ArgumentParser()
     parser.add_argument('file', help='file to parse')
     parser.add_argument('-t', '--tz', help='Specify timezone for times. Only use this if timezone info is not given in the log', default=None)
+    parser.add_argument('--max_open', help='Max number of open files without Summary. Older ones are dropped. Default is {0}'.format(DEF_MAX_OPEN), default=DEF_MAX_OPEN, type=int)
+    parser.add_argument('--max_age', help='Open files without Summary for this number of seconds (of log time) are dropped. Default is {0}'.format(DEF_MAX_AGE), default=DEF_MAX_AGE, type=int)
     return parser.parse_args()
 
 
@@ -21,50 +48,107 @@ def open_stdin(_):
     yield sys.stdin
 
 
-def parse_time(s, tz=False):
+def parse_time(s, tz=None):
     t = time_parser.parse(  s + ( (' ' + tz) if tz is not None else '' )  )
     return int( t.timestamp() )
 
 
-if __name__ == '__main__':
-    args = parse_args()
-    if args.file == '-':
-        cm = open_stdin
-    else:
-        cm = open
+class TimeParser:
+    """
+    parse_time with cached formats: the first strptime format that parses a timestamp to the same time
+    as dateutil is used for the following ones. Epoch seconds are cached for the last second of timestamps.
+    """
+    def __init__(self, tz=None):
+        self.tz = tz
+        self.tzinfo = time_parser.parse('2000-01-01 00:00:00 ' + tz).tzinfo if tz is not None else None
+        self.formats = []
+        self.last = (None, None)
 
-    ts_parser = lambda x: parse_time(x, args.tz)
-    found = {}
-    times = []
-    f_open_rexp = re.compile('^(.*) lcg[0-9]+.*File descriptor ([0-9]+) associated to file ([^ ]+) opened in read mode$')
-    f_close_rexp = re.compile('^(?P<TS>.*) lcg[0-9]+.*XrdCephOssBufferedFile::Summary: \{"fd":(?P<fd>[0-9]+), "Elapsed_time_ms":(?P<elapsed_time>[0-9]+), "path":"(?P<path>[^"]+)", read_B:(?P<read_b>[0-9]+), readV_B:(?P<readv_b>[0-9]+), readAIO_B:(?P<readaio_b>[0-9]+), writeB:(?P<write_b>[0-9]+), writeAIO_B:(?P<writeaio_b>[0-9]+).*')
-    with cm(args.file) as fd:
-        for line in fd:
-            m = f_open_rexp.match(line)
+    def strptime(self, s, fmt):
+        t = datetime.datetime.strptime(s, fmt)
+        if t.tzinfo is None and self.tzinfo is not None:
+            t = t.replace(tzinfo=self.tzinfo)
+        return int(t.timestamp())
+
+    def __call__(self, s):
+        s = FRACTION_RE.sub(r'\1', s, count=1)
+        if s == self.last[0]:
+            return self.last[1]
+        res = None
+        for fmt in self.formats:
+            try:
+                res = self.strptime(s, fmt)
+                break
+            except ValueError:
+                pass
+        if res is None:
+            res = parse_time(s, self.tz)
+            for fmt in TIME_FORMATS:
+                if fmt in self.formats:
+                    continue
+                try:
+                    if self.strptime(s, fmt) == res:
+                        self.formats.append(fmt)
+                        break
+                except ValueError:
+                    pass
+        self.last = (s, res)
+        return res
+
+
+def parse(lines, on_record, ts_parser=parse_time, max_open=DEF_MAX_OPEN, max_age=DEF_MAX_AGE):
+    """
+    Call on_record((start, end, fd, path, read_b, readv_b, readaio_b)) for every Summary line with its open time.
+    Returns number of opens that were dropped or had no Summary till the end of lines.
+    """
+    found = OrderedDict()
+    dropped = 0
+    for line in lines:
+        pos = line.find(OPEN_MARK)
+        if pos >= 0:
+            host = HOST_RE.search(line, 0, pos)
+            m = OPEN_RE.match(line, host.end()) if host else None
             if m:
-                ts, fd, path = ts_parser(m.group(1)), int(m.group(2)), m.group(3)
+                ts, fd, path = ts_parser(line[:host.start()]), int(m.group(1)), m.group(2)
                 if (fd, path) in found:
                     raise ValueError("File {0} (fd {1}) was found twice".format(path, fd))
                 found[(fd, path)] = ts
+                #Opens come in time order, so the oldest one is first
+                while found:
+                    key, start = next(iter(found.items()))
+                    if len(found) <= max_open and start >= ts - max_age:
+                        break
+                    print("Summary for file {0} (fd {1}) not found in {2} seconds, dropped".format(key[1], key[0], ts - start), file=sys.stderr)
+                    del found[key]
+                    dropped += 1
+            continue
 
-            m = f_close_rexp.match(line)
+        pos = line.find(CLOSE_MARK)
+        if pos >= 0:
+            host = HOST_RE.search(line, 0, pos)
+            m = CLOSE_RE.match(line, host.end()) if host else None
             if m:
-                ts, fd, path = ts_parser(m.group('TS')), int(m.group('fd')), m.group('path')
-                read_b, readv_b, readaio_b, write_b, writeaio_b = [int(m.group(x)) for x in ('read_b', 'readv_b', 'readaio_b', 'write_b', 'writeaio_b')]
-                elapsed_time = int(m.group('elapsed_time'))
-                try:
-                    start = found[(fd, path)]
-                except KeyError:
+                ts, fd, path = ts_parser(line[:host.start()]), int(m.group('fd')), m.group('path')
+                read_b, readv_b, readaio_b = [int(m.group(x)) for x in ('read_b', 'readv_b', 'readaio_b')]
+                start = found.pop((fd, path), None)
+                if start is None:
                     if read_b == 0 and readv_b == 0 and readaio_b == 0:
                         print("Open log message for file {0} (fd {1}) not found, though it looks like it is a write".format(path, fd), file=sys.stderr)
-                    else:
-                        print("Warning, open log message for file {0} (fd {1}) not found, will calculate ts from close message".format(path, fd), file=sys.stderr)
-                        start = ts - elapsed_time // 1000
-                times.append( (start, ts, fd, path) )
-                try:
-                    found.pop( (fd, path) )
-                except KeyError:
-                    pass
+                        continue
+                    print("Warning, open log message for file {0} (fd {1}) not found, will calculate ts from close message".format(path, fd), file=sys.stderr)
+                    start = ts - int(m.group('elapsed_time')) // 1000
+                on_record( (start, ts, fd, path, read_b, readv_b, readaio_b) )
+    return dropped + len(found)
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    if args.file == '-':
+        cm = open_stdin
+    else:
+        cm = open
 
-    for start, end, fd, path in times:
-        print(start, end, fd, path)
+    with cm(args.file) as fd:
+        left = parse(fd, lambda rec: print(*rec), TimeParser(args.tz), args.max_open, args.max_age)
+    if left:
+        print("{0} opened files without Summary".format(left), file=sys.stderr)
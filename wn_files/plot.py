@@ -1,12 +1,19 @@
 #!/usr/bin/env python3
-import re
-import sys
 import argparse
 
-from parser import open_stdin
+import numpy as np
+
 from matplotlib import pyplot as plt
+from matplotlib.collections import LineCollection
+from matplotlib.colors import to_rgb
 from time import strftime, localtime
 
+from concurrency import load_intervals, concurrency, print_summary
+
+
+#Opacity of pixels covered by a single interval in raster plots
+MIN_ALPHA = 0.25
+
 
 def parse_args():
     parser = argparse.ArgumentParser()
@@ -17,73 +24,92 @@ def parse_args():
     parser.add_argument('-H', '--height', help='Picture`s height', type=int, default=None)
     parser.add_argument('-w', '--width', help='Picture`s width', type=int, default=None)
     parser.add_argument('-t', '--title', help='Picture`s title', default=None)
+    parser.add_argument('-b', '--bins', help='Number of time bins for count plots. Default is 2000', type=int, default=2000)
+    parser.add_argument('-m', '--mean', help='Plot mean count of every bin instead of max', action='store_true')
+    parser.add_argument('-l', '--max_lines', help='Simple plots with more files are drawn as an image of -W x -R pixels. Default is 20000', type=int, default=20000)
+    parser.add_argument('-W', '--raster_width', help='Image width, pixels. Default is 2000', type=int, default=2000)
+    parser.add_argument('-R', '--raster_height', help='Image height, pixels. Default is 2000', type=int, default=2000)
     return parser.parse_args()
 
 
+def raster(rows, start, end, x_range, y_range, width, height):
+    "Number of [start, end] intervals at rows that cover every pixel of a width x height image"
+    def scale(values, vrange, npix):
+        lo, hi = vrange
+        if hi <= lo:
+            return np.zeros(len(values), dtype=np.int64)
+        return np.clip( ((np.asarray(values, dtype=np.float64) - lo) * (npix / (hi - lo))).astype(np.int64), 0, npix - 1 )
+
+    #Difference array along x: +1 at the first pixel of an interval, -1 after the last one
+    diff = np.zeros( (height, width + 1), dtype=np.int64 )
+    y = scale(rows, y_range, height)
+    first = scale(start, x_range, width)
+    last = np.maximum(scale(end, x_range, width), first)
+    np.add.at(diff, (y, first), 1)
+    np.add.at(diff, (y, last + 1), -1)
+    return np.cumsum(diff, axis=1)[:, :width]
+
+
+def shade(layers, colors):
+    "RGB image: every layer is painted over white with its colour, opacity grows with log of the count"
+    img = np.ones(layers[0].shape + (3,))
+    for layer, color in zip(layers, colors):
+        top = layer.max()
+        if top <= 0:
+            continue
+        alpha = np.where(layer > 0, MIN_ALPHA + (1 - MIN_ALPHA) * np.log1p(layer) / np.log1p(top), 0)[..., None]
+        img = img * (1 - alpha) + np.array(to_rgb(color)) * alpha
+    return img
+
+
 if __name__ == '__main__':
     args = parse_args()
-    if args.file == '-':
-        cm = open_stdin
-    else:
-        cm = open
-
-    res = {}
-    with cm(args.file) as fd:
-        for line in fd:
-            ts1, ts2, fd, path = line.strip().split(' ')
-            if args.group_by_vo:
-                m = re.match('^([a-z0-9A-Z]+):.*', path)
-                vo = m.group(1)
-            else:
-                vo = 'all'
-            ts1, ts2 = (int(x) for x in (ts1, ts2))
-            if vo in res:
-                res[vo].append( (ts1, ts2) )
-            else:
-                res[vo] = [(ts1, ts2)]
+    data = load_intervals(args.file, args.group_by_vo)
 
     fig = plt.figure()
     if args.width:
         fig.set_figwidth(args.width)
     if args.height:
         fig.set_figheight(args.height)
+    ax = fig.gca()
 
     if args.plot_type == 'simple':
-        plt.figure().set_figheight(15)
-        idx = 0
-        keys = [x for x in res.keys()]
-        for k in keys:
-            for start, end in res[k]:
-                plt.plot( [start, end], [idx, idx], '-b')
-                idx += 1
+        if not args.height:
+            fig.set_figheight(15)
+        #A row per file, a colour per vo
+        data = data.sort_values('vo', kind='stable')
+        rows = np.arange(len(data))
+        vos = sorted(data['vo'].unique())
+        colors = plt.rcParams['axes.prop_cycle'].by_key()['color'] if len(vos) > 1 else ['b']
+        x_range = (data['start'].min(), data['end'].max())
+        if len(data) <= args.max_lines:
+            #All intervals in one collection
+            segments = np.stack( (np.column_stack((data['start'], rows)), np.column_stack((data['end'], rows))), axis=1 )
+            vo_color = {vo: colors[i % len(colors)] for i, vo in enumerate(vos)}
+            ax.add_collection(LineCollection(segments, colors=[vo_color[vo] for vo in data['vo']], linewidths=0.5))
+        else:
+            #Too many lines to draw: count intervals that cover every pixel
+            layers = []
+            for vo in vos:
+                part = (data['vo'] == vo).to_numpy()
+                layers.append(raster(rows[part], data['start'].to_numpy()[part], data['end'].to_numpy()[part], x_range, (0, len(data)),
+                                     args.raster_width, args.raster_height))
+            ax.imshow(shade(layers, [colors[i % len(colors)] for i in range(len(vos))]), origin='lower', aspect='auto',
+                      extent=(x_range[0], x_range[1], 0, len(data)), interpolation='nearest')
+        ax.set_xlim(*x_range)
+        ax.set_ylim(-1, len(data))
     else:
-        #res = [(2, 3), (1, 4), (1, 10), (2, 12)]
-        Min, Max = 10**10, -1
-        keys = [x for x in res.keys()]
-        for k in keys:
-            x_vals = []
-            y_vals = []
-            data = {}
-            arr = [(x[0], 's') for x in res[k]] + [(x[1], 'e') for x in res[k]]
-            arr.sort(key=lambda x: x[0])
-            o_files = 0
-            for val, typ in arr:
-                if typ == 's':
-                    o_files += 1
-                elif typ == 'e':
-                    o_files -= 1
-                if x_vals and x_vals[-1] == val:
-                    y_vals[-1] = o_files
-                else:
-                    x_vals.append(val)
-                    y_vals.append(o_files)
-            plt.step(x_vals, y_vals, where="post")
-            Min = min(x_vals[0], Min)
-            Max = max(x_vals[-1], Max)
-        plt.legend(keys)
-        plt.ylabel('nofiles')
-        plt.ylim(bottom=0)
-        plt.xlim(Min, Max)
+        res = concurrency(data, nbins=args.bins)
+        print_summary(res)
+        for vo, val in res.items():
+            values = val['mean'] if args.mean else val['peak']
+            #Repeat the last value, so that the last bin is drawn
+            ax.step(val['edges'], np.append(values, values[-1]), where='post')
+        ax.legend(list(res.keys()))
+        ax.set_ylabel('nofiles')
+        ax.set_ylim(bottom=0)
+        edges = next(iter(res.values()))['edges']
+        ax.set_xlim(edges[0], edges[-1])
     if args.title:
         plt.title(args.title)
     xticks = plt.xticks()